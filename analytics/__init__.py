@@ -0,0 +1,162 @@
+"""
+Columnar analytics over clock history.
+
+For reports over years of data, building one Clocktime object per row is
+the bottleneck. ClockHistory instead pulls the few columns such reports
+need straight from the DBAPI cursor into NumPy arrays, with times as
+epoch seconds and ids as integers, and does the grouping with vectorized
+searchsorted/bincount.
+
+NumPy is optional: importing this module works without it, but loading
+history raises ImportError.
+
+Times are naive local timestamps, like everywhere else in the database.
+They are converted to epoch seconds as if they were UTC, and period edges
+are computed the same way, so the two always line up.
+"""
+
+import calendar
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['ClockHistory', 'period_edges', 'to_epoch']
+
+HISTORY_SQL = """
+SELECT CAST(strftime('%s', time_in) AS INTEGER),
+       CAST(coalesce(strftime('%s', time_out), strftime('%s', time_in))
+            AS INTEGER),
+       tenths,
+       coalesce(job_id, 0),
+       coalesce(employee_id, 0)
+FROM clocktimes
+WHERE tenths IS NOT NULL"""
+
+
+def to_epoch(moment):
+    """Epoch seconds of a naive datetime or date, taken as UTC."""
+    if not isinstance(moment, datetime):
+        moment = datetime(moment.year, moment.month, moment.day)
+    return calendar.timegm(moment.timetuple())
+
+
+def period_edges(start, end, unit='month'):
+    """Epoch-second edges of the days, ISO weeks or months in [start, end]
+
+    Returns an array of n + 1 edges for n periods: the first edge is the
+    start of the period containing start, the last the end of the period
+    containing end.
+    """
+    if unit == 'day':
+        first = date(start.year, start.month, start.day)
+        step = lambda d: d + timedelta(days=1)
+    elif unit == 'week':
+        first = date(start.year, start.month, start.day)
+        first -= timedelta(days=first.weekday())
+        step = lambda d: d + timedelta(days=7)
+    elif unit == 'month':
+        first = date(start.year, start.month, 1)
+        step = lambda d: date(d.year + d.month // 12, d.month % 12 + 1, 1)
+    else:
+        raise ValueError("unit must be 'day', 'week' or 'month'")
+
+    edges = [first]
+    last = date(end.year, end.month, end.day)
+    while edges[-1] <= last:
+        edges.append(step(edges[-1]))
+    return np.array([to_epoch(d) for d in edges], dtype=np.int64)
+
+
+class ClockHistory(object):
+    """Closed clocktimes as parallel NumPy arrays
+
+    time_in, time_out: int64 epoch seconds
+    tenths: int64 tenths of an hour worked
+    job_id, employee_id: int64, 0 where unset
+    """
+
+    def __init__(self, time_in, time_out, tenths, job_id, employee_id):
+        self.time_in = time_in
+        self.time_out = time_out
+        self.tenths = tenths
+        self.job_id = job_id
+        self.employee_id = employee_id
+
+    def __len__(self):
+        return len(self.time_in)
+
+    @classmethod
+    def load(cls, bind, start=None, end=None, batch=65536):
+        """Read closed clocktimes with start <= time_in < end
+
+        bind is a SQLAlchemy connection or session on the timesheet
+        database. Rows are fetched batch at a time from the raw
+        DBAPI cursor, so no ORM objects or row tuples pile up.
+        """
+        if np is None:
+            raise ImportError("Clock history analytics need NumPy")
+        sql, params = HISTORY_SQL, []
+
+        if start is not None:
+            sql += " AND time_in >= ?"
+            params.append(start.strftime('%Y-%m-%d %H:%M:%S'))
+        if end is not None:
+            sql += " AND time_in < ?"
+            params.append(end.strftime('%Y-%m-%d %H:%M:%S'))
+
+        conn = bind.connection() if isinstance(bind, Session) else bind
+        cursor = conn.connection.cursor()
+        chunks = []
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.int64))
+        finally:
+            cursor.close()
+
+        table = np.concatenate(chunks) if chunks \
+            else np.empty((0, 5), dtype=np.int64)
+        return cls(*table.T)
+
+    def hours_by(self, edges, key='job_id'):
+        """Hours worked per key per period
+
+        edges comes from period_edges(). Slices are placed in the period
+        their time_in falls in; slices outside the edges are ignored.
+        Returns (keys, totals): the sorted distinct ids, and a
+        len(keys) x (len(edges) - 1) array of hours.
+        """
+        periods = len(edges) - 1
+        period = np.searchsorted(edges, self.time_in, side='right') - 1
+        inside = (period >= 0) & (period < periods)
+        keys, row = np.unique(getattr(self, key)[inside], return_inverse=True)
+        flat = row.ravel() * periods + period[inside]
+        # Integer tenths add up exactly, even as float64 weights.
+        totals = np.bincount(flat, weights=self.tenths[inside],
+                             minlength=len(keys) * periods)
+        return keys, totals.reshape(len(keys), periods) / 10
+
+    def utilization(self, edges, capacity):
+        """Fraction of capacity hours worked in each period, all keys."""
+        _, totals = self.hours_by(edges, key='employee_id')
+        return totals.sum(axis=0) / float(capacity)
+
+    @staticmethod
+    def trend(totals):
+        """Least-squares slope, in hours per period, of each row of totals"""
+        x = np.arange(totals.shape[1], dtype=np.float64)
+        x -= x.mean()
+        denominator = (x * x).sum()
+
+        if denominator == 0:
+            return np.zeros(totals.shape[0])
+        centred = totals - totals.mean(axis=1, keepdims=True)
+        return centred.dot(x) / denominator
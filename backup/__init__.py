@@ -0,0 +1,508 @@
+"""
+Deduplicated backups of the timesheet database.
+
+A snapshot is taken with SQLite's online backup API, so it is consistent
+even while another connection is writing. The snapshot is then split into
+database pages and every page is stored once under .backup/chunks, named
+by its SHA-1. A snapshot file only lists the page hashes in order, which
+means snapshots share all unchanged pages and a new backup only costs the
+pages that changed since the last one.
+
+Every snapshot is also recorded in .backup/manifest.jsonl with its reason,
+time, size and checksum. The store keeps that index in memory, sorted by
+time, so listing, pruning and picking a snapshot to recover never have to
+scan the backup directory.
+
+Pages can be stored through a stdlib compressor (gzip or lzma). Each page
+is compressed and decompressed on its own, so neither a backup nor a
+restore ever holds more than one page of the database in memory.
+
+BackupWorker takes those snapshots on a background thread so clock events
+never wait on the disk.
+"""
+
+import atexit
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+from queue import Queue, Full, Empty
+
+__all__ = ['BackupStore', 'BackupWorker', 'RetentionPolicy', 'BACKUP_DIR',
+           'replace_database']
+
+BACKUP_DIR = '.backup'
+CHUNK_DIR = 'chunks'
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_EXT = '.snap'
+SNAPSHOT_MAGIC = 'pyper-snapshot 1'
+MANIFEST = 'manifest.jsonl'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# compression name -> (chunk file extension, opener)
+CODECS = {
+    None: ('', open),
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open),
+}
+OPENERS = dict(CODECS.values())  # chunk file extension -> opener
+
+
+def _write_atomic(path, data):
+    """Write bytes to path through a temp file so readers never see half."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def replace_database(new_path, db_path):
+    """Move new_path over db_path, dropping db_path's WAL and journal
+
+    All connections to db_path must be closed first. A WAL left behind by
+    the old file would otherwise be replayed into the new one.
+    """
+    for suffix in ('-wal', '-shm', '-journal'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(new_path, db_path)
+
+
+class RetentionPolicy(object):
+    """Grandfather-father-son retention
+
+    Keeps the newest snapshot of each of the last `hourly` hours, `daily`
+    days and `weekly` ISO weeks, plus the `last` newest snapshots whatever
+    their age.
+    """
+
+    def __init__(self, hourly=24, daily=7, weekly=4, last=5):
+        self.hourly = hourly
+        self.daily = daily
+        self.weekly = weekly
+        self.last = last
+
+    def keep(self, entries):
+        """Return the names from entries (oldest first) to keep"""
+        tiers = [
+            (self.hourly, lambda t: t.strftime('%Y-%m-%d %H')),
+            (self.daily, lambda t: t.date()),
+            (self.weekly, lambda t: t.isocalendar()[:2])]
+        seen = [set() for _ in tiers]
+        kept = set(e['name'] for e in entries[-self.last:]) \
+            if self.last else set()
+
+        for entry in reversed(entries):
+            when = datetime.strptime(entry['time'], TIME_FORMAT)
+
+            for (limit, bucket_of), buckets in zip(tiers, seen):
+                bucket = bucket_of(when)
+
+                if bucket not in buckets and len(buckets) < limit:
+                    buckets.add(bucket)
+                    kept.add(entry['name'])
+        return kept
+
+
+class BackupStore(object):
+    """Content-addressed store of database snapshots
+
+    store = BackupStore('.backup')
+    name = store.snapshot('.timesheet.db', 'clockin_FOO')
+    store.restore(name, '.timesheet.db')
+    """
+
+    def __init__(self, root=BACKUP_DIR, compression=None):
+        if compression not in CODECS:
+            raise ValueError("Unknown compression {}".format(compression))
+        self.root = root
+        self.compression = compression
+        self.chunk_dir = os.path.join(root, CHUNK_DIR)
+        self.snapshot_dir = os.path.join(root, SNAPSHOT_DIR)
+        self.manifest_path = os.path.join(root, MANIFEST)
+        self._known = None  # digest -> (extension, bytes) of stored chunks
+        self._entries = None  # manifest records, oldest first
+        self._times = None  # entry times, parallel to _entries for bisect
+        # Held while chunks are written or collected, so collect() never
+        # deletes a page a snapshot in progress is about to reference.
+        self._lock = threading.RLock()
+
+    def _ensure_dirs(self):
+        for path in (self.chunk_dir, self.snapshot_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def _chunk_path(self, digest, ext=None):
+        if ext is None:
+            ext = self._known_chunks()[digest][0]
+        return os.path.join(self.chunk_dir, digest[:2], digest + ext)
+
+    def _snapshot_path(self, name):
+        return os.path.join(self.snapshot_dir, name + SNAPSHOT_EXT)
+
+    def _known_chunks(self):
+        """Stored chunks, read from disk once per store."""
+        if self._known is None:
+            self._known = {}
+            for dirpath, _, filenames in os.walk(self.chunk_dir):
+                for filename in filenames:
+                    if filename.endswith('.tmp'):
+                        continue
+                    digest, ext = os.path.splitext(filename)
+                    size = os.path.getsize(os.path.join(dirpath, filename))
+                    self._known[digest] = (ext, size)
+        return self._known
+
+    def _write_chunk(self, digest, page):
+        """Store one page with the store's compression, return bytes used"""
+        ext, opener = CODECS[self.compression]
+        path = self._chunk_path(digest, ext)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        with opener(path + '.tmp', 'wb') as f:
+            f.write(page)
+        os.replace(path + '.tmp', path)
+        size = os.path.getsize(path)
+        self._known[digest] = (ext, size)
+        return size
+
+    def _read_chunk(self, digest):
+        ext = self._known_chunks()[digest][0]
+        with OPENERS[ext](self._chunk_path(digest, ext), 'rb') as f:
+            return f.read()
+
+    def _manifest(self):
+        """The manifest entries, loaded from disk once per store."""
+        if self._entries is None:
+            by_name = {}
+
+            if os.path.isfile(self.manifest_path):
+                with open(self.manifest_path) as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            by_name[entry['name']] = entry
+
+            elif os.path.isdir(self.snapshot_dir):
+                by_name = self._rebuild_manifest()
+            self._entries = sorted(by_name.values(),
+                                   key=lambda e: (e['time'], e['name']))
+            self._times = [e['time'] for e in self._entries]
+        return self._entries
+
+    def _rebuild_manifest(self):
+        """Index snapshots written before the manifest existed"""
+        by_name = {}
+
+        for filename in os.listdir(self.snapshot_dir):
+            if not filename.endswith(SNAPSHOT_EXT):
+                continue
+            name = filename[:-len(SNAPSHOT_EXT)]
+            page_size, digests = self.read_snapshot(name)
+            when = datetime.strptime(name[-15:], '%Y%m%d-%H%M%S')
+            by_name[name] = {'name': name, 'reason': None,
+                             'time': when.strftime(TIME_FORMAT),
+                             'size': page_size * len(digests),
+                             'checksum': None}
+        self._write_manifest(by_name.values())
+        return by_name
+
+    def _write_manifest(self, entries):
+        data = ''.join(json.dumps(e, sort_keys=True) + '\n' for e in entries)
+        _write_atomic(self.manifest_path, data.encode('ascii'))
+
+    def _record(self, entry):
+        """Append an entry to the manifest, on disk and in memory."""
+        entries = self._manifest()
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+        # Two snapshots for the same reason in one second share a name.
+        i = bisect.bisect_left(self._times, entry['time'])
+        while i < len(entries) and self._times[i] == entry['time']:
+            if entries[i]['name'] == entry['name']:
+                del entries[i]
+                del self._times[i]
+            else:
+                i += 1
+
+        i = bisect.bisect_right(self._times, entry['time'])
+        entries.insert(i, entry)
+        self._times.insert(i, entry['time'])
+
+    def snapshot(self, db_path, reason, when=None):
+        """Back up db_path and return the new snapshot's name
+
+        Only pages that are not already in the store are written.
+        """
+        with self._lock:
+            return self._snapshot(db_path, reason, when)
+
+    def _snapshot(self, db_path, reason, when):
+        self._ensure_dirs()
+        self._manifest()
+        when = when or datetime.now()
+        name = '{db}_{reason}{stamp}'.format(
+            db=os.path.basename(db_path),
+            reason=reason,
+            stamp=when.strftime('-%Y%m%d-%H%M%S'))
+
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        os.close(fd)
+        try:
+            page_size = self._online_backup(db_path, tmp)
+            known = self._known_chunks()
+            checksum = hashlib.sha1()
+            digests = []
+            stored = 0
+
+            with open(tmp, 'rb') as f:
+                for page in iter(lambda: f.read(page_size), b''):
+                    digest = hashlib.sha1(page).hexdigest()
+                    checksum.update(page)
+
+                    if digest not in known:
+                        stored += self._write_chunk(digest, page)
+                    digests.append(digest)
+        finally:
+            os.remove(tmp)
+
+        lines = [SNAPSHOT_MAGIC,
+                 'page_size {}'.format(page_size),
+                 'pages {}'.format(len(digests))] + digests
+        _write_atomic(self._snapshot_path(name),
+                      ('\n'.join(lines) + '\n').encode('ascii'))
+        self._record({'name': name,
+                      'reason': reason,
+                      'time': when.strftime(TIME_FORMAT),
+                      'size': page_size * len(digests),
+                      'stored': stored,
+                      'compression': self.compression,
+                      'checksum': checksum.hexdigest()})
+        return name
+
+    @staticmethod
+    def _online_backup(db_path, dest):
+        """Copy db_path to dest with the SQLite backup API, return page size"""
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(dest)
+        try:
+            # The copy is thrown away after chunking, don't pay for fsyncs.
+            dst.execute('PRAGMA synchronous=OFF')
+            dst.execute('PRAGMA journal_mode=OFF')
+            src.backup(dst)
+            return dst.execute('PRAGMA page_size').fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+
+    def read_snapshot(self, name):
+        """Return (page_size, [digests]) for a snapshot."""
+        with open(self._snapshot_path(name)) as f:
+            lines = f.read().splitlines()
+
+        if not lines or lines[0] != SNAPSHOT_MAGIC:
+            raise ValueError("{} is not a snapshot file".format(name))
+        header = dict(line.split(' ', 1) for line in lines[1:3])
+        digests = lines[3:]
+
+        if len(digests) != int(header['pages']):
+            raise ValueError("Snapshot {} is truncated".format(name))
+        return int(header['page_size']), digests
+
+    def restore(self, name, dest_path):
+        """Rebuild the complete database file for snapshot name at dest_path
+
+        Raises ValueError, leaving dest_path alone, if the rebuilt file does
+        not match the checksum recorded when the snapshot was taken.
+        """
+        _, digests = self.read_snapshot(name)
+        expected = self.entry(name).get('checksum')
+        checksum = hashlib.sha1()
+        tmp = dest_path + '.restore'
+
+        with open(tmp, 'wb') as out:
+            for digest in digests:
+                page = self._read_chunk(digest)
+                checksum.update(page)
+                out.write(page)
+
+        if expected and checksum.hexdigest() != expected:
+            os.remove(tmp)
+            raise ValueError("Snapshot {} failed its checksum".format(name))
+        replace_database(tmp, dest_path)
+
+    def entries(self):
+        """Manifest entries for all snapshots, oldest first."""
+        return list(self._manifest())
+
+    def snapshots(self):
+        """Names of all snapshots, oldest first."""
+        return [e['name'] for e in self._manifest()]
+
+    def entry(self, name):
+        """Manifest entry for the snapshot called name."""
+        entries = self._manifest()
+        when = datetime.strptime(name[-15:], '%Y%m%d-%H%M%S')
+        stamp = when.strftime(TIME_FORMAT)
+        i = bisect.bisect_left(self._times, stamp)
+
+        while i < len(entries) and self._times[i] == stamp:
+            if entries[i]['name'] == name:
+                return entries[i]
+            i += 1
+        raise KeyError(name)
+
+    def latest(self, before=None):
+        """Newest entry taken at or before `before` (default: newest)
+
+        Returns None if there is no such snapshot.
+        """
+        entries = self._manifest()
+
+        if before is None:
+            i = len(entries)
+        else:
+            i = bisect.bisect_right(self._times, before.strftime(TIME_FORMAT))
+        return entries[i - 1] if i else None
+
+    def remove(self, name):
+        """Delete a snapshot. Its chunks go away on the next collect()."""
+        with self._lock:
+            self._remove([name])
+
+    def _remove(self, names):
+        names = set(names)
+        for name in names:
+            os.remove(self._snapshot_path(name))
+        keep = [e for e in self._manifest() if e['name'] not in names]
+        self._write_manifest(keep)
+        self._entries = keep
+        self._times = [e['time'] for e in keep]
+
+    def prune(self, policy=None):
+        """Drop snapshots the retention policy doesn't keep
+
+        Pages only they used are collected. Returns the removed entries
+        and the number of bytes freed on disk.
+        """
+        policy = policy or RetentionPolicy()
+        with self._lock:
+            entries = self._manifest()
+            kept = policy.keep(entries)
+            removed = [e for e in entries if e['name'] not in kept]
+            freed = 0
+
+            if removed:
+                self._remove([e['name'] for e in removed])
+                freed = self._collect()
+            return removed, freed
+
+    def collect(self):
+        """Delete chunks no snapshot refers to, return the bytes freed."""
+        with self._lock:
+            return self._collect()
+
+    def usage(self):
+        """Bytes on disk used by stored pages, after compression."""
+        with self._lock:
+            return sum(size for _, size in self._known_chunks().values())
+
+    def _collect(self):
+        live = set()
+        for name in self.snapshots():
+            live.update(self.read_snapshot(name)[1])
+
+        freed = 0
+        for digest in list(self._known_chunks()):
+            if digest not in live:
+                os.remove(self._chunk_path(digest))
+                freed += self._known.pop(digest)[1]
+        return freed
+
+
+class BackupWorker(object):
+    """Background thread that takes snapshots off the caller's path
+
+    request() queues a snapshot and returns at once. Requests that pile up
+    while a snapshot is running are merged into a single snapshot, since
+    one copy taken afterwards already covers all of them. Pending requests
+    are flushed when the interpreter exits.
+    """
+
+    _STOP = object()
+
+    def __init__(self, store, db_path, maxsize=8):
+        self.store = store
+        self.db_path = db_path
+        self._queue = Queue(maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.taken = 0  # snapshots actually written
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='backup-worker')
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def request(self, reason):
+        """Queue a snapshot of the database, tagged with reason."""
+        self.start()
+        try:
+            self._queue.put_nowait(reason)
+        except Full:
+            # The queued snapshots have not run yet and will include
+            # whatever this request wanted saved.
+            logging.debug("backup queue full, merging {}".format(reason))
+
+    def drain(self):
+        """Block until every queued snapshot has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self):
+        """Flush pending snapshots and stop the thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            reasons = [self._queue.get()]
+
+            # Merge the rest of a burst into one snapshot.
+            while True:
+                try:
+                    reasons.append(self._queue.get_nowait())
+                except Empty:
+                    break
+
+            stop = self._STOP in reasons
+            reasons = [r for r in reasons if r is not self._STOP]
+
+            try:
+                if reasons:
+                    self.store.snapshot(self.db_path, reasons[-1])
+                    self.taken += 1
+            except Exception as e:
+                logging.error("Backup for {} failed: {}".format(reasons, e))
+            finally:
+                for _ in range(len(reasons) + stop):
+                    self._queue.task_done()
+
+            if stop:
+                return
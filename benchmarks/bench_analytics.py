@@ -0,0 +1,96 @@
+"""
+Hours per job per month over a large clock history: the per-row Python
+loop week_report/daily_report used (one ORM object and one strptime per
+row) against analytics.ClockHistory.
+
+    $ python benchmarks/bench_analytics.py [rows]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from analytics import ClockHistory, period_edges
+from models import Base, Clocktime
+
+START = datetime(2012, 1, 1)
+JOBS = 200
+
+
+def build_db(path, rows):
+    engine = create_engine('sqlite:///{}'.format(path))
+    Base.metadata.create_all(engine)
+    rng = random.Random(42)
+    span = 5 * 365 * 24 * 60
+    batch = []
+
+    with engine.begin() as conn:
+        for i in range(rows):
+            time_in = START + timedelta(minutes=rng.randrange(span))
+            tenths = rng.randrange(1, 40)
+            batch.append({'p_uuid': uuid.UUID(int=i % 5000), 'time_in': time_in,
+                          'time_out': time_in + timedelta(minutes=6 * tenths),
+                          'sub_task': 'task', 'tenths': tenths,
+                          'job_id': rng.randrange(1, JOBS + 1),
+                          'employee_id': rng.randrange(1, 20)})
+            if len(batch) == 50000:
+                conn.execute(Clocktime.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Clocktime.__table__.insert(), batch)
+    return engine
+
+
+def per_row(session):
+    """The report loops' approach: ORM rows, strftime/strptime each."""
+    totals = {}
+    for i in session.query(Clocktime).all():
+        if i.tenths is None:
+            continue
+        month = datetime.strptime(i.time_in.strftime('%Y-%m'), '%Y-%m')
+        key = (i.job_id, month)
+        totals[key] = totals.get(key, 0.0) + i.tenths / 10.0
+    return totals
+
+
+def columnar(session):
+    history = ClockHistory.load(session)
+    edges = period_edges(START, START + timedelta(days=5 * 366))
+    return history.hours_by(edges)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        started = time.time()
+        engine = build_db(os.path.join(tmpdir, 'bench.db'), rows)
+        print("{} clocktimes built in {:.1f} s\n".format(
+            rows, time.time() - started))
+
+        for label, method in (('per-row ORM loop', per_row),
+                              ('NumPy columnar', columnar)):
+            session = sessionmaker(bind=engine)()
+            started = time.time()
+            method(session)
+            print("{:<18} {:>8.2f} s".format(label, time.time() - started))
+            session.close()
+        engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
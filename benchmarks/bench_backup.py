@@ -0,0 +1,93 @@
+"""
+Clock-in latency against database size, old full-file copy vs the
+deduplicated snapshot store.
+
+    $ python benchmarks/bench_backup.py
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backup import BackupStore
+from models import Base, Clocktime
+
+SIZES = (1000, 10000, 100000)
+PUNCHES = 20
+
+
+def build_db(path, rows):
+    engine = create_engine('sqlite:///{}'.format(path))
+    Base.metadata.create_all(engine)
+    start = datetime(2014, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(Clocktime.__table__.insert(), [
+            {'p_uuid': uuid.UUID(int=i), 'time_in': start + timedelta(hours=i),
+             'time_out': start + timedelta(hours=i, minutes=30),
+             'sub_task': 'task', 'tenths': 5} for i in range(rows)])
+    return engine
+
+
+def clockin(session):
+    session.add(Clocktime(p_uuid=uuid.uuid4(), time_in=datetime.now(),
+                          sub_task='bench'))
+    session.commit()
+
+
+def run(rows, tmpdir):
+    db = os.path.join(tmpdir, 'bench.db')
+    engine = build_db(db, rows)
+    session = sessionmaker(bind=engine)()
+    size = os.path.getsize(db)
+
+    copy_dir = os.path.join(tmpdir, 'copies')
+    os.makedirs(copy_dir)
+    started = time.time()
+    for i in range(PUNCHES):
+        shutil.copyfile(db, os.path.join(copy_dir, str(i)))
+        clockin(session)
+    old = (time.time() - started) / PUNCHES
+    old_disk = sum(os.path.getsize(os.path.join(copy_dir, f))
+                   for f in os.listdir(copy_dir))
+
+    store = BackupStore(os.path.join(tmpdir, '.backup'))
+    started = time.time()
+    for i in range(PUNCHES):
+        store.snapshot(db, 'bench{}'.format(i),
+                       when=datetime.now() + timedelta(seconds=i))
+        clockin(session)
+    new = (time.time() - started) / PUNCHES
+    new_disk = sum(os.path.getsize(os.path.join(d, f))
+                   for d, _, files in os.walk(store.root) for f in files)
+
+    session.close()
+    engine.dispose()
+    print("{:>8} {:>10.1f} {:>12.2f} {:>12.2f} {:>12.1f} {:>12.1f}".format(
+        rows, size / 1024.0, old * 1000, new * 1000,
+        old_disk / 1024.0, new_disk / 1024.0))
+
+
+def main():
+    print("{:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+        'rows', 'db KiB', 'copy ms', 'snapshot ms', 'copy KiB', 'store KiB'))
+    for rows in SIZES:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            run(rows, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
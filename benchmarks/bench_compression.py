@@ -0,0 +1,79 @@
+"""
+Size and CPU cost per backup: raw file copies against the snapshot store
+with no compression, gzip and lzma.
+
+    $ python benchmarks/bench_compression.py [rows]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from backup import BackupStore
+from bench_backup import build_db, clockin
+
+BACKUPS = 20
+
+
+def disk_usage(path):
+    return sum(os.path.getsize(os.path.join(d, f))
+               for d, _, files in os.walk(path) for f in files)
+
+
+def raw_copies(db, session, out):
+    os.makedirs(out)
+    for i in range(BACKUPS):
+        shutil.copyfile(db, os.path.join(out, str(i)))
+        clockin(session)
+
+
+def store_snapshots(compression):
+    def run(db, session, out):
+        store = BackupStore(out, compression=compression)
+        for i in range(BACKUPS):
+            store.snapshot(db, 'bench', when=datetime.now() +
+                           timedelta(seconds=i))
+            clockin(session)
+    return run
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = os.path.join(tmpdir, 'bench.db')
+        engine = build_db(db, rows)
+        print("{} rows, {:.1f} KiB database, {} backups\n".format(
+            rows, os.path.getsize(db) / 1024.0, BACKUPS))
+        print("{:<10} {:>14} {:>14} {:>14}".format(
+            'method', 'cpu ms/backup', 'wall ms/backup', 'total KiB'))
+
+        for label, method in (('raw copy', raw_copies),
+                              ('store', store_snapshots(None)),
+                              ('gzip', store_snapshots('gzip')),
+                              ('lzma', store_snapshots('lzma'))):
+            out = os.path.join(tmpdir, label.replace(' ', '_'))
+            session = sessionmaker(bind=engine)()
+            cpu, wall = time.process_time(), time.time()
+            method(db, session, out)
+            cpu, wall = time.process_time() - cpu, time.time() - wall
+            session.close()
+            print("{:<10} {:>14.2f} {:>14.2f} {:>14.1f}".format(
+                label, cpu * 1000 / BACKUPS, wall * 1000 / BACKUPS,
+                disk_usage(out) / 1024.0))
+        engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
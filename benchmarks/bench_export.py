@@ -0,0 +1,93 @@
+"""
+Timesheet CSV export: the old query(Timesheet).all() + writerow loop
+against exports.export_csv, in rows/s and peak memory.
+
+    $ python benchmarks/bench_export.py [rows]
+"""
+
+from __future__ import print_function
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import exports
+from models import Base, Timesheet
+
+START = datetime(2012, 1, 1)
+
+
+def build_db(path, rows):
+    engine = create_engine('sqlite:///{}'.format(path))
+    Base.metadata.create_all(engine)
+    batch = []
+
+    with engine.begin() as conn:
+        for i in range(rows):
+            day = START + timedelta(minutes=10 * i)
+            batch.append({'p_uuid': uuid.UUID(int=i), 'abbr': 'JOB{}'.format(i % 200),
+                          'name': 'Job {}'.format(i % 200), 'tenths': 5,
+                          'date': day, 'week': day.strftime('%Y-%m-%d')})
+            if len(batch) == 50000:
+                conn.execute(Timesheet.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Timesheet.__table__.insert(), batch)
+    return engine
+
+
+def orm_loop(session, path):
+    """What export_timesheet did before."""
+    outfile = open(path, 'wt')
+    outcsv = csv.writer(outfile)
+    outcsv.writerow(exports.TIMESHEET_HEADER)
+    for i in session.query(Timesheet).all():
+        outcsv.writerow(
+            [i.abbr, i.name, i.tenths / 10.0, datetime.date(i.date), i.week])
+    outfile.close()
+
+
+def streaming(session, path):
+    exports.export_csv(session, path)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        engine = build_db(os.path.join(tmpdir, 'bench.db'), rows)
+        out = os.path.join(tmpdir, 'out.csv')
+        print("{} timesheet rows\n".format(rows))
+        print("{:<18} {:>10} {:>12} {:>10}".format(
+            '', 'seconds', 'rows/s', 'peak MB'))
+
+        for label, method in (('ORM .all() loop', orm_loop),
+                              ('streaming export', streaming)):
+            session = sessionmaker(bind=engine)()
+            tracemalloc.start()
+            started = time.time()
+            method(session, out)
+            elapsed = time.time() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("{:<18} {:>10.2f} {:>12.0f} {:>10.1f}".format(
+                label, elapsed, rows / elapsed, peak / 1e6))
+            session.close()
+        engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
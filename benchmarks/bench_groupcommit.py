@@ -0,0 +1,94 @@
+"""
+Clock events per second through groupcommit.GroupCommit, with a commit
+per event vs groups of various max delays, and what each costs in group
+size and time to acknowledgement. Every client thread waits for each
+event's ack before sending its next, as tc does.
+
+    $ python benchmarks/bench_groupcommit.py [clients] [events per client]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from connection import make_engine
+from groupcommit import MAX_BATCH, GroupCommit
+from migrations import upgrade
+from models import Clocktime
+
+SETTINGS = [
+    ('a commit per event', 0, 1),
+    ('groups, no delay', 0, MAX_BATCH),
+    ('groups, 2 ms', 0.002, MAX_BATCH),
+    ('groups, 5 ms', 0.005, MAX_BATCH),
+    ('groups, 20 ms', 0.02, MAX_BATCH),
+]
+
+
+def clock_in(employee_id):
+    def write(session):
+        session.add(Clocktime(time_in=datetime.now(), sub_task='bench',
+                              employee_id=employee_id))
+    return write
+
+
+def run(path, clients, events, max_delay, max_batch):
+    engine = make_engine(path)
+    upgrade(engine, pause=0)
+    queue = GroupCommit(sessionmaker(bind=engine), max_delay, max_batch)
+
+    def client(employee_id):
+        for _ in range(events):
+            queue.commit(clock_in(employee_id))
+
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    queue.stop()
+    engine.dispose()
+    return clients * events / elapsed, queue.metrics.summary()
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    # In the working directory rather than /tmp, which may be in memory
+    # and make fsyncs free.
+    tmpdir = tempfile.mkdtemp(dir='.')
+    try:
+        print("{} clients, {} clock-ins each\n".format(clients, events))
+        print("{:<22}{:>10}{:>12}{:>12}{:>12}{:>12}".format(
+            '', 'events/s', 'mean group', 'commit p99', 'ack p50',
+            'ack p99'))
+        for name, max_delay, max_batch in SETTINGS:
+            path = os.path.join(tmpdir, 'bench.db')
+            rate, metrics = run(path, clients, events, max_delay, max_batch)
+            print("{:<22}{:>10.0f}{:>12.1f}{:>10.1f}ms{:>10.1f}ms"
+                  "{:>10.1f}ms".format(
+                      name, rate, metrics['mean_group'],
+                      metrics['commit_p99_ms'], metrics['ack_p50_ms'],
+                      metrics['ack_p99_ms']))
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
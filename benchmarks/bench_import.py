@@ -0,0 +1,104 @@
+"""
+CSV import: one ORM session.add per row against imports.import_csv, for
+the timesheet export format and for raw clocktimes.
+
+    $ python benchmarks/bench_import.py [rows]
+"""
+
+from __future__ import print_function
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import imports
+from exports import TIMESHEET_HEADER
+from models import Base, Employee, Job, Timesheet
+
+START = datetime(2000, 1, 1)
+JOBS = 200
+
+
+def fresh_db(path):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine('sqlite:///{}'.format(path))
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Job.__table__.insert(), [
+            {'abbr': 'JOB{}'.format(i), 'name': 'Job {}'.format(i),
+             'rate': 100} for i in range(JOBS)])
+        conn.execute(Employee.__table__.insert(), [
+            {'firstname': 'E', 'lastname': str(i)} for i in range(20)])
+    return engine
+
+
+def write_csvs(folder, rows):
+    timesheet = os.path.join(folder, 'timesheet.csv')
+    clocktimes = os.path.join(folder, 'clocktimes.csv')
+
+    with open(timesheet, 'w', newline='') as t, \
+            open(clocktimes, 'w', newline='') as c:
+        t, c = csv.writer(t), csv.writer(c)
+        t.writerow(TIMESHEET_HEADER)
+        c.writerow(imports.CLOCKTIME_HEADER)
+        for i in range(rows):
+            # One row per job per day, like tc writes.
+            day = START + timedelta(days=i // JOBS)
+            abbr = 'JOB{}'.format(i % JOBS)
+            t.writerow([abbr, '', 1.5, day.strftime('%Y-%m-%d'), ''])
+            time_in = day + timedelta(hours=8, minutes=i % 60)
+            c.writerow(['', abbr, i % 20 + 1, time_in,
+                        time_in + timedelta(minutes=90), 'task'])
+    return timesheet, clocktimes
+
+
+def orm_import(engine, path):
+    """One Timesheet object and session.add per row."""
+    session = sessionmaker(bind=engine)()
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for abbr, name, hours, day, week in reader:
+            session.add(Timesheet(abbr=abbr, name=name,
+                                  tenths=round(float(hours) * 10),
+                                  date=datetime.strptime(day, '%Y-%m-%d'),
+                                  week=week))
+    session.commit()
+    session.close()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        timesheet, clocktimes = write_csvs(tmpdir, rows)
+        db = os.path.join(tmpdir, 'bench.db')
+        print("{} rows\n".format(rows))
+
+        for label, path, method in (
+                ('ORM session.add, timesheet', timesheet, orm_import),
+                ('import_csv, timesheet', timesheet, imports.import_csv),
+                ('import_csv, clocktimes', clocktimes, imports.import_csv)):
+            engine = fresh_db(db)
+            started = time.time()
+            method(engine, path)
+            elapsed = time.time() - started
+            print("{:<28} {:>8.2f} s {:>10.0f} rows/s".format(
+                label, elapsed, rows / elapsed))
+            engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
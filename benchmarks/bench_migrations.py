@@ -0,0 +1,141 @@
+"""
+How long clock-ins wait while upgrade() migrates an old database, with
+backfills in batches vs in one transaction per step.
+
+    $ python benchmarks/bench_migrations.py [rows]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from migrations import BATCH, PAUSE, upgrade
+
+START = datetime(2014, 1, 1)
+CLOCK_INS_EVERY = 0.01
+
+# A database from before the migrations: text keys, float hours, no
+# modified, week_key or job_id values and no indexes.
+OLD_SCHEMA = [
+    "CREATE TABLE employees (id INTEGER PRIMARY KEY, firstname VARCHAR(50), "
+    "lastname VARCHAR(50))",
+    "CREATE TABLE jobs (id INTEGER PRIMARY KEY, p_uuid VARCHAR, "
+    "name VARCHAR(50), abbr VARCHAR(16), rate INTEGER)",
+    "CREATE TABLE clocktimes (id INTEGER PRIMARY KEY, p_uuid VARCHAR, "
+    "time_in DATETIME, time_out DATETIME, sub_task VARCHAR(20), "
+    "employee_id INTEGER REFERENCES employees (id), "
+    "job_id INTEGER REFERENCES jobs (id), tworked FLOAT)",
+    "CREATE TABLE timesheet (id INTEGER PRIMARY KEY, p_uuid VARCHAR, "
+    "name VARCHAR(50), abbr VARCHAR(16), rate INTEGER, worked FLOAT, "
+    "date DATETIME, week VARCHAR(10))",
+]
+
+
+def build_db(path, rows):
+    conn = sqlite3.connect(path)
+    with conn:
+        for statement in OLD_SCHEMA:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO jobs (p_uuid, name, abbr, rate) VALUES (?, ?, ?, 0)",
+            [(str(uuid.uuid4()), 'Job {}'.format(i), 'JOB{}'.format(i))
+             for i in range(200)])
+        keys = [str(uuid.uuid4()) for _ in range(rows // 4)]
+        conn.executemany(
+            "INSERT INTO timesheet (p_uuid, abbr, worked, date) "
+            "VALUES (?, ?, 2.0, ?)",
+            [(key, 'JOB{}'.format(i % 200),
+              str(START + timedelta(hours=i)))
+             for i, key in enumerate(keys)])
+        conn.executemany(
+            "INSERT INTO clocktimes (p_uuid, time_in, time_out, sub_task, "
+            "tworked) VALUES (?, ?, ?, 'task', 0.5)",
+            [(keys[i // 4], str(START + timedelta(hours=i // 4, minutes=i)),
+              str(START + timedelta(hours=i // 4, minutes=i + 30)))
+             for i in range(rows)])
+    conn.close()
+
+
+def clock_in(path, stop, waits):
+    """Punch in every CLOCK_INS_EVERY seconds, noting how long each took"""
+    conn = sqlite3.connect(path, timeout=600)
+    while not stop.is_set():
+        started = time.time()
+        with conn:
+            now = str(datetime.now())
+            conn.execute("INSERT INTO clocktimes (p_uuid, time_in) "
+                         "VALUES (?, ?)", (uuid.uuid4().bytes, now))
+            # Set modified as the model's column default would, once
+            # upgrade() has added it; else backfill_modified chases us.
+            try:
+                conn.execute("UPDATE clocktimes SET modified = ? "
+                             "WHERE rowid = last_insert_rowid()", (now,))
+            except sqlite3.OperationalError:
+                pass
+        waits.append(time.time() - started)
+        time.sleep(CLOCK_INS_EVERY)
+    conn.close()
+
+
+def run(path, batch, pause):
+    engine = create_engine('sqlite:///{}'.format(path),
+                           connect_args={'timeout': 600})
+    stop = threading.Event()
+    waits = []
+    puncher = threading.Thread(target=clock_in, args=(path, stop, waits))
+    puncher.start()
+    started = time.time()
+    try:
+        upgrade(engine, batch=batch, pause=pause)
+    finally:
+        elapsed = time.time() - started
+        stop.set()
+        puncher.join()
+        engine.dispose()
+    waits.sort()
+    return elapsed, len(waits), waits[int(len(waits) * 0.99)], waits[-1]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        base = os.path.join(tmpdir, 'base.db')
+        build_db(base, rows)
+        engine = create_engine('sqlite:///{}'.format(base))
+        estimate = sum(c.rows for c in upgrade(engine, dry_run=True)
+                       if c.version)
+        engine.dispose()
+        print("{} clocktimes, dry run estimates {} rows to backfill\n"
+              .format(rows, estimate))
+
+        print("{:<26}{:>10}{:>10}{:>12}{:>12}".format(
+            'backfill batches', 'upgrade s', 'punches', 'p99 wait s',
+            'max wait s'))
+        for name, batch, pause in (
+                ('one per step', rows * 10, 0),
+                ('{} rows'.format(BATCH), BATCH, 0),
+                ('{} rows, {}s apart'.format(BATCH, PAUSE), BATCH, PAUSE)):
+            path = os.path.join(tmpdir, 'run.db')
+            shutil.copyfile(base, path)
+            print("{:<26}{:>10.2f}{:>10}{:>12.3f}{:>12.3f}".format(
+                name, *run(path, batch, pause)))
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Payroll export, one CSV per ISO week and employee, against the number of
+worker processes.
+
+    $ python benchmarks/bench_partitions.py [rows]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exports
+from bench_export import build_db
+from models import Clocktime
+
+EMPLOYEES = 20
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = os.path.join(tmpdir, 'bench.db')
+        engine = build_db(db, rows)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                'INSERT INTO {} (p_uuid, time_in, employee_id) '
+                'SELECT p_uuid, date, id % {} + 1 FROM timesheet'.format(
+                    Clocktime.__tablename__, EMPLOYEES))
+            conn.exec_driver_sql('ANALYZE')
+        engine.dispose()
+        print("{} timesheet rows, {} cores\n".format(rows, os.cpu_count()))
+
+        workers = 1
+        while workers <= max(os.cpu_count(), 1):
+            out = os.path.join(tmpdir, 'out{}'.format(workers))
+            started = time.time()
+            entries = exports.export_partitions(db, out, workers=workers)
+            print("{:>2} workers {:>8.2f} s  {} files".format(
+                workers, time.time() - started, len(entries)))
+            workers *= 2
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
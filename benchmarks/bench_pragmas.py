@@ -0,0 +1,138 @@
+"""
+Clock-in, clock-out and weekly report throughput with each connection
+profile of connection.make_engine(), the statements tc.py runs for each.
+
+The journal's triggers are left out: journal.install() would switch even
+the stock profile to WAL.
+
+    $ python benchmarks/bench_pragmas.py [operations] [history days]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+import rollups
+from connection import PROFILES, make_engine
+from migrations import upgrade
+from models import Clocktime, Job, Timesheet, tenths_between
+from reports import timesheet_rows, week_range
+
+START = datetime(2014, 1, 1)
+JOBS = 50
+PUNCHES_PER_DAY = 4
+
+
+def build_history(session, days):
+    session.add_all(Job(name='Job {}'.format(i), abbr='JOB{}'.format(i),
+                        rate=0) for i in range(JOBS))
+    clocktimes = []
+    for day in range(days):
+        date = START + timedelta(days=day)
+        key = uuid.UUID(int=day)
+        abbr = 'JOB{}'.format(day % JOBS)
+        session.add(Timesheet(p_uuid=key, abbr=abbr, name=abbr,
+                              tenths=20 * PUNCHES_PER_DAY, date=date))
+        for punch in range(PUNCHES_PER_DAY):
+            time_in = date + timedelta(hours=8 + 2 * punch)
+            clocktimes.append(Clocktime(
+                p_uuid=key, time_in=time_in, sub_task='task',
+                time_out=time_in + timedelta(hours=2), tenths=20))
+    session.add_all(clocktimes)
+    session.commit()
+    rollups.rebuild(session)
+    session.commit()
+
+
+def clock_in(session, key, abbr, now):
+    session.add(Timesheet(p_uuid=key, abbr=abbr, name=abbr, tenths=0,
+                          date=now))
+    session.commit()
+    sheet = session.query(Timesheet.abbr).filter(
+        Timesheet.p_uuid == key).first()
+    job = session.query(Job).filter(Job.abbr == sheet.abbr).first()
+    session.add(Clocktime(p_uuid=key, time_in=now, sub_task='task',
+                          job_id=job.id))
+    session.commit()
+
+
+def clock_out(session, key, now):
+    sheet = session.query(Timesheet).filter(Timesheet.p_uuid == key).first()
+    clk = session.query(Clocktime).filter(Clocktime.p_uuid == key).order_by(
+        Clocktime.id.desc()).first()
+    tenths = tenths_between(clk.time_in, now)
+    session.query(Clocktime).filter(Clocktime.id == clk.id).update(
+        {'time_out': now, 'tenths': tenths}, synchronize_session=False)
+    session.query(Timesheet).filter(Timesheet.p_uuid == key).update(
+        {'tenths': func.coalesce(Timesheet.tenths, 0) + tenths},
+        synchronize_session=False)
+    rollups.record(session, clk.time_in.date(), sheet.abbr, None, 'task',
+                   tenths)
+    session.commit()
+
+
+def rate(operation, count):
+    started = time.time()
+    for i in range(count):
+        operation(i)
+    return count / (time.time() - started)
+
+
+def run(path, pragmas, operations, days):
+    engine = make_engine(path, pragmas)
+    upgrade(engine, pause=0)
+    session = sessionmaker(bind=engine)()
+    build_history(session, days)
+
+    now = START + timedelta(days=days)
+    keys = [uuid.uuid4() for _ in range(operations)]
+    rng = random.Random(42)
+    weeks = [week_range((START + timedelta(days=rng.randrange(days))).date())
+             for _ in range(operations)]
+    try:
+        return (
+            rate(lambda i: clock_in(session, keys[i], 'JOB{}'.format(i % JOBS),
+                                    now + timedelta(minutes=i)), operations),
+            rate(lambda i: clock_out(session, keys[i],
+                                     now + timedelta(minutes=i + 30)),
+                 operations),
+            rate(lambda i: timesheet_rows(session, *weeks[i]).all(),
+                 operations))
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 3650
+    # In the working directory rather than /tmp, which may be in memory
+    # and make fsyncs free.
+    tmpdir = tempfile.mkdtemp(dir='.')
+    try:
+        print("{} operations each, {} days of history, in {}\n".format(
+            operations, days, os.path.abspath(tmpdir)))
+        print("{:<10}{:>16}{:>16}{:>16}".format(
+            'profile', 'clock-ins/s', 'clock-outs/s', 'reports/s'))
+        for profile in ('stock', 'safe', 'tuned'):
+            path = os.path.join(tmpdir, profile + '.db')
+            print("{:<10}{:>16.0f}{:>16.0f}{:>16.0f}".format(
+                profile, *run(path, PROFILES[profile], operations, days)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
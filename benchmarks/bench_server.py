@@ -0,0 +1,103 @@
+"""
+Punches per second through the timeclock server at a shift change, with
+the writer committing each punch on its own vs grouping them, driven by
+server.loadgen from the same machine.
+
+    $ python benchmarks/bench_server.py [employees] [clients] [rounds]
+"""
+
+from __future__ import print_function
+
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy.orm import Session
+
+from connection import make_engine
+from migrations import upgrade
+from models import Employee, Job
+from server import MAX_BATCH
+from server.loadgen import shift_change
+
+
+def build_db(path, employees):
+    engine = make_engine(path)
+    upgrade(engine, pause=0)
+    with Session(engine) as session:
+        session.add_all(Employee(firstname='Emp', lastname=str(i))
+                        for i in range(employees))
+        session.add(Job(name='Load', abbr='LOAD', rate=0))
+        session.commit()
+    engine.dispose()
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(cwd, port, max_batch):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'server', '--port', str(port),
+         '--max-batch', str(max_batch)],
+        cwd=cwd, env=dict(os.environ, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def main():
+    employees = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    # In the working directory rather than /tmp, which may be in memory
+    # and make fsyncs free.
+    tmpdir = tempfile.mkdtemp(dir='.')
+    try:
+        print("{} employees punching in and out {} times over {} "
+              "connections\n".format(employees, rounds, clients))
+        print("{:<22}{:>12}{:>12}{:>12}{:>10}".format(
+            'writer', 'punches/s', 'p50 ms', 'p99 ms', 'errors'))
+        for name, max_batch in (('a commit per punch', 1),
+                                ('grouped commits', MAX_BATCH)):
+            cwd = os.path.join(tmpdir, 'run')
+            os.mkdir(cwd)
+            build_db(os.path.join(cwd, '.timesheet.db'), employees)
+            port = free_port()
+            proc = start_server(cwd, port, max_batch)
+            try:
+                result = asyncio.run(shift_change(
+                    port=port, employees=employees, clients=clients,
+                    rounds=rounds))
+            finally:
+                proc.terminate()
+                proc.wait()
+            print("{:<22}{:>12.0f}{:>12.1f}{:>12.1f}{:>10}".format(
+                name, result.rate, result.percentile(0.5) * 1000,
+                result.percentile(0.99) * 1000, result.errors))
+            shutil.rmtree(cwd)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Time from launching tc.py to its first prompt, and until the database it
+loads in the background is ready, in an empty directory and in one with
+a year of history.
+
+    $ python benchmarks/bench_startup.py [runs]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from migrations import upgrade
+from models import Clocktime, Job, Timesheet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TC = os.path.join(ROOT, 'tc.py')
+PROMPT = b'>>> '
+START = datetime(2014, 1, 1)
+
+
+def build_db(path, days=365):
+    engine = create_engine('sqlite:///{}'.format(path))
+    upgrade(engine, pause=0)
+    session = Session(engine)
+    session.add(Job(name='Job', abbr='JOB', rate=0))
+    for day in range(days):
+        key = uuid.UUID(int=day)
+        time_in = START + timedelta(days=day, hours=9)
+        session.add(Timesheet(p_uuid=key, abbr='JOB', tenths=80,
+                              date=time_in))
+        session.add(Clocktime(p_uuid=key, time_in=time_in, tenths=80,
+                              time_out=time_in + timedelta(hours=8)))
+    session.commit()
+    session.close()
+    engine.dispose()
+
+
+def import_time():
+    """Seconds python takes to start and import tc"""
+    started = time.time()
+    subprocess.check_call([sys.executable, '-c', 'import tc'], cwd=ROOT)
+    return time.time() - started
+
+
+def launch(cwd):
+    """Seconds to tc.py's first prompt, and to quitting from it: quitting
+    waits for the database and the startup backup."""
+    env = dict(os.environ, PYTHONPATH=ROOT, TERM='dumb')
+    started = time.time()
+    proc = subprocess.Popen([sys.executable, '-u', TC], cwd=cwd, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    seen = b''
+    while not seen.endswith(PROMPT):
+        char = proc.stdout.read(1)
+        if not char:
+            raise RuntimeError(seen.decode('ascii', 'replace'))
+        seen += char
+    prompt = time.time() - started
+    proc.communicate(b'7\n')
+    return prompt, time.time() - started
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tmpdir = tempfile.mkdtemp()
+    try:
+        history = os.path.join(tmpdir, 'history')
+        os.mkdir(history)
+        build_db(os.path.join(history, '.timesheet.db'))
+
+        imports = sorted(import_time() for _ in range(runs))
+        print("python -c 'import tc': {:.3f} s (median of {})\n".format(
+            imports[runs // 2], runs))
+        print("{:<16}{:>16}{:>16}".format('', 'first prompt s', 'quit s'))
+        for name, source in (('new database', None), ('a year of it', history)):
+            timings = []
+            for _ in range(runs):
+                cwd = os.path.join(tmpdir, 'run')
+                if source:
+                    shutil.copytree(source, cwd)
+                else:
+                    os.mkdir(cwd)
+                timings.append(launch(cwd))
+                shutil.rmtree(cwd)
+            timings.sort()
+            print("{:<16}{:>16.3f}{:>16.3f}".format(name, *timings[runs // 2]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
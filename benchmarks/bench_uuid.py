@@ -0,0 +1,132 @@
+"""
+Database size and p_uuid lookup time, 36 character text keys vs the 16
+byte BLOBs of sqa_uuid.UUID, and the time to migrate one to the other.
+
+    $ python benchmarks/bench_uuid.py [rows]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import bindparam, create_engine, select
+
+from migrations import BATCH, convert_uuids
+from models import Clocktime
+
+LOOKUPS = 20000
+PUNCHES_PER_KEY = 4
+START = datetime(2014, 1, 1)
+
+# Just the columns compared, p_uuid declared as before sqa_uuid.UUID
+# (VARCHAR) or as it is now (BLOB), and indexed either way.
+SCHEMA = [
+    "CREATE TABLE clocktimes (id INTEGER PRIMARY KEY, p_uuid {0}, "
+    "time_in DATETIME, time_out DATETIME, sub_task VARCHAR(20))",
+    "CREATE INDEX ix_clocktimes_p_uuid ON clocktimes (p_uuid)",
+    "CREATE TABLE timesheet (id INTEGER PRIMARY KEY, p_uuid {0}, "
+    "abbr VARCHAR(16), date DATETIME)",
+    "CREATE INDEX ix_timesheet_p_uuid ON timesheet (p_uuid)",
+    "CREATE TABLE jobs (id INTEGER PRIMARY KEY, p_uuid {0})",
+]
+
+
+def fill(path, keys, column_type, encode):
+    conn = sqlite3.connect(path)
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement.format(column_type))
+        conn.executemany(
+            'INSERT INTO timesheet (p_uuid, abbr, date) VALUES (?, ?, ?)',
+            [(encode(key), 'JOB', START + timedelta(hours=i))
+             for i, key in enumerate(keys)])
+        conn.executemany(
+            'INSERT INTO clocktimes (p_uuid, time_in, sub_task) '
+            'VALUES (?, ?, ?)',
+            [(encode(key), START + timedelta(hours=i, minutes=j), 'task')
+             for i, key in enumerate(keys) for j in range(PUNCHES_PER_KEY)])
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def lookups(path, keys, encode):
+    conn = sqlite3.connect(path)
+    started = time.time()
+    for key in keys:
+        conn.execute('SELECT id FROM clocktimes WHERE p_uuid = ?',
+                     (encode(key),)).fetchall()
+    elapsed = time.time() - started
+    conn.close()
+    return elapsed
+
+
+def orm_lookups(path, keys):
+    """The same lookups through the model, binding uuid.UUID objects"""
+    engine = create_engine('sqlite:///{}'.format(path))
+    query = select(Clocktime.id).where(Clocktime.p_uuid == bindparam('key'))
+    with engine.connect() as conn:
+        started = time.time()
+        for key in keys:
+            conn.execute(query, {'key': key}).all()
+        elapsed = time.time() - started
+    engine.dispose()
+    return elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(42)
+    keys = [uuid.UUID(int=rng.getrandbits(128), version=4)
+            for _ in range(rows // PUNCHES_PER_KEY)]
+    probes = [rng.choice(keys) for _ in range(LOOKUPS)]
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        text_db = os.path.join(tmpdir, 'text.db')
+        blob_db = os.path.join(tmpdir, 'blob.db')
+        fill(text_db, keys, 'VARCHAR', str)
+        fill(blob_db, keys, 'BLOB', lambda key: key.bytes)
+
+        print("{} clocktimes, {} timesheet rows, {} lookups\n".format(
+            len(keys) * PUNCHES_PER_KEY, len(keys), LOOKUPS))
+        print("{:<12}{:>10}{:>14}".format('', 'size MB', 'lookups s'))
+        for name, path, encode in (('text', text_db, str),
+                                   ('blob', blob_db,
+                                    lambda key: key.bytes)):
+            print("{:<12}{:>10.1f}{:>14.3f}".format(
+                name, os.path.getsize(path) / 1e6,
+                lookups(path, probes, encode)))
+        print("{:<12}{:>10}{:>14.3f}".format(
+            'blob, ORM', '', orm_lookups(blob_db, probes)))
+
+        print()
+        engine = create_engine('sqlite:///{}'.format(text_db))
+        for run in ('text database', 'nothing left to convert'):
+            started = time.time()
+            with engine.begin() as conn:
+                while convert_uuids(conn, BATCH):
+                    pass
+            print("{:<44}{:>8.3f} s".format(
+                'convert_uuids(), ' + run, time.time() - started))
+        engine.dispose()
+        conn = sqlite3.connect(text_db)
+        conn.execute('VACUUM')
+        conn.close()
+        print("{:<44}{:>8.1f} MB".format(
+            'converted and vacuumed', os.path.getsize(text_db) / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+In-memory catalog of jobs for the clock-in prompt.
+
+The catalog reads the jobs table once and keeps the abbreviations in a
+sorted list, so prefix completion is a bisect instead of a query, and a
+normalized-name index for "did you mean" suggestions. Anything that adds
+or edits a job must call invalidate() so the next lookup reloads.
+"""
+
+import bisect
+import difflib
+import re
+from collections import namedtuple
+
+from models import Job
+
+__all__ = ['JobCatalog', 'JobEntry']
+
+JobEntry = namedtuple('JobEntry', 'id abbr name')
+
+
+def normalize(text):
+    """Lowercase text and drop everything but letters and digits."""
+    return re.sub(r'[^0-9a-z]', '', (text or '').lower())
+
+
+class JobCatalog(object):
+    """Cached index of Job rows by abbreviation and name
+
+    catalog = JobCatalog(session)
+    catalog.get('PYTIME')    -> [JobEntry(...)]
+    catalog.complete('PY')   -> ['PYTIME', ...]
+    catalog.suggest('pytim') -> JobEntry(abbr='PYTIME', ...)
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._abbrs = None  # sorted abbreviations, one per distinct abbr
+        self._by_abbr = None  # abbr -> [JobEntry]
+        self._by_name = None  # normalized name -> [JobEntry]
+
+    def invalidate(self):
+        """Forget the cached jobs; the next lookup reads the table again."""
+        self._abbrs = self._by_abbr = self._by_name = None
+
+    def _load(self):
+        if self._by_abbr is not None:
+            return
+        by_abbr, by_name = {}, {}
+
+        for row in self.session.query(Job.id, Job.abbr, Job.name) \
+                .order_by(Job.id):
+            entry = JobEntry(*row)
+            if entry.abbr is None:
+                continue
+            by_abbr.setdefault(entry.abbr, []).append(entry)
+            by_name.setdefault(normalize(entry.name), []).append(entry)
+        self._by_abbr, self._by_name = by_abbr, by_name
+        self._abbrs = sorted(by_abbr)
+
+    def __len__(self):
+        self._load()
+        return len(self._abbrs)
+
+    def get(self, abbr):
+        """Jobs with exactly this abbreviation, oldest first."""
+        self._load()
+        return list(self._by_abbr.get(abbr, ()))
+
+    def complete(self, prefix, limit=None):
+        """Abbreviations starting with prefix, in sorted order."""
+        self._load()
+        start = bisect.bisect_left(self._abbrs, prefix)
+        matches = []
+
+        for abbr in self._abbrs[start:]:
+            if not abbr.startswith(prefix) or len(matches) == limit:
+                break
+            matches.append(abbr)
+        return matches
+
+    def suggest(self, text):
+        """Best guess at the job meant by text, or None
+
+        Tries, in order: the abbreviation in upper case, a unique
+        abbreviation prefix, a job name, then the closest abbreviation.
+        """
+        self._load()
+        text = (text or '').strip()
+
+        if not text:
+            return None
+
+        if text.upper() in self._by_abbr:
+            return self._by_abbr[text.upper()][0]
+
+        prefixed = self.complete(text.upper(), limit=2)
+        if len(prefixed) == 1:
+            return self._by_abbr[prefixed[0]][0]
+
+        named = self._by_name.get(normalize(text))
+        if named:
+            return named[0]
+
+        close = difflib.get_close_matches(text.upper(), self._abbrs, n=1)
+        if close:
+            return self._by_abbr[close[0]][0]
+        return None
+
+    def completer(self, text, state):
+        """readline completer over the job abbreviations."""
+        matches = self.complete(text) or self.complete(text.upper())
+        return matches[state] if state < len(matches) else None
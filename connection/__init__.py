@@ -0,0 +1,145 @@
+"""
+The engine every part of PYPER opens the timesheet database with.
+
+make_engine() runs a profile of PRAGMAs on each new connection, from a
+SQLAlchemy connect event, and keeps the connections in a QueuePool: the
+PRAGMAs run once per connection, not per checkout, and WAL lets the
+pooled readers share the file with a writer.
+
+PROFILES:
+
+- stock: nothing is set, so SQLite's defaults stand: the rollback
+  journal, synchronous=FULL and a 2 MB page cache.
+- safe: WAL, still syncing on every commit.
+- tuned (the default): WAL with synchronous=NORMAL, which syncs at
+  checkpoints only. A power cut can lose the last few commits but never
+  corrupts the file. Also a 32 MB page cache, 256 MB of mmap and
+  in-memory temp tables.
+
+Settings are read, each overriding the last, from:
+
+1. The [database] section of the config file: CONFIG_NAME in the current
+   directory, or the file PYPER_DB_CONFIG names. `profile = ...` picks a
+   profile; any other key is a PRAGMA to set, e.g. `cache_size = -8000`.
+2. PYPER_DB_PROFILE, a profile name.
+3. PYPER_DB_PRAGMAS, e.g. "mmap_size=0,synchronous=FULL".
+"""
+
+import os
+import re
+from collections import OrderedDict
+from configparser import ConfigParser
+from urllib.request import pathname2url
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+__all__ = ['PROFILES', 'DEFAULT_PROFILE', 'PRAGMAS', 'CONFIG_NAME',
+           'load_pragmas', 'make_engine']
+
+PROFILES = {
+    'stock': OrderedDict(),
+    'safe': OrderedDict([
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'FULL'),
+        ('busy_timeout', '5000'),
+    ]),
+    'tuned': OrderedDict([
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('cache_size', '-32000'),  # negative: KiB rather than pages
+        ('mmap_size', '268435456'),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', '5000'),
+    ]),
+}
+DEFAULT_PROFILE = 'tuned'
+
+# The PRAGMAs a config may set, in the order they are run.
+PRAGMAS = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+           'temp_store', 'busy_timeout', 'foreign_keys', 'wal_autocheckpoint']
+# Only journal_mode changes the file; the rest are per connection.
+FILE_PRAGMAS = {'journal_mode'}
+
+CONFIG_NAME = '.timesheet.cfg'
+POOL_SIZE = 5
+
+_VALUE = re.compile(r'^-?\w+$')
+
+
+def _set(pragmas, name, value):
+    name = name.strip().lower()
+    value = value.strip()
+    if name not in PRAGMAS:
+        raise ValueError("Unknown SQLite pragma {!r}".format(name))
+    if not _VALUE.match(value):
+        raise ValueError("Bad value {!r} for pragma {}".format(value, name))
+    pragmas[name] = value
+
+
+def _profile(name):
+    try:
+        return OrderedDict(PROFILES[name.strip().lower()])
+    except KeyError:
+        raise ValueError("Unknown database profile {!r}, expected one of "
+                         "{}".format(name, ', '.join(sorted(PROFILES))))
+
+
+def load_pragmas(config=None, environ=None):
+    """OrderedDict of the PRAGMAs to run, from the config file at `config`
+    (default: see the module docstring) and the environment"""
+    environ = os.environ if environ is None else environ
+    config = config or environ.get('PYPER_DB_CONFIG', CONFIG_NAME)
+
+    parser = ConfigParser()
+    parser.read(config)
+    section = dict(parser.items('database')) \
+        if parser.has_section('database') else {}
+
+    profile = section.pop('profile', DEFAULT_PROFILE)
+    pragmas = _profile(environ.get('PYPER_DB_PROFILE') or profile)
+    for name, value in section.items():
+        _set(pragmas, name, value)
+
+    for item in environ.get('PYPER_DB_PRAGMAS', '').split(','):
+        if item.strip():
+            name, _, value = item.partition('=')
+            _set(pragmas, name, value)
+
+    return OrderedDict((name, pragmas[name]) for name in PRAGMAS
+                       if name in pragmas)
+
+
+def make_engine(db_path, pragmas=None, readonly=False, **kwargs):
+    """Engine for the SQLite file db_path, running `pragmas` (default:
+    load_pragmas()) on every new connection. A readonly engine opens the
+    file with mode=ro and leaves its journal mode alone."""
+    if pragmas is None:
+        pragmas = load_pragmas()
+
+    if readonly:
+        url = 'sqlite:///file:{0}?mode=ro&uri=true'.format(
+            pathname2url(os.path.abspath(db_path)))
+        pragmas = OrderedDict((name, value) for name, value in pragmas.items()
+                              if name not in FILE_PRAGMAS)
+    else:
+        url = 'sqlite:///{}'.format(db_path)
+
+    kwargs.setdefault('poolclass', QueuePool)
+    if kwargs['poolclass'] is QueuePool:
+        kwargs.setdefault('pool_size', POOL_SIZE)
+    engine = create_engine(url, **kwargs)
+
+    statements = ['PRAGMA {}={}'.format(name, value)
+                  for name, value in pragmas.items()]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    return engine
@@ -0,0 +1,387 @@
+"""
+Streaming CSV export of the timesheet.
+
+Rows come straight off a Core select, a batch at a time, with the date
+already formatted by SQLite, and go through a large write buffer into a
+temp file next to the target. The temp file replaces the target only once
+it is complete, so an interrupted export never leaves half a CSV behind.
+Memory use is one batch, whatever the size of the timesheet.
+
+export_changes() exports only the rows inserted or updated since its last
+run, tracked by each row's modified time and a high-water mark kept in the
+export_state table, either appended to one CSV or as a separate delta file.
+modified is stamped before the write waits for the database lock, so a
+row can commit after a newer one has been exported; each run reads back
+OVERLAP before the mark and skips the rows it has already written.
+
+export_partitions() splits the export into one CSV per ISO week and/or
+employee and writes them from a pool of processes, each reading the
+database through its own read-only connection, and lists the files in a
+manifest. An employee's CSV has the hours of that employee's own
+clocktimes on each row; hours no employee clocked, such as all of tc's,
+go to an "unassigned" partition, so the partitions add up to the
+timesheet.
+"""
+
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import Float, String, and_, case, exists, func, literal, \
+    or_, select, type_coerce
+from sqlalchemy.orm import Session
+
+from connection import make_engine
+from models import Clocktime, ExportState, Job, Timesheet, week_label
+
+__all__ = ['TIMESHEET_HEADER', 'CLOCKTIME_HEADER', 'MANIFEST', 'ExportStats',
+           'Partition', 'UNASSIGNED', 'timesheet_select', 'clocktime_select',
+           'export_csv', 'find_partitions', 'readonly_engine',
+           'export_partitions', 'export_changes']
+
+TIMESHEET_HEADER = ('Id', 'Job Name', 'Hours Worked', 'Date', 'Week Ending')
+CLOCKTIME_HEADER = ('Key', 'Id', 'Employee', 'Time In', 'Time Out', 'Task')
+BATCH = 10000
+BUFFER = 1 << 20
+MANIFEST = 'manifest.jsonl'
+# Longest a row's modified time can precede its commit: the busy timeout
+# its write may wait for the lock, with room to spare.
+OVERLAP = timedelta(seconds=30)
+
+Partition = namedtuple('Partition', 'week employee_id')
+# employee_id of the partition of hours no employee clocked, as in rollups.
+UNASSIGNED = 0
+
+
+class ExportStats(object):
+    """Rows written and time taken by one export"""
+
+    def __init__(self, path, rows, seconds):
+        self.path = path
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rate(self):
+        """Rows per second"""
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+    def __repr__(self):
+        return '<ExportStats {} rows in {:.2f}s to {}>'.format(
+            self.rows, self.seconds, self.path)
+
+
+def _assigned_tenths():
+    """Tenths of a timesheet row's clocktimes that have an employee"""
+    return select(func.coalesce(func.sum(Clocktime.tenths), 0)) \
+        .where(Clocktime.p_uuid == Timesheet.p_uuid,
+               Clocktime.employee_id.isnot(None)) \
+        .scalar_subquery()
+
+
+def _has_employee():
+    return exists().where(and_(Clocktime.p_uuid == Timesheet.p_uuid,
+                               Clocktime.employee_id.isnot(None)))
+
+
+def _unassigned():
+    """(tenths no employee clocked, condition for rows that have some)
+
+    A row no employee clocked time on is unassigned whole, even with no
+    hours yet; otherwise what its clocktimes don't account for is.
+    """
+    rest = func.coalesce(Timesheet.tenths, 0) - _assigned_tenths()
+    return (case((_has_employee(), rest), else_=Timesheet.tenths),
+            or_(~_has_employee(), rest > 0))
+
+
+def timesheet_select(start=None, end=None, employee_id=None, week=None):
+    """Select of the export columns for timesheet rows dated in
+    [start, end), in date order. Either end may be left open. week (a
+    week_key) keeps only rows of that ISO week.
+
+    With employee_id, only the jobs that employee clocked time on, with
+    the hours of their own clocktimes; with UNASSIGNED, the hours of each
+    row no employee clocked.
+    """
+    tenths = Timesheet.tenths
+    if employee_id == UNASSIGNED:
+        tenths, unassigned = _unassigned()
+    elif employee_id is not None:
+        tenths = func.sum(Clocktime.tenths)
+
+    query = select(Timesheet.abbr,
+                   Timesheet.name,
+                   # Shortest float repr of n / 10 is exactly n's tenths.
+                   type_coerce(tenths / 10.0, Float),
+                   func.date(Timesheet.date),
+                   Timesheet.week)
+
+    if start is not None:
+        query = query.where(Timesheet.date >= start)
+    if end is not None:
+        query = query.where(Timesheet.date < end)
+    if week is not None:
+        query = query.where(Timesheet.week_key == week)
+    if employee_id == UNASSIGNED:
+        query = query.where(unassigned)
+    elif employee_id is not None:
+        query = query.join(Clocktime, Clocktime.p_uuid == Timesheet.p_uuid) \
+            .where(Clocktime.employee_id == employee_id) \
+            .group_by(Timesheet.id)
+    return query.order_by(Timesheet.date, Timesheet.id)
+
+
+def clocktime_select():
+    """Select of clocktimes in the CLOCKTIME_HEADER format, which
+    imports.import_csv reads back. Times keep their microseconds, or a
+    re-import wouldn't recognise the clocktimes it already has."""
+    job = select(Job.abbr).where(Job.id == Clocktime.job_id) \
+        .scalar_subquery()
+    return select(Clocktime.p_uuid,
+                  job,
+                  Clocktime.employee_id,
+                  # As stored, YYYY-MM-DD HH:MM:SS.ffffff.
+                  type_coerce(Clocktime.time_in, String),
+                  type_coerce(Clocktime.time_out, String),
+                  Clocktime.sub_task) \
+        .order_by(Clocktime.time_in, Clocktime.id)
+
+
+# What export_changes() can follow: model, full select, header.
+CHANGE_FEEDS = {
+    'timesheet': (Timesheet, timesheet_select, TIMESHEET_HEADER),
+    'clocktimes': (Clocktime, clocktime_select, CLOCKTIME_HEADER),
+}
+
+
+def export_csv(bind, path, query=None, header=TIMESHEET_HEADER,
+               batch=BATCH, append=False):
+    """Stream the rows of query (default: the whole timesheet) to a CSV
+
+    bind is a SQLAlchemy connection or session. With append, rows are
+    added to the end of an existing, non-empty path instead, without a
+    header, and synced to disk before returning. Returns ExportStats.
+    """
+    if query is None:
+        query = timesheet_select()
+    began = time.time()
+    rows = _write_csv(path, header, _stream(bind, query, batch), append)
+    return ExportStats(path, rows, time.time() - began)
+
+
+def _stream(bind, query, batch):
+    """The rows of query, a batch per list, off a server-side cursor"""
+    conn = bind.connection() if isinstance(bind, Session) else bind
+    return conn.execution_options(stream_results=True,
+                                  yield_per=batch).execute(query).partitions()
+
+
+def _write_csv(path, header, chunks, append):
+    """Write lists of rows to path as export_csv() does, return the
+    number of rows"""
+    append = append and os.path.isfile(path) and os.path.getsize(path) > 0
+    tmp = path if append else path + '.tmp'
+    rows = 0
+
+    try:
+        with open(tmp, 'a' if append else 'w', newline='',
+                  buffering=BUFFER) as f:
+            out = csv.writer(f)
+            if not append:
+                out.writerow(header)
+
+            for chunk in chunks:
+                out.writerows(chunk)
+                rows += len(chunk)
+            if append:
+                f.flush()
+                os.fsync(f.fileno())
+        if not append:
+            os.replace(tmp, path)
+    finally:
+        if not append and os.path.exists(tmp):
+            os.remove(tmp)
+    return rows
+
+
+def find_partitions(bind, by=('week', 'employee'), start=None, end=None):
+    """Partitions holding at least one timesheet row dated in [start, end)
+
+    by names what to split on: 'week', 'employee' or both. Weeks are
+    week_key()s; a field not split on is None. Splitting by employee adds
+    an UNASSIGNED partition wherever some hours have no employee.
+    """
+    conn = bind.connection() if isinstance(bind, Session) else bind
+    if 'week' not in by and 'employee' not in by:
+        raise ValueError("Partition by 'week', 'employee' or both")
+    week = [Timesheet.week_key] if 'week' in by else []
+
+    def dated(query):
+        if start is not None:
+            query = query.where(Timesheet.date >= start)
+        if end is not None:
+            query = query.where(Timesheet.date < end)
+        return query.distinct()
+
+    if 'employee' in by:
+        queries = [
+            dated(select(*week + [Clocktime.employee_id])
+                  .join(Clocktime, Clocktime.p_uuid == Timesheet.p_uuid)
+                  .where(Clocktime.employee_id.isnot(None))),
+            dated(select(*week + [literal(UNASSIGNED)])
+                  .select_from(Timesheet).where(_unassigned()[1]))]
+    else:
+        queries = [dated(select(*week).select_from(Timesheet))]
+
+    found = set()
+    for query in queries:
+        for row in conn.execute(query):
+            row = list(row)
+            found.add(Partition(row.pop(0) if week else None,
+                                row[0] if 'employee' in by else None))
+    return sorted(found, key=lambda p: (p.week or 0, p.employee_id or 0))
+
+
+def partition_name(partition):
+    """CSV file name of a partition, e.g. timesheet_2016-W10_emp3.csv"""
+    parts = ['timesheet']
+    if partition.week is not None:
+        parts.append(week_label(partition.week))
+    if partition.employee_id == UNASSIGNED:
+        parts.append('unassigned')
+    elif partition.employee_id is not None:
+        parts.append('emp{0}'.format(partition.employee_id))
+    return '_'.join(parts) + '.csv'
+
+
+def readonly_engine(db_path):
+    """Engine whose connections can only read db_path"""
+    return make_engine(db_path, readonly=True)
+
+
+_worker_engine = None
+
+
+def _open_readonly(db_path):
+    """Pool initializer: one read-only engine per worker process."""
+    global _worker_engine
+    _worker_engine = readonly_engine(db_path)
+
+
+def _export_partition(job):
+    partition, start, end, path = job
+    query = timesheet_select(start, end, partition.employee_id,
+                             partition.week)
+
+    with _worker_engine.connect() as conn:
+        stats = export_csv(conn, path, query)
+    return partition, stats.rows
+
+
+def export_partitions(db_path, folder, by=('week', 'employee'), start=None,
+                      end=None, workers=None):
+    """Write one CSV per partition of the timesheet into folder
+
+    db_path is the SQLite database file; each of `workers` processes
+    (default: one per core) opens it read-only. A manifest listing every
+    partition's file and row count is written last, to folder/MANIFEST.
+    Returns the manifest entries.
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    engine = readonly_engine(db_path)
+    try:
+        with engine.connect() as conn:
+            found = find_partitions(conn, by, start, end)
+    finally:
+        engine.dispose()
+
+    jobs = [(p, start, end, os.path.join(folder, partition_name(p)))
+            for p in found]
+    entries = []
+
+    with ProcessPoolExecutor(workers, initializer=_open_readonly,
+                             initargs=(db_path,)) as pool:
+        for partition, rows in pool.map(_export_partition, jobs,
+                                        chunksize=8):
+            entries.append({
+                'file': partition_name(partition),
+                'week': week_label(partition.week)
+                if partition.week is not None else None,
+                'employee_id': partition.employee_id,
+                'rows': rows})
+
+    tmp = os.path.join(folder, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+    os.replace(tmp, os.path.join(folder, MANIFEST))
+    return entries
+
+
+def _stored(value):
+    # A datetime as SQLAlchemy's SQLite DateTime stores it, which sorts
+    # and compares the same as the datetime.
+    return value.isoformat(' ', 'microseconds')
+
+
+def export_changes(session, path, feed='timesheet', append=False,
+                   batch=BATCH):
+    """Export rows of feed modified since the last export_changes() of it
+
+    feed is a key of CHANGE_FEEDS. The rows go to a new CSV at path, or
+    with append to the end of it. The new mark is written through session
+    and takes effect when the caller commits, so an export that fails
+    before then is simply repeated next time. Returns ExportStats.
+    """
+    model, full_select, header = CHANGE_FEEDS[feed]
+    state = session.get(ExportState, feed)
+    mark = state.mark if state is not None else None
+    done = json.loads(state.edge) if state is not None and state.edge \
+        else {}
+
+    # Fix the upper bound first: rows modified while exporting wait for
+    # the next run instead of being skipped by a mark past them.
+    newest = session.execute(select(func.max(model.modified))).scalar()
+    if newest is None:
+        newest = mark
+    query = full_select().order_by(None) \
+        .add_columns(model.id, type_coerce(model.modified, String)) \
+        .where(model.modified <= newest) \
+        .order_by(model.modified, model.id)
+    if mark is not None:
+        query = query.where(model.modified > mark - OVERLAP)
+
+    # Rows the next run reads again, from this run or still from the last.
+    floor = _stored(newest - OVERLAP) if newest is not None else None
+    edge = dict((key, modified) for key, modified in done.items()
+                if modified > floor)
+
+    def fresh(chunks):
+        for chunk in chunks:
+            rows = []
+            for row in chunk:
+                key, modified = str(row[-2]), row[-1]
+                if done.get(key) == modified:
+                    continue
+                if modified > floor:
+                    edge[key] = modified
+                rows.append(row[:-2])
+            yield rows
+
+    began = time.time()
+    rows = _write_csv(path, header, fresh(_stream(session, query, batch)),
+                      append)
+    if state is None:
+        state = ExportState(name=feed)
+        session.add(state)
+    state.mark = newest
+    state.edge = json.dumps(edge, sort_keys=True)
+    state.exported = datetime.now()
+    state.rows = rows
+    return ExportStats(path, rows, time.time() - began)
@@ -0,0 +1,217 @@
+"""
+Group commit: many small writes, one transaction and one commit.
+
+Every commit writes the WAL and takes the write lock, and with
+synchronous=FULL waits for an fsync, so a burst of clock events committed
+one at a time is capped by commits per second. A GroupCommit queue takes
+writes from any thread and hands them to a single writer thread, which
+waits up to max_delay after the first for others to join it, then makes
+up to max_batch of them in one session and commits once. submit() returns
+a Future that resolves when the write's group has committed, as durably
+as the connection profile (see connection) commits anything.
+
+A write that raises fails its whole group, so the group is rolled back
+and its writes are made again one per transaction; only the bad one
+fails. A write whose Future is cancelled before its group starts is
+dropped.
+
+GroupMetrics keeps the size and commit latency of recent groups, and how
+long writes waited for their acknowledgement.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+__all__ = ['GroupCommit', 'GroupMetrics', 'MAX_DELAY', 'MAX_BATCH']
+
+# Seconds to wait for more writes after the first of a group. Writes
+# queued while the last group committed join the next one anyway, which
+# is as much grouping as callers waiting on their acks can give; a delay
+# only helps writers that don't wait.
+MAX_DELAY = 0
+MAX_BATCH = 500
+WINDOW = 1000  # groups the latency percentiles are taken over
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+class GroupMetrics(object):
+    """Counts since startup, and sizes and latencies of the last `window`
+    groups
+
+    A write's ack time runs from submitting it to its group committing;
+    a group's commit time from starting its first write to committing.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.groups = 0
+        self.writes = 0
+        self.failed = 0
+        self.largest = 0
+        self.sizes = deque(maxlen=window)
+        self.commit_seconds = deque(maxlen=window)
+        self.ack_seconds = deque(maxlen=window * 10)
+        self._lock = threading.Lock()
+
+    def record(self, size, commit_seconds, ack_seconds):
+        with self._lock:
+            self.groups += 1
+            self.writes += size
+            self.largest = max(self.largest, size)
+            self.sizes.append(size)
+            self.commit_seconds.append(commit_seconds)
+            self.ack_seconds.extend(ack_seconds)
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def summary(self):
+        """Dict of the metrics, latencies in milliseconds"""
+        with self._lock:
+            sizes = list(self.sizes)
+            commits = list(self.commit_seconds)
+            acks = list(self.ack_seconds)
+            summary = {'groups': self.groups, 'writes': self.writes,
+                       'failed': self.failed, 'largest_group': self.largest}
+        summary['mean_group'] = round(
+            float(sum(sizes)) / len(sizes), 1) if sizes else 0.0
+        for name, values in (('commit', commits), ('ack', acks)):
+            for label, p in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+                summary['{}_{}_ms'.format(name, label)] = round(
+                    _percentile(values, p) * 1000, 1)
+        return summary
+
+    def __str__(self):
+        return ("{writes} writes in {groups} groups (mean {mean_group}, "
+                "largest {largest_group}), {failed} failed; commit p50 "
+                "{commit_p50_ms} ms p99 {commit_p99_ms} ms; ack p50 "
+                "{ack_p50_ms} ms p99 {ack_p99_ms} ms").format(
+                    **self.summary())
+
+
+class GroupCommit(object):
+    """Writer thread committing queued writes in groups
+
+    A write is a callable taking a Session from sessionmaker; whatever it
+    returns is the result of its Future. after_commit, if given, is
+    called on the writer thread with the size of each group committed.
+    """
+
+    _STOP = object()
+
+    def __init__(self, sessionmaker, max_delay=MAX_DELAY,
+                 max_batch=MAX_BATCH, after_commit=None):
+        self.sessionmaker = sessionmaker
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.after_commit = after_commit
+        self.metrics = GroupMetrics()
+        self._queue = Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='group-commit')
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def submit(self, write):
+        """Queue write; returns a Future of its result, set once the
+        write has committed"""
+        self.start()
+        future = Future()
+        self._queue.put((write, future, time.time()))
+        return future
+
+    def commit(self, write):
+        """Make write and wait for it to commit; returns its result or
+        raises what it raised"""
+        return self.submit(write).result()
+
+    def stop(self):
+        """Commit the writes still queued and stop the thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is self._STOP:
+                return
+            if not first[1].set_running_or_notify_cancel():
+                continue
+            group, stop = [first], False
+
+            deadline = time.time() + self.max_delay
+            while len(group) < self.max_batch:
+                remaining = deadline - time.time()
+                try:
+                    item = self._queue.get(timeout=remaining) \
+                        if remaining > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                if item[1].set_running_or_notify_cancel():
+                    group.append(item)
+
+            self._commit(group)
+            if stop:
+                return
+
+    def _commit(self, group):
+        started = time.time()
+        try:
+            results = self._apply([write for write, _, _ in group])
+        except Exception as e:
+            if len(group) > 1:
+                logging.warning("Group of %d writes failed (%s), making them "
+                                "one at a time", len(group), e)
+                for item in group:
+                    self._commit([item])
+                return
+            self.metrics.record_failure()
+            group[0][1].set_exception(e)
+            return
+
+        committed = time.time()
+        self.metrics.record(len(group), committed - started,
+                            [committed - queued for _, _, queued in group])
+        for (_, future, _), result in zip(group, results):
+            future.set_result(result)
+
+        if self.after_commit is not None:
+            try:
+                self.after_commit(len(group))
+            except Exception:
+                logging.exception("after_commit failed")
+
+    def _apply(self, writes):
+        session = self.sessionmaker()
+        try:
+            results = [write(session) for write in writes]
+            session.commit()
+            return results
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
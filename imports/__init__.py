@@ -0,0 +1,356 @@
+"""
+Bulk CSV import into the timesheet.
+
+Two formats are read, told apart by their header row:
+
+- the timesheet export (exports.TIMESHEET_HEADER): one row per job per
+  day, imported as timesheet rows;
+- raw clocktimes (CLOCKTIME_HEADER): one row per punch, imported as
+  clocktimes. The timesheet rows they belong to are created or topped up,
+  and so are the rollups.
+
+The file is read as a stream and handled a batch at a time. Each row is
+validated on its own, so a bad row is reported by line number and skipped
+while the rest of its batch still goes in. Job abbreviations are resolved
+through a map read once per import. Rows already in the database, or
+earlier in the file, are skipped: clocktimes by p_uuid and time in, and
+timesheet rows by job and day, whatever their p_uuid. A job can have
+several timesheet rows a day, one per sub-task in tc and one per
+employee in the server, so the n-th row of a job and day in the file is
+skipped only if the database already has n of them. A row without a key
+gets a uuid5 of its job and day, and of n after the first. A key that
+isn't a UUID is turned into one, the same way migrations convert old
+text keys.
+
+Each batch is inserted with one executemany in its own transaction.
+"""
+
+import csv
+import math
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from sqlalchemy import bindparam, func, select
+
+from exports import CLOCKTIME_HEADER, TIMESHEET_HEADER
+from models import Clocktime, Employee, Job, Timesheet, tenths_between, \
+    week_key
+import rollups
+from sqa_uuid import KEY_NAMESPACE, to_uuid
+
+__all__ = ['CLOCKTIME_HEADER', 'ImportResult', 'import_csv']
+
+BATCH = 50000
+MAX_ERRORS = 100
+# SQLite's default limit on bound parameters is 999 before 3.32.
+IN_CHUNK = 900
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class ImportResult(object):
+    """What an import did: rows read and inserted, duplicates skipped, and
+    (line, message) for the first MAX_ERRORS bad rows"""
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def __repr__(self):
+        return '<ImportResult {} {}: {} inserted, {} duplicates, {} bad>' \
+            .format(self.kind, self.path, self.inserted, self.duplicates,
+                    self.failed)
+
+
+@lru_cache(maxsize=4096)
+def day_key(abbr, day, employee_id=None):
+    """The p_uuid of a job's timesheet row for day, or of one employee's"""
+    key = '{0}|{1}'.format(abbr, day.strftime(DATE_FORMAT))
+    if employee_id is not None:
+        key += '|{0}'.format(employee_id)
+    return uuid.uuid5(KEY_NAMESPACE, key)
+
+
+@lru_cache(maxsize=4096)
+def week_ending(day):
+    """Week ending date as tc stores it: Saturday of the ISO week"""
+    return (day - timedelta(days=day.weekday()) +
+            timedelta(days=5)).strftime(DATE_FORMAT)
+
+
+def _parse_time(text):
+    """ISO date or date and time; fromisoformat is far cheaper than
+    strptime over millions of rows."""
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError("bad date/time {0!r}".format(text))
+
+
+def _sql_value(value):
+    # What SQLAlchemy's SQLite DateTime and sqa_uuid's UUID types store.
+    if isinstance(value, datetime):
+        return value.isoformat(' ', 'microseconds')
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    return value
+
+
+def _insert_many(conn, table, rows):
+    """executemany an INSERT of dict rows into table
+
+    Goes straight to the driver: for large batches SQLAlchemy's per-row
+    parameter processing costs more than SQLite's insert does. That also
+    skips column defaults, so modified is filled in here.
+    """
+    now = datetime.now()
+    columns = [c.name for c in table.columns
+               if c.name in rows[0] or c.name == 'modified']
+    conn.exec_driver_sql(
+        'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            table.name, ', '.join(columns), ', '.join('?' * len(columns))),
+        [tuple(_sql_value(row.get(c, now)) for c in columns)
+         for row in rows])
+
+
+def _existing(conn, column, values):
+    """The subset of values found in column"""
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK):
+        found.update(conn.execute(
+            select(column).where(column.in_(values[i:i + IN_CHUNK])))
+            .scalars())
+    return found
+
+
+class _Importer(object):
+
+    def __init__(self, engine, result, batch):
+        self.engine = engine
+        self.result = result
+        self.batch = batch
+        with engine.connect() as conn:
+            # Oldest job first wins for a duplicated abbreviation.
+            self.jobs = {}
+            for job_id, abbr, name, rate in conn.execute(
+                    select(Job.id, Job.abbr, Job.name, Job.rate)
+                    .order_by(Job.id.desc())):
+                self.jobs[abbr] = (job_id, name, rate)
+            self.employees = set(conn.execute(select(Employee.id)).scalars())
+
+    def run(self, reader):
+        pending = OrderedDict()
+
+        for fields in reader:
+            if not any(fields):
+                continue
+            self.result.rows += 1
+            try:
+                key, row = self.parse(fields)
+            except ValueError as e:
+                self.result.error(reader.line_num, str(e))
+                continue
+
+            if key in pending:
+                self.result.duplicates += 1
+                continue
+            pending[key] = row
+            if len(pending) >= self.batch:
+                self.flush(pending)
+                pending = OrderedDict()
+        if pending:
+            self.flush(pending)
+
+    def job(self, abbr):
+        if abbr not in self.jobs:
+            raise ValueError("unknown job {0!r}".format(abbr))
+        return self.jobs[abbr]
+
+
+class _TimesheetImporter(_Importer):
+
+    def __init__(self, engine, result, batch):
+        super(_TimesheetImporter, self).__init__(engine, result, batch)
+        self.seen = Counter()  # rows read so far per (abbr, date)
+
+    def parse(self, fields):
+        if len(fields) < 4:
+            raise ValueError("expected {0} columns, got {1}".format(
+                len(TIMESHEET_HEADER), len(fields)))
+        abbr, name, hours, day = (f.strip() for f in fields[:4])
+        week = fields[4].strip() if len(fields) > 4 else ''
+        job_name, rate = self.job(abbr)[1:]
+        day = _parse_time(day)
+        hours = float(hours)
+        if not math.isfinite(hours):
+            raise ValueError("bad hours {0}".format(hours))
+        tenths = round(hours * 10)
+        if tenths < 0:
+            raise ValueError("negative hours {0}".format(hours))
+
+        date = day.strftime(DATE_FORMAT)
+        n = self.seen[abbr, date]
+        self.seen[abbr, date] += 1
+        p_uuid = day_key(abbr, day) if not n else \
+            uuid.uuid5(KEY_NAMESPACE, '{0}|{1}#{2}'.format(abbr, date, n))
+        return (abbr, date, n), {
+            'p_uuid': p_uuid, 'abbr': abbr, 'name': name or job_name,
+            'rate': rate, 'tenths': tenths, 'date': day,
+            'week': week or week_ending(day), 'week_key': week_key(day)}
+
+    def flush(self, pending):
+        with self.engine.begin() as conn:
+            counts = self._day_counts(conn, pending)
+            for key in list(pending):
+                if key[2] < counts.get(key[:2], 0):
+                    del pending[key]
+                    self.result.duplicates += 1
+            if pending:
+                _insert_many(conn, Timesheet.__table__,
+                             list(pending.values()))
+        self.result.inserted += len(pending)
+
+    def _day_counts(self, conn, keys):
+        """Timesheet rows in the database per (abbr, date) of keys
+
+        Rows this import inserted in earlier batches count too, which is
+        what lets the rest of a day's rows in the file through.
+        """
+        days = sorted(day for _, day, _ in keys)
+        start = datetime.strptime(days[0], DATE_FORMAT)
+        end = datetime.strptime(days[-1], DATE_FORMAT) + timedelta(days=1)
+        abbrs = list(set(abbr for abbr, _, _ in keys))
+        counts = {}
+        for i in range(0, len(abbrs), IN_CHUNK):
+            day = func.date(Timesheet.date)
+            counts.update(((abbr, date), n) for abbr, date, n in conn.execute(
+                select(Timesheet.abbr, day, func.count())
+                .where(Timesheet.abbr.in_(abbrs[i:i + IN_CHUNK]),
+                       Timesheet.date >= start, Timesheet.date < end)
+                .group_by(Timesheet.abbr, day)))
+        return counts
+
+
+class _ClocktimeImporter(_Importer):
+
+    def parse(self, fields):
+        if len(fields) < len(CLOCKTIME_HEADER):
+            raise ValueError("expected {0} columns, got {1}".format(
+                len(CLOCKTIME_HEADER), len(fields)))
+        p_uuid, abbr, employee, time_in, time_out, task = \
+            (f.strip() for f in fields[:6])
+        job_id = self.job(abbr)[0]
+        time_in = _parse_time(time_in)
+        time_out = _parse_time(time_out) if time_out else None
+
+        if time_out is not None and time_out < time_in:
+            raise ValueError("time out before time in")
+        if employee:
+            employee = int(employee)
+            if employee not in self.employees:
+                raise ValueError("unknown employee {0}".format(employee))
+
+        p_uuid = to_uuid(p_uuid, KEY_NAMESPACE) if p_uuid \
+            else day_key(abbr, time_in.date())
+        return (p_uuid, time_in), {
+            'p_uuid': p_uuid, 'abbr': abbr, 'job_id': job_id,
+            'employee_id': employee or None, 'time_in': time_in,
+            'time_out': time_out, 'sub_task': task[:20] or None,
+            'tenths': tenths_between(time_in, time_out)
+            if time_out is not None else None}
+
+    def flush(self, pending):
+        with self.engine.begin() as conn:
+            existing = self._existing_times(conn, set(p for p, _ in pending))
+            for key in existing & set(pending):
+                del pending[key]
+                self.result.duplicates += 1
+            if not pending:
+                return
+
+            rows = list(pending.values())
+            _insert_many(conn, Clocktime.__table__, rows)
+            self._timesheets(conn, rows)
+            self._rollups(conn, rows)
+        self.result.inserted += len(pending)
+
+    def _existing_times(self, conn, uuids):
+        found = set()
+        uuids = list(uuids)
+        for i in range(0, len(uuids), IN_CHUNK):
+            found.update(conn.execute(
+                select(Clocktime.p_uuid, Clocktime.time_in)
+                .where(Clocktime.p_uuid.in_(uuids[i:i + IN_CHUNK]))).all())
+        return found
+
+    def _timesheets(self, conn, rows):
+        """Create missing timesheet rows with the new hours, add them onto
+        existing ones"""
+        worked = OrderedDict()
+        for row in rows:
+            first = worked.setdefault(row['p_uuid'], [row, 0])
+            first[1] += row['tenths'] or 0
+
+        missing = set(worked) - _existing(conn, Timesheet.p_uuid, worked)
+        if missing:
+            _insert_many(conn, Timesheet.__table__, [
+                {'p_uuid': p_uuid, 'abbr': row['abbr'],
+                 'name': self.jobs[row['abbr']][1],
+                 'rate': self.jobs[row['abbr']][2],
+                 'tenths': tenths, 'date': row['time_in'],
+                 'week': week_ending(row['time_in']),
+                 'week_key': week_key(row['time_in'])}
+                for p_uuid, (row, tenths) in worked.items()
+                if p_uuid in missing])
+
+        added = [{'key': p_uuid, 'added': tenths}
+                 for p_uuid, (_, tenths) in worked.items()
+                 if tenths and p_uuid not in missing]
+        if added:
+            table = Timesheet.__table__
+            conn.execute(
+                table.update()
+                .where(table.c.p_uuid == bindparam('key'))
+                .values(tenths=func.coalesce(table.c.tenths, 0) +
+                        bindparam('added')),
+                added)
+
+    def _rollups(self, conn, rows):
+        rollups.record_many(conn, [
+            (row['time_in'].date(), row['abbr'], row['employee_id'],
+             row['sub_task'], row['tenths'], 1)
+            for row in rows if row['tenths'] is not None])
+
+
+def import_csv(engine, path, batch=BATCH):
+    """Import a timesheet export or raw clocktime CSV, return ImportResult
+
+    Raises ValueError if the header matches neither format.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = tuple(h.strip() for h in next(reader, ()))
+
+        if header[:len(TIMESHEET_HEADER)] == TIMESHEET_HEADER:
+            result = ImportResult(path, 'timesheet')
+            importer = _TimesheetImporter(engine, result, batch)
+        elif header[:len(CLOCKTIME_HEADER)] == CLOCKTIME_HEADER:
+            result = ImportResult(path, 'clocktime')
+            importer = _ClocktimeImporter(engine, result, batch)
+        else:
+            raise ValueError("{0} is neither a timesheet export nor a "
+                             "clocktime CSV".format(path))
+        importer.run(reader)
+    return result
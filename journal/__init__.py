@@ -0,0 +1,284 @@
+"""
+Logical change journal for point-in-time recovery.
+
+Triggers on the journaled tables copy every inserted, updated or deleted
+row into a change_log table, inside the same transaction as the change.
+After each commit the new change_log rows are appended to an archive file
+(.backup/journal.jsonl) and removed from the database.
+
+Every record holds the full row, so replaying records is idempotent: to
+rebuild the database as of any time, restore the newest snapshot taken
+before it and replay the journal from that snapshot on. Records the
+snapshot already contains are simply written again.
+
+A recovery discards the changes made after the time it went back to. It
+leaves a marker in the archive, so a later recovery past the marker
+doesn't replay them and undo it.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from backup import replace_database
+
+__all__ = ['ChangeJournal', 'JOURNAL_NAME']
+
+JOURNAL_NAME = 'journal.jsonl'
+RECOVER = 'recover'  # op of the marker a recovery leaves
+TS_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+CHANGE_LOG_DDL = """
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    tbl TEXT NOT NULL,
+    op TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    data TEXT
+)"""
+
+TRIGGER_DDL = """
+CREATE TRIGGER pyper_journal_{table}_{op} AFTER {OP} ON {table}
+BEGIN
+    INSERT INTO change_log (ts, tbl, op, row_id, data)
+    VALUES (strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'),
+            '{table}', '{op}', {row}.id, {data});
+END"""
+
+
+# JSON can't hold a BLOB, so one goes in as {"blob": "<hex>"}.
+BLOB_JSON = ("CASE WHEN typeof({row}.{col}) = 'blob' "
+             "THEN json_object('blob', hex({row}.{col})) "
+             "ELSE {row}.{col} END")
+
+
+def _row_json(table, row):
+    """SQL building a JSON object out of every column of row (NEW/OLD)"""
+    pairs = ', '.join("'{col}', {value}".format(
+        col=column.name, value=BLOB_JSON.format(col=column.name, row=row))
+        for column in table.columns)
+    return 'json_object({})'.format(pairs)
+
+
+def _column_value(value):
+    if isinstance(value, dict):
+        return bytes.fromhex(value['blob'])
+    return value
+
+
+class ChangeJournal(object):
+    """Archive of row changes to a set of tables
+
+    journal = ChangeJournal('.backup/journal.jsonl', [Clocktime.__table__])
+    journal.install(engine)        # once per database, safe to repeat
+    journal.archive('.timesheet.db')  # after each commit
+    journal.recover(store, '.timesheet.db', until=datetime(...))
+    """
+
+    def __init__(self, path, tables):
+        self.path = path
+        self.tables = list(tables)
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        """(Re)create change_log and the triggers
+
+        Triggers are rebuilt every time so they follow schema changes to
+        the journaled tables. The journal mode is left to the engine's
+        connection profile (see connection); in WAL mode archive() reads
+        and trims change_log without holding up clock events.
+        """
+        with engine.begin() as conn:
+            conn.exec_driver_sql(CHANGE_LOG_DDL)
+
+            for table in self.tables:
+                for op, row in (('insert', 'NEW'), ('update', 'NEW'),
+                                ('delete', 'OLD')):
+                    conn.exec_driver_sql(
+                        'DROP TRIGGER IF EXISTS pyper_journal_{}_{}'.format(
+                            table.name, op))
+                    conn.exec_driver_sql(TRIGGER_DDL.format(
+                        table=table.name, op=op, OP=op.upper(), row=row,
+                        data='NULL' if op == 'delete'
+                        else _row_json(table, row)))
+
+    def attach(self, sessionmaker, db_path):
+        """Archive the change log after every commit of sessionmaker's
+        sessions."""
+        from sqlalchemy import event
+
+        def after_commit(session):
+            self.archive(db_path)
+        event.listen(sessionmaker, 'after_commit', after_commit)
+
+    def archive(self, db_path):
+        """Move committed change_log rows to the archive file
+
+        Returns the number of records archived.
+        """
+        with self._lock:
+            conn = sqlite3.connect(db_path)
+            try:
+                try:
+                    rows = conn.execute(
+                        'SELECT seq, ts, tbl, op, row_id, data '
+                        'FROM change_log ORDER BY seq').fetchall()
+                except sqlite3.OperationalError:
+                    return 0  # journal not installed in this database
+
+                if not rows:
+                    return 0
+                self._append(rows)
+                with conn:
+                    conn.execute('DELETE FROM change_log WHERE seq <= ?',
+                                 (rows[-1][0],))
+                return len(rows)
+            finally:
+                conn.close()
+
+    def _append(self, rows):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        with open(self.path, 'a') as f:
+            for seq, ts, table, op, row_id, data in rows:
+                f.write(json.dumps({
+                    'seq': seq, 'ts': ts, 'table': table, 'op': op,
+                    'id': row_id,
+                    'row': json.loads(data) if data is not None else None},
+                    sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def records(self, since=None, until=None):
+        """Archived records with since <= ts <= until, in commit order
+
+        since and until are datetimes or timestamp strings. Records are
+        stamped to the millisecond, so datetimes are cut to milliseconds.
+        """
+        since, until = (t.strftime(TS_FORMAT)[:-3] if isinstance(t, datetime)
+                        else t for t in (since, until))
+        found, recoveries = [], []
+
+        if not os.path.isfile(self.path):
+            return found
+
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['op'] == RECOVER:
+                    recoveries.append(record)
+                    continue
+                if since is not None and record['ts'] < since:
+                    continue
+                if until is not None and record['ts'] > until:
+                    continue
+                found.append(record)
+
+        # What a recovery up to until discarded is no longer history.
+        for mark in recoveries:
+            if until is None or mark['ts'] <= until:
+                found = [r for r in found
+                         if not mark['until'] < r['ts'] <= mark['ts']]
+        # A restore can archive a record a second time, after newer ones.
+        found.sort(key=lambda r: (r['ts'], r['seq']))
+        return found
+
+    def replay(self, conn, records):
+        """Apply records to an open sqlite3 connection, return the count"""
+        columns = {}
+
+        for record in records:
+            table = record['table']
+
+            if table not in columns:
+                columns[table] = [r[1] for r in conn.execute(
+                    'PRAGMA table_info({})'.format(table))]
+
+            if record['op'] == 'delete':
+                conn.execute('DELETE FROM {} WHERE id = ?'.format(table),
+                             (record['id'],))
+            else:
+                names = [c for c in columns[table] if c in record['row']]
+                conn.execute(
+                    'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+                        table, ', '.join(names), ', '.join('?' * len(names))),
+                    [_column_value(record['row'][c]) for c in names])
+        return len(records)
+
+    def recover(self, store, db_path, until=None, base=None):
+        """Rebuild db_path as it was at `until` (default: now)
+
+        Starts from `base`, a manifest entry of store, or the newest
+        snapshot taken at or before `until`, and replays the journal from
+        there. All connections to db_path must be closed. Returns the base
+        entry and the number of records replayed.
+        """
+        until = until or datetime.now()
+        base = base or store.latest(before=until)
+
+        if base is None:
+            raise ValueError("No backup taken before {}".format(until))
+        tmp = db_path + '.recover'
+        store.restore(base['name'], tmp)
+        records = self.records(since=base['time'], until=until)
+
+        conn = sqlite3.connect(tmp)
+        try:
+            with conn:
+                replayed = self.replay(conn, records)
+
+                # Everything the snapshot had pending, and everything the
+                # replay just logged, is already in the archive.
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE "
+                                "name = 'change_log'").fetchone():
+                    conn.execute('DELETE FROM change_log')
+        finally:
+            conn.close()
+        replace_database(tmp, db_path)
+        self._mark_recovery(until)
+        return base, replayed
+
+    def _mark_recovery(self, until):
+        with self._lock:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({
+                    'seq': None, 'op': RECOVER, 'table': None, 'id': None,
+                    'row': None,
+                    'ts': datetime.now().strftime(TS_FORMAT)[:-3],
+                    'until': until.strftime(TS_FORMAT)[:-3]},
+                    sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def compact(self, before):
+        """Drop archived records older than `before`, a timestamp string
+
+        Call with the time of the oldest snapshot kept: older records can
+        never be replayed onto anything.
+        """
+        with self._lock:
+            if not os.path.isfile(self.path):
+                return 0
+            tmp = self.path + '.tmp'
+            dropped = 0
+
+            with open(self.path) as f, open(tmp, 'w') as out:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    if json.loads(line)['ts'] < before:
+                        dropped += 1
+                    else:
+                        out.write(line)
+            os.replace(tmp, self.path)
+            return dropped
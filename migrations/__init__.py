@@ -0,0 +1,354 @@
+"""
+Schema upgrades for existing timesheet databases.
+
+Base.metadata.create_all() only creates missing tables, so an index or
+column added to a model never reaches a .timesheet.db created before it.
+upgrade() brings a database up to date in two parts:
+
+- The schema: every column and index declared on the models that the
+  database lacks is added, on every upgrade. SQLite adds a nullable
+  column without copying the table, and finding nothing to do costs a
+  few PRAGMAs.
+- The data: each Migration in MIGRATIONS has a version and runs once per
+  database; the schema_version table lists those applied. A Backfill
+  changes at most `batch` rows per transaction and pauses between them,
+  so a clock-in waits for about one batch, never for the whole table, and
+  an interrupted backfill picks up where it stopped.
+
+A database created from scratch has nothing to migrate; every version is
+simply recorded as applied.
+
+upgrade(engine, dry_run=True) changes nothing and returns what it would
+do, with an estimate of the rows each change touches.
+"""
+
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import column, select
+from sqlalchemy.dialects import sqlite
+
+import rollups
+from models import Base, SchemaVersion, sql_week_key
+from sqa_uuid import KEY_NAMESPACE, to_uuid
+
+__all__ = ['upgrade', 'Change', 'Migration', 'Backfill', 'Fill',
+           'MIGRATIONS', 'BATCH', 'PAUSE']
+
+BATCH = 5000
+# Seconds between backfill batches, to let waiting clock-ins have the
+# database: SQLite's busy handler polls, so without a gap the next batch
+# nearly always wins the lock again. It sleeps up to 100ms between polls.
+PAUSE = 0.1
+
+# One thing upgrade() did or, in a dry run, would do. version is None for
+# schema changes.
+Change = namedtuple('Change', 'version name rows')
+
+# Set target to value on the rows of table where target is NULL and value
+# isn't. needs names a column without which there is nothing to do.
+Fill = namedtuple('Fill', 'table target value needs')
+
+
+def _columns(conn, table):
+    """Column names of table, empty if there is no such table"""
+    return set(row[1] for row in conn.exec_driver_sql(
+        'PRAGMA table_info({})'.format(table)))
+
+
+def _count(conn, table, where='1'):
+    return conn.exec_driver_sql('SELECT count(*) FROM {} WHERE {}'.format(
+        table, where)).scalar()
+
+
+def _sql(expression):
+    return str(expression.compile(dialect=sqlite.dialect(),
+                                  compile_kwargs={'literal_binds': True}))
+
+
+def missing_columns(conn):
+    """(table, column) of model columns missing from existing tables"""
+    found = []
+    for table in Base.metadata.sorted_tables:
+        present = _columns(conn, table.name)
+        if present:
+            found.extend((table, c) for c in table.columns
+                         if c.name not in present)
+    return found
+
+
+def missing_indexes(conn):
+    """Model indexes the database lacks"""
+    present = set(conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index'").scalars())
+    return [index for table in Base.metadata.sorted_tables
+            for index in table.indexes if index.name not in present]
+
+
+def add_column(conn, table, column):
+    """ALTER TABLE ADD COLUMN: SQLite only rewrites the schema, not rows.
+
+    It can't add primary keys or unique columns; the models only ever
+    grow plain nullable ones.
+    """
+    conn.exec_driver_sql('ALTER TABLE {} ADD COLUMN {} {}'.format(
+        table.name, column.name, column.type.compile(dialect=conn.dialect)))
+
+
+class Migration(object):
+    """A data change, made once per database in a single transaction
+
+    run(conn) makes it and returns the number of rows it touched;
+    estimate(conn) counts them without changing anything, and must cope
+    with the schema changes upgrade() hasn't made yet.
+    """
+
+    def __init__(self, version, name, run, estimate):
+        self.version = version
+        self.name = name
+        self.run = run
+        self.estimate = estimate
+
+    def apply(self, engine, batch, pause=0):
+        with engine.begin() as conn:
+            rows = self.run(conn)
+            _record(conn, self, rows)
+        return rows
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(type(self).__name__, self.version,
+                                   self.name)
+
+
+class Backfill(Migration):
+    """A data change made a batch at a time, one transaction per batch
+
+    run(conn, limit) changes at most limit of the rows that still need it
+    and returns how many; it is called until it returns 0. start, if
+    given, is called before the first batch of every apply().
+    """
+
+    def __init__(self, version, name, run, estimate, start=None):
+        super(Backfill, self).__init__(version, name, run, estimate)
+        self.start = start
+
+    def apply(self, engine, batch, pause=0):
+        if self.start is not None:
+            self.start()
+        rows = 0
+        while True:
+            with engine.begin() as conn:
+                done = self.run(conn, batch)
+            if not done:
+                break
+            rows += done
+            time.sleep(pause)
+        with engine.begin() as conn:
+            _record(conn, self, rows)
+        return rows
+
+
+def _record(conn, migration, rows):
+    conn.execute(SchemaVersion.__table__.insert().values(
+        version=migration.version, name=migration.name,
+        applied=datetime.now(), rows=rows))
+
+
+def fill_columns(version, name, fills):
+    """Backfill applying each Fill in turn, with raw SQL so that column
+    onupdate defaults (modified) are left alone
+
+    Each table is walked in rowid order from where the last batch
+    stopped, so a row the Fill can't fill, such as a clocktime with no
+    matching job, is read once rather than by every batch.
+    """
+    after = {}  # Fill -> last rowid filled, for the apply() under way
+
+    def pending(conn, fill):
+        columns = _columns(conn, fill.table)
+        if not columns or (fill.needs and fill.needs not in columns):
+            return None
+        where = '({}) IS NOT NULL'.format(fill.value)
+        if fill.target in columns:
+            where = '{} IS NULL AND {}'.format(fill.target, where)
+        return where
+
+    def run(conn, limit):
+        for fill in fills:
+            where = pending(conn, fill)
+            if where is None:
+                continue
+            where = 'rowid > {} AND {}'.format(after.get(fill, 0), where)
+            last = conn.exec_driver_sql(
+                'SELECT max(rowid) FROM (SELECT rowid FROM {0} WHERE {1} '
+                'ORDER BY rowid LIMIT {2})'.format(
+                    fill.table, where, limit)).scalar()
+            if last is None:
+                continue
+            after[fill] = last
+            return conn.exec_driver_sql(
+                'UPDATE {0} SET {1} = ({2}) WHERE rowid <= {3} AND {4}'
+                .format(fill.table, fill.target, fill.value, last,
+                        where)).rowcount
+        return 0
+
+    def estimate(conn):
+        total = 0
+        for fill in fills:
+            where = pending(conn, fill)
+            if where is not None:
+                total += _count(conn, fill.table, where)
+        return total
+    return Backfill(version, name, run, estimate, start=after.clear)
+
+
+# Float hours columns replaced by integer tenths of an hour. The float
+# columns are left in place, unused.
+backfill_tenths = fill_columns(1, 'backfill_tenths', [
+    Fill(table, 'tenths', 'CAST(round({} * 10) AS INTEGER)'.format(hours),
+         hours)
+    for table, hours in (('clocktimes', 'tworked'), ('timesheet', 'worked'),
+                         ('daily_rollup', 'worked'),
+                         ('weekly_rollup', 'worked'))])
+
+
+# Tables whose p_uuid used to be 36 characters of text.
+UUID_TABLES = ['clocktimes', 'jobs', 'timesheet']
+TEXT_UUID = "typeof(p_uuid) = 'text'"
+
+
+def convert_uuids(conn, limit):
+    """Rewrite text p_uuids as the 16 bytes sqa_uuid.UUID stores
+
+    A key that isn't a UUID gets a uuid5 of its text, so rows that shared
+    one still do; an empty one becomes NULL. The column keeps its old
+    declared type, which SQLite doesn't hold BLOBs to.
+    """
+    for table in UUID_TABLES:
+        rows = conn.exec_driver_sql(
+            'SELECT id, p_uuid FROM {} WHERE {} LIMIT {}'.format(
+                table, TEXT_UUID, limit)).all()
+        if rows:
+            conn.exec_driver_sql(
+                'UPDATE {} SET p_uuid = ? WHERE id = ?'.format(table),
+                [(to_uuid(text.strip(), KEY_NAMESPACE).bytes
+                  if text.strip() else None, row_id)
+                 for row_id, text in rows])
+            return len(rows)
+    return 0
+
+
+def count_text_uuids(conn):
+    return sum(_count(conn, table, TEXT_UUID) for table in UUID_TABLES
+               if _columns(conn, table))
+
+
+def _rollups_empty(conn):
+    return not (_columns(conn, 'daily_rollup') and conn.exec_driver_sql(
+        'SELECT EXISTS (SELECT 1 FROM daily_rollup)').scalar())
+
+
+def populate_rollups(conn):
+    """Fill the rollup tables of a database that has history but no
+    rollups. One INSERT ... SELECT per table, quick enough not to need
+    batches."""
+    return rollups.rebuild(conn) if _rollups_empty(conn) else 0
+
+
+def count_rollup_sources(conn):
+    if not _rollups_empty(conn) or not _columns(conn, 'clocktimes'):
+        return 0
+    return _count(conn, 'clocktimes', 'time_out IS NOT NULL')
+
+
+# Rows from before modified times were kept are dated by when they were
+# made, so the first incremental export orders them sensibly.
+backfill_modified = fill_columns(4, 'backfill_modified', [
+    Fill('timesheet', 'modified', 'date', None),
+    Fill('clocktimes', 'modified', 'coalesce(time_out, time_in)', None)])
+
+# Clocktimes used to be written without a job_id: take the job their
+# timesheet row names.
+backfill_clocktime_jobs = fill_columns(5, 'backfill_clocktime_jobs', [
+    Fill('clocktimes', 'job_id',
+         'SELECT jobs.id FROM timesheet JOIN jobs '
+         'ON jobs.abbr = timesheet.abbr '
+         'WHERE timesheet.p_uuid = clocktimes.p_uuid '
+         'ORDER BY jobs.id LIMIT 1', None)])
+
+backfill_week_keys = fill_columns(6, 'backfill_week_keys', [
+    Fill('timesheet', 'week_key', _sql(sql_week_key(column('date'))),
+         None)])
+
+
+# In version order. A new step gets the next version; released versions
+# are never renumbered or reused.
+MIGRATIONS = [
+    backfill_tenths,
+    Backfill(2, 'convert_uuids', convert_uuids, count_text_uuids),
+    Migration(3, 'populate_rollups', populate_rollups, count_rollup_sources),
+    backfill_modified,
+    backfill_clocktime_jobs,
+    backfill_week_keys,
+]
+
+
+def _applied(conn):
+    if not _columns(conn, SchemaVersion.__tablename__):
+        return set()
+    return set(conn.execute(select(SchemaVersion.version)).scalars())
+
+
+def upgrade(engine, dry_run=False, batch=BATCH, pause=PAUSE):
+    """Bring the database's schema and data up to date
+
+    Returns a Change for everything done or, with dry_run, everything
+    that would be, with estimated rows.
+    """
+    changes = []
+
+    with engine.connect() as conn:
+        new = not _columns(conn, 'timesheet')
+        for table in Base.metadata.sorted_tables:
+            if not _columns(conn, table.name):
+                changes.append(Change(None, 'create table ' + table.name, 0))
+        for table, col in missing_columns(conn):
+            changes.append(Change(
+                None, 'add column {}.{}'.format(table.name, col.name), 0))
+        for index in missing_indexes(conn):
+            changes.append(Change(
+                None, 'create index ' + index.name,
+                _count(conn, index.table.name)
+                if _columns(conn, index.table.name) else 0))
+        pending = [m for m in MIGRATIONS if m.version not in _applied(conn)]
+
+        if dry_run:
+            return changes + [
+                Change(m.version, m.name, 0 if new else m.estimate(conn))
+                for m in pending]
+
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        for table, col in missing_columns(conn):
+            add_column(conn, table, col)
+        indexes = missing_indexes(conn)
+
+    # An index locks out writes while it reads its whole table, so each
+    # is built in a transaction of its own.
+    for index in indexes:
+        with engine.begin() as conn:
+            index.create(conn)
+        time.sleep(pause)
+
+    if new:
+        # Nothing to migrate: mark every version applied.
+        with engine.begin() as conn:
+            for migration in pending:
+                _record(conn, migration, 0)
+        return changes + [Change(m.version, m.name, 0) for m in pending]
+
+    for migration in pending:
+        changes.append(Change(migration.version, migration.name,
+                              migration.apply(engine, batch, pause)))
+    return changes
@@ -1,13 +1,62 @@
+from datetime import datetime
+
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, \
-    create_engine
-from sqlalchemy.types import DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, \
+    cast, func
+from sqlalchemy.types import Date, DateTime
 from sqlalchemy.orm import relationship
 
-engine = create_engine('sqlite:///.timesheet.db')
+from sqa_uuid import UUID
+
 Base = declarative_base()
 
-__all__ = ['Clocktime', 'Employee', 'Job']
+__all__ = ['Clocktime', 'Employee', 'Job', 'Timesheet', 'DailyRollup',
+           'WeeklyRollup', 'ExportState', 'SchemaVersion', 'week_key',
+           'week_label', 'sql_week_key', 'tenths_between', 'format_tenths']
+
+
+def week_key(day):
+    """ISO year * 100 + ISO week of day, e.g. 201602 for 2016-01-12"""
+    year, week, _ = day.isocalendar()
+    return year * 100 + week
+
+
+def week_label(key):
+    """ISO week name of a week_key(), e.g. '2016-W02'"""
+    return '{0}-W{1:02d}'.format(key // 100, key % 100)
+
+
+def sql_week_key(day):
+    """week_key() as a SQLite expression over a date/datetime column
+
+    The ISO week and year are those of the week's Thursday.
+    """
+    thursday = func.date(day, 'weekday 0', '-3 days')
+    return cast(func.strftime('%Y', thursday), Integer) * 100 + \
+        (cast(func.strftime('%j', thursday), Integer) - 1) // 7 + 1
+
+
+def tenths_between(time_in, time_out):
+    """Time worked from time_in to time_out in tenths of an hour
+
+    Rounded to the nearest 6 minutes; shorter slices still count as one
+    tenth.
+    """
+    seconds = int((time_out - time_in).total_seconds())
+    return max((seconds + 180) // 360, 1)
+
+
+def format_tenths(tenths):
+    """Tenths of an hour as hours, e.g. '1.5' for 15; '' for None"""
+    if tenths is None:
+        return ''
+    sign = '-' if tenths < 0 else ''
+    return '{0}{1}.{2}'.format(sign, *divmod(abs(tenths), 10))
+
+
+def _default_week_key(context):
+    day = context.get_current_parameters().get('date')
+    return week_key(day) if day is not None else None
 
 
 class Clocktime(Base):
@@ -20,13 +69,18 @@ class Clocktime(Base):
 
     __tablename__ = "clocktimes"
     id = Column(Integer, primary_key=True)
-    p_uuid = Column(String)
-    time_in = Column(DateTime)
+    p_uuid = Column(UUID, index=True)
+    time_in = Column(DateTime, index=True)
     time_out = Column(DateTime)
     sub_task = Column(String(20))
     employee_id = Column(Integer, ForeignKey('employees.id'))
-    job_id = Column(Integer, ForeignKey('jobs.id'))
-    tworked = Column(Float)
+    job_id = Column(Integer, ForeignKey('jobs.id'), index=True)
+    # Time worked in tenths of an hour, see tenths_between(). Replaces the
+    # float hours column tworked, which older databases still have.
+    tenths = Column(Integer)
+    # Last insert or update, for incremental exports.
+    modified = Column(DateTime, default=datetime.now, onupdate=datetime.now,
+                      index=True)
     # employee = many to one relationship with Employee
     # job = many to one relationship with Jobs
 
@@ -74,9 +128,9 @@ class Job(Base):
 
     __tablename__ = "jobs"
     id = Column(Integer, primary_key=True)
-    p_uuid = Column(String)
+    p_uuid = Column(UUID, index=True)
     name = Column(String(50))
-    abbr = Column(String(16))
+    abbr = Column(String(16), index=True)
     rate = Column(Integer)  # cents/hr
     clocktimes = relationship('Clocktime', backref='job')
 
@@ -97,13 +151,18 @@ class Timesheet(Base):
 
     __tablename__ = "timesheet"
     id = Column(Integer, primary_key=True)
-    p_uuid = Column(String)
+    p_uuid = Column(UUID, index=True)
     name = Column(String(50))
-    abbr = Column(String(16))
+    abbr = Column(String(16), index=True)
     rate = Column(Integer)  # cents/hr
-    worked = Column(Float)  # may have to use a different type here.
-    date = Column(DateTime)
-    week = Column(String(10))
+    # Tenths of an hour worked, the sum of the clocktimes' tenths.
+    # Replaces the float hours column worked.
+    tenths = Column(Integer)
+    date = Column(DateTime, index=True)
+    week = Column(String(10))  # week ending date, kept for exports
+    week_key = Column(Integer, default=_default_week_key, index=True)
+    modified = Column(DateTime, default=datetime.now, onupdate=datetime.now,
+                      index=True)
 
     def __str__(self):
         formatter = "Name: {name:<50} {abbr:>23}\n" \
@@ -112,4 +171,61 @@ class Timesheet(Base):
                                 abbr="Abbr: " + str(self.abbr),
                                 rate=self.rate / 100.0,
                                 id="ID# " + str(self.id))
-Base.metadata.create_all(engine)
\ No newline at end of file
+
+
+class DailyRollup(Base):
+    """Tenths of an hour worked per day, job, employee and sub-task
+
+    Kept up to date by rollups.record() on every clock out and rebuilt from
+    clocktimes by rollups.rebuild(). employee_id 0 and sub_task '' stand
+    for none, since NULLs can't be part of the key.
+    """
+
+    __tablename__ = "daily_rollup"
+    day = Column(Date, primary_key=True)
+    abbr = Column(String(16), primary_key=True)
+    employee_id = Column(Integer, primary_key=True)
+    sub_task = Column(String(20), primary_key=True)
+    tenths = Column(Integer)
+    punches = Column(Integer)
+
+
+class WeeklyRollup(Base):
+    """Tenths of an hour worked per ISO week, job and employee
+
+    week is week_key() of the days summed, see DailyRollup.
+    """
+
+    __tablename__ = "weekly_rollup"
+    week = Column(Integer, primary_key=True)
+    abbr = Column(String(16), primary_key=True)
+    employee_id = Column(Integer, primary_key=True)
+    tenths = Column(Integer)
+    punches = Column(Integer)
+
+
+class ExportState(Base):
+    """High-water mark of an incremental export
+
+    mark is the newest modified time already exported from the export
+    named by name, see exports.export_changes(). edge is a JSON object of
+    the id and modified time of each row exported that the next export
+    reads again, within exports.OVERLAP of mark.
+    """
+
+    __tablename__ = "export_state"
+    name = Column(String(32), primary_key=True)
+    mark = Column(DateTime)
+    exported = Column(DateTime)
+    rows = Column(Integer)
+    edge = Column(Text)
+
+
+class SchemaVersion(Base):
+    """A data migration applied to this database, see migrations."""
+
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    applied = Column(DateTime)
+    rows = Column(Integer)
@@ -0,0 +1,238 @@
+"""
+Report queries over the timesheet.
+
+Every report is a query over a date range, with optional employee and job
+filters, and all of it is pushed into SQL: the range is an indexed scan
+on timesheet.date and the sub-task is looked up per row through the
+clocktimes p_uuid index. A report therefore reads the rows it prints and
+nothing else, however long the history is.
+
+Weekly views read the pre-summed daily_rollup table instead, see rollups.
+
+Long reports are read a page at a time: timesheet_page() seeks to a page by
+its (date, id) neighbour rather than an OFFSET, so every page costs the same
+however deep into the history it is.
+
+ReportCache keeps finished reports in memory until the data under them
+changes, so flipping between views doesn't re-run anything.
+"""
+
+from collections import OrderedDict, namedtuple
+from itertools import islice
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, exists, func, select, tuple_
+
+from models import Clocktime, DailyRollup, Job, Timesheet, WeeklyRollup
+
+__all__ = ['day_range', 'week_range', 'timesheet_rows', 'timesheet_page',
+           'iter_pages', 'daily_totals', 'weekly_totals', 'Page', 'PAGE_SIZE',
+           'ReportCache']
+
+PAGE_SIZE = 50
+
+Page = namedtuple('Page', 'rows has_prev has_next')
+
+
+def day_range(day):
+    """[start, end) datetimes covering the calendar day of `day`."""
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def week_range(day):
+    """[start, end) datetimes covering the ISO week (Mon-Sun) of `day`."""
+    start = day_range(day)[0] - timedelta(days=day.weekday())
+    return start, start + timedelta(days=7)
+
+
+def timesheet_rows(session, start, end, employee_id=None, abbr=None,
+                   week=None):
+    """Timesheet rows dated in [start, end), oldest first
+
+    Each row has id, abbr, name, sub_task, tenths (of an hour worked) and
+    date; sub_task is the task of the job's latest clocktime. employee_id
+    keeps only jobs that employee clocked time on, abbr only that job,
+    week (a week_key) only that ISO week. start and end may be None for
+    no limit.
+    """
+    sub_task = select(Clocktime.sub_task) \
+        .where(Clocktime.p_uuid == Timesheet.p_uuid) \
+        .order_by(Clocktime.id.desc()) \
+        .limit(1) \
+        .scalar_subquery()
+
+    rows = session.query(Timesheet.id,
+                         Timesheet.abbr,
+                         Timesheet.name,
+                         sub_task.label('sub_task'),
+                         Timesheet.tenths,
+                         Timesheet.date)
+
+    if start is not None:
+        rows = rows.filter(Timesheet.date >= start)
+    if end is not None:
+        rows = rows.filter(Timesheet.date < end)
+
+    if week is not None:
+        rows = rows.filter(Timesheet.week_key == week)
+
+    if abbr is not None:
+        rows = rows.filter(Timesheet.abbr == abbr)
+
+    if employee_id is not None:
+        rows = rows.filter(exists().where(and_(
+            Clocktime.p_uuid == Timesheet.p_uuid,
+            Clocktime.employee_id == employee_id)))
+    return rows.order_by(Timesheet.date, Timesheet.id)
+
+
+def timesheet_page(session, start, end, after=None, before=None,
+                   limit=PAGE_SIZE, **filters):
+    """A Page of timesheet_rows(), at most limit rows
+
+    after and before are the (date, id) of a row from a neighbouring page:
+    pass the last row's key for the next page, the first row's key for the
+    previous one, neither for the first page. Filters go to timesheet_rows.
+    """
+    rows = timesheet_rows(session, start, end, **filters)
+    key = tuple_(Timesheet.date, Timesheet.id)
+
+    if before is not None:
+        rows = rows.filter(key < tuple_(*before)) \
+            .order_by(None).order_by(Timesheet.date.desc(),
+                                     Timesheet.id.desc())
+    elif after is not None:
+        rows = rows.filter(key > tuple_(*after))
+
+    # One extra row tells whether there is a page beyond this one.
+    found = rows.limit(limit + 1).all()
+    more = len(found) > limit
+    found = found[:limit]
+
+    if before is not None:
+        return Page(found[::-1], more, True)
+    return Page(found, after is not None, more)
+
+
+def iter_pages(rows, size=PAGE_SIZE):
+    """Yield lists of up to size rows from a query or any iterable
+
+    Queries are streamed from the cursor in size batches, so only one page
+    is held in memory at a time.
+    """
+    if hasattr(rows, 'yield_per'):
+        rows = rows.yield_per(size)
+    rows = iter(rows)
+
+    while True:
+        page = list(islice(rows, size))
+        if not page:
+            return
+        yield page
+
+
+def _job_name(abbr_column):
+    return select(Job.name).where(Job.abbr == abbr_column) \
+        .order_by(Job.id).limit(1).scalar_subquery()
+
+
+def daily_totals(session, start, end, employee_id=None, abbr=None):
+    """Hours per day, job and sub-task from the daily rollup, oldest first
+
+    Rows have the same fields as timesheet_rows() except id, so the same
+    code can print either.
+    """
+    rows = session.query(DailyRollup.abbr,
+                         _job_name(DailyRollup.abbr).label('name'),
+                         DailyRollup.sub_task,
+                         func.sum(DailyRollup.tenths).label('tenths'),
+                         DailyRollup.day.label('date')) \
+        .filter(DailyRollup.day >= start.date(), DailyRollup.day < end.date())
+
+    if abbr is not None:
+        rows = rows.filter(DailyRollup.abbr == abbr)
+
+    if employee_id is not None:
+        rows = rows.filter(DailyRollup.employee_id == employee_id)
+    return rows.group_by(DailyRollup.day, DailyRollup.abbr,
+                         DailyRollup.sub_task) \
+        .order_by(DailyRollup.day, DailyRollup.abbr, DailyRollup.sub_task)
+
+
+def weekly_totals(session, first_week=None, last_week=None):
+    """Weekly rollup rows, with job names, between two week_key()s."""
+    rows = session.query(WeeklyRollup.week,
+                         WeeklyRollup.abbr,
+                         _job_name(WeeklyRollup.abbr).label('name'),
+                         WeeklyRollup.employee_id,
+                         WeeklyRollup.tenths,
+                         WeeklyRollup.punches)
+
+    if first_week is not None:
+        rows = rows.filter(WeeklyRollup.week >= first_week)
+
+    if last_week is not None:
+        rows = rows.filter(WeeklyRollup.week <= last_week)
+    return rows.order_by(WeeklyRollup.week, WeeklyRollup.abbr,
+                         WeeklyRollup.employee_id)
+
+
+class ReportCache(object):
+    """LRU cache of built reports, invalidated by any write
+
+    A cached report is tagged with the database's version when it was
+    built and is only served while the version is unchanged. The version
+    combines SQLite's PRAGMA data_version, which moves when another
+    connection commits, with a counter of this process's own flushes,
+    commits and rollbacks, which data_version doesn't see.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.writes = 0
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, report)
+
+    def attach(self, sessionmaker):
+        """Count writes made through sessionmaker's sessions (or a
+        single session)."""
+        for name in ('after_flush', 'after_commit', 'after_soft_rollback'):
+            event.listen(sessionmaker, name, self._bump)
+
+    def _bump(self, session, *args):
+        self.writes += 1
+
+    def version(self, session):
+        connection = session.connection()
+        data_version = connection.exec_driver_sql(
+            'PRAGMA data_version').scalar()
+        # data_version is only comparable on the same DBAPI connection.
+        return id(connection.connection.dbapi_connection), data_version, \
+            self.writes
+
+    def get(self, session, key, build):
+        """Return the report cached under key, or build() and cache it.
+
+        The report is tagged with the version read before building, so a
+        write committed while it was built makes it stale.
+        """
+        version = self.version(session)
+        cached = self._entries.get(key)
+
+        if cached is not None and cached[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        report = build()
+        self._entries[key] = (version, report)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return report
+
+    def clear(self):
+        self._entries.clear()
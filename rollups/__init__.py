@@ -0,0 +1,92 @@
+"""
+Daily and weekly rollups of worked time, in integer tenths of an hour.
+
+Reports and summary exports read the pre-summed daily_rollup and
+weekly_rollup tables instead of scanning clocktimes. record() adds one
+clocktime slice to both tables as part of the clock out that produced it,
+record_many() a whole batch of them, e.g. from an import;
+rebuild() regenerates them from clocktimes, for existing databases or
+after clocktimes were changed by hand.
+
+Every function takes a session or connection as `bind`.
+"""
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from models import Clocktime, DailyRollup, Timesheet, WeeklyRollup, \
+    sql_week_key, week_key
+
+__all__ = ['record', 'record_many', 'rebuild']
+
+
+def _upsert(model):
+    """Statement adding tenths and punches onto a rollup row, for
+    executemany with the key, tenths and punches of each row."""
+    table = model.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[c.name for c in table.primary_key.columns],
+        set_={'tenths': table.c.tenths + stmt.excluded.tenths,
+              'punches': table.c.punches + stmt.excluded.punches})
+
+
+def record(bind, day, abbr, employee_id, sub_task, tenths, punches=1):
+    """Add a slice of worked time, in tenths of an hour, to the daily and
+    weekly rollups
+
+    Pass negative tenths and punches to take a slice back out, e.g. when a
+    clocktime is edited.
+    """
+    record_many(bind, [(day, abbr, employee_id, sub_task, tenths, punches)])
+
+
+def record_many(bind, slices):
+    """record() for many (day, abbr, employee_id, sub_task, tenths,
+    punches) slices at once, with one executemany per table."""
+    daily, weekly = {}, {}
+
+    for day, abbr, employee_id, sub_task, tenths, punches in slices:
+        for totals, key in (
+                (daily, (day, abbr, employee_id or 0, sub_task or '')),
+                (weekly, (week_key(day), abbr, employee_id or 0))):
+            worked, count = totals.get(key, (0, 0))
+            totals[key] = (worked + tenths, count + punches)
+
+    for model, totals, names in (
+            (DailyRollup, daily, ('day', 'abbr', 'employee_id', 'sub_task')),
+            (WeeklyRollup, weekly, ('week', 'abbr', 'employee_id'))):
+        if totals:
+            bind.execute(_upsert(model), [
+                dict(zip(names, key), tenths=tenths, punches=punches)
+                for key, (tenths, punches) in totals.items()])
+
+
+def rebuild(bind):
+    """Regenerate both rollup tables from clocktimes, return daily rows"""
+    abbr = func.coalesce(select(Timesheet.abbr)
+                         .where(Timesheet.p_uuid == Clocktime.p_uuid)
+                         .limit(1)
+                         .scalar_subquery(), '')
+    day = func.date(Clocktime.time_in)
+    employee = func.coalesce(Clocktime.employee_id, 0)
+    sub_task = func.coalesce(Clocktime.sub_task, '')
+    daily = select(day, abbr, employee, sub_task,
+                   func.sum(Clocktime.tenths), func.count()) \
+        .where(Clocktime.tenths.isnot(None)) \
+        .group_by(day, abbr, employee, sub_task)
+
+    bind.execute(DailyRollup.__table__.delete())
+    bind.execute(WeeklyRollup.__table__.delete())
+    rows = bind.execute(DailyRollup.__table__.insert().from_select(
+        ['day', 'abbr', 'employee_id', 'sub_task', 'tenths', 'punches'],
+        daily)).rowcount
+
+    # Weeks are summed from the (much smaller) daily table.
+    week = sql_week_key(DailyRollup.day)
+    bind.execute(WeeklyRollup.__table__.insert().from_select(
+        ['week', 'abbr', 'employee_id', 'tenths', 'punches'],
+        select(week, DailyRollup.abbr, DailyRollup.employee_id,
+               func.sum(DailyRollup.tenths), func.sum(DailyRollup.punches))
+        .group_by(week, DailyRollup.abbr, DailyRollup.employee_id)))
+    return rows
@@ -0,0 +1,399 @@
+"""
+Timeclock server: many employees clocking in and out at once.
+
+    $ python -m server [--port 8080] [--db .timesheet.db]
+
+A JSON API over HTTP/1.1, on asyncio streams, listening on localhost:
+
+    POST /clockin   {"employee_id": 3, "abbr": "PYTIME", "sub_task": "docs"}
+    POST /clockout  {"employee_id": 3}
+    GET  /status?employee_id=3
+    GET  /report?start=2016-03-07&end=2016-03-14[&employee_id=3][&abbr=X]
+    GET  /metrics
+
+A report given neither start nor end covers the current week. Errors
+come back as {"error": message} with a 4xx status.
+
+Every punch goes to a single Writer, which makes them through a
+groupcommit.GroupCommit: its thread takes all the punches waiting, waits
+up to max_delay for more, and makes up to max_batch of them in one
+transaction. A shift change of hundreds of punches costs a few commits,
+and as nothing else writes, none of them meets "database is locked". A
+punch is answered once its transaction has committed. /metrics reports
+the writer's groupcommit.GroupMetrics.
+
+Punches are stored the way imports stores clocktimes, but with a
+timesheet row per job per day for each employee, keyed by
+imports.day_key() with the employee_id, and a clocktime per punch. A
+report for an employee has only their own hours. The writer keeps each
+employee's open clocktime in memory, read from the database at startup,
+so making a punch takes one lookup of the employee and one of the job.
+
+Reports run on a pool of reader threads. In WAL mode, which
+connection.make_engine() sets by default, they don't wait for the writer.
+"""
+
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, sessionmaker
+
+import rollups
+from groupcommit import MAX_DELAY, GroupCommit
+from imports import day_key, week_ending
+from models import Clocktime, Employee, Job, Timesheet, format_tenths, \
+    tenths_between, week_key
+from reports import timesheet_rows, week_range
+
+__all__ = ['Server', 'Writer', 'Punch', 'Shift', 'RequestError', 'HOST',
+           'PORT', 'MAX_BATCH', 'MAX_DELAY']
+
+HOST = '127.0.0.1'
+PORT = 8080
+MAX_BATCH = 500
+READERS = 4
+MAX_BODY = 64 * 1024
+DATE_FORMAT = '%Y-%m-%d'
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# kind is 'in' or 'out'; time is when the request arrived.
+Punch = namedtuple('Punch', 'kind employee_id abbr sub_task time')
+# An employee's clocktime that has no time out yet.
+Shift = namedtuple('Shift', 'p_uuid abbr sub_task time_in')
+
+
+class RequestError(Exception):
+    """A request that can't be served, with the HTTP status to say so"""
+
+    def __init__(self, status, message):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+class Writer(object):
+    """The single writer: makes punches through a groupcommit.GroupCommit
+
+    Each punch is a write of its own; a group of them shares a
+    transaction. open maps employee ids to their Shift, as of the last
+    commit. after_commit, if given, is called on the writer thread with
+    the size of each group, after its punches have been answered.
+    """
+
+    def __init__(self, engine, max_batch=MAX_BATCH, max_delay=MAX_DELAY,
+                 after_commit=None):
+        self.engine = engine
+        self.open = {}
+        self.sessionmaker = sessionmaker(bind=engine)
+        event.listen(self.sessionmaker, 'after_commit', self._committed)
+        self.queue = GroupCommit(self.sessionmaker, max_delay, max_batch,
+                                 after_commit)
+        self.metrics = self.queue.metrics
+
+    async def start(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.load)
+        self.queue.start()
+
+    async def stop(self):
+        """Commit the punches still queued and stop the writer thread."""
+        await asyncio.get_running_loop().run_in_executor(None,
+                                                         self.queue.stop)
+
+    def load(self):
+        """Read every employee's open clocktime"""
+        query = select(Clocktime.employee_id, Clocktime.p_uuid,
+                       Timesheet.abbr, Clocktime.sub_task,
+                       Clocktime.time_in) \
+            .join(Timesheet, Timesheet.p_uuid == Clocktime.p_uuid) \
+            .where(Clocktime.time_out.is_(None),
+                   Clocktime.employee_id.isnot(None)) \
+            .order_by(Clocktime.id)
+
+        with self.engine.connect() as conn:
+            self.open = dict((row[0], Shift(*row[1:]))
+                             for row in conn.execute(query))
+
+    async def punch(self, punch):
+        """Make punch; return its result once committed"""
+        result = await asyncio.wrap_future(
+            self.queue.submit(lambda session: self.write(session, punch)))
+        if isinstance(result, RequestError):
+            raise result
+        return result
+
+    def write(self, session, punch):
+        """Make punch in session's transaction
+
+        Returns its result, or the RequestError refusing it: a refused
+        punch changes nothing, so the rest of its group still commits.
+        The group's shifts are kept in session.info until it commits.
+        """
+        open = session.info.get('open')
+        if open is None:
+            open = session.info['open'] = dict(self.open)
+        make = self._clock_in if punch.kind == 'in' else self._clock_out
+        try:
+            return make(session.connection(), open, punch)
+        except RequestError as e:
+            return e
+
+    def _committed(self, session):
+        open = session.info.pop('open', None)
+        if open is not None:
+            self.open = open
+
+    @staticmethod
+    def _clock_in(conn, open, punch):
+        if punch.employee_id in open:
+            raise RequestError(409, "Employee {} is already clocked in to "
+                               "{}".format(punch.employee_id,
+                                           open[punch.employee_id].abbr))
+        if conn.execute(select(Employee.id).where(
+                Employee.id == punch.employee_id)).first() is None:
+            raise RequestError(404, "No employee {}".format(
+                punch.employee_id))
+        job = conn.execute(select(Job.id, Job.name, Job.rate)
+                           .where(Job.abbr == punch.abbr)
+                           .order_by(Job.id).limit(1)).first()
+        if job is None:
+            raise RequestError(404, "No job {}".format(punch.abbr))
+
+        now = punch.time
+        p_uuid = day_key(punch.abbr, now.date(), punch.employee_id)
+        if conn.execute(select(Timesheet.id).where(
+                Timesheet.p_uuid == p_uuid)).first() is None:
+            conn.execute(Timesheet.__table__.insert().values(
+                p_uuid=p_uuid, abbr=punch.abbr, name=job.name,
+                rate=job.rate, tenths=0, date=now,
+                week=week_ending(now.date()), week_key=week_key(now)))
+        conn.execute(Clocktime.__table__.insert().values(
+            p_uuid=p_uuid, time_in=now, sub_task=punch.sub_task,
+            employee_id=punch.employee_id, job_id=job.id))
+
+        open[punch.employee_id] = Shift(p_uuid, punch.abbr, punch.sub_task,
+                                        now)
+        return {'employee_id': punch.employee_id, 'abbr': punch.abbr,
+                'sub_task': punch.sub_task, 'time_in': now.isoformat()}
+
+    @staticmethod
+    def _clock_out(conn, open, punch):
+        shift = open.pop(punch.employee_id, None)
+        if shift is None:
+            raise RequestError(409, "Employee {} is not clocked in".format(
+                punch.employee_id))
+
+        now = punch.time
+        tenths = tenths_between(shift.time_in, now)
+        conn.execute(Clocktime.__table__.update().where(
+            Clocktime.p_uuid == shift.p_uuid,
+            Clocktime.employee_id == punch.employee_id,
+            Clocktime.time_out.is_(None)).values(time_out=now,
+                                                 tenths=tenths))
+        conn.execute(Timesheet.__table__.update().where(
+            Timesheet.p_uuid == shift.p_uuid).values(
+            tenths=func.coalesce(Timesheet.tenths, 0) + tenths))
+        rollups.record(conn, shift.time_in.date(), shift.abbr,
+                       punch.employee_id, shift.sub_task, tenths)
+
+        return {'employee_id': punch.employee_id, 'abbr': shift.abbr,
+                'sub_task': shift.sub_task,
+                'time_in': shift.time_in.isoformat(),
+                'time_out': now.isoformat(), 'tenths': tenths,
+                'hours': format_tenths(tenths)}
+
+
+def _employee_id(fields):
+    try:
+        return int(fields['employee_id'])
+    except (KeyError, TypeError, ValueError):
+        raise RequestError(400, "employee_id must be an integer")
+
+
+def _date(fields, name):
+    if not fields.get(name):
+        return None
+    try:
+        return datetime.strptime(fields[name], DATE_FORMAT)
+    except ValueError:
+        raise RequestError(400, "{} must be a date, YYYY-MM-DD".format(name))
+
+
+def _json(body):
+    try:
+        fields = json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise RequestError(400, "Body must be JSON")
+    if not isinstance(fields, dict):
+        raise RequestError(400, "Body must be a JSON object")
+    return fields
+
+
+async def _read_request(reader):
+    """(method, path, query, body, keep_alive), None at end of stream"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise RequestError(400, "Bad request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise RequestError(400, "Bad Content-Length")
+    if length > MAX_BODY:
+        raise RequestError(413, "Body over {} bytes".format(MAX_BODY))
+    body = await reader.readexactly(length) if length else b''
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' \
+        else connection == 'keep-alive'
+    url = urlsplit(target)
+    query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+    return method, url.path, query, body, keep_alive
+
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n' \
+           'Content-Length: {}\r\n{}\r\n'.format(
+               status, REASONS[status], len(body),
+               '' if keep_alive else 'Connection: close\r\n')
+    return head.encode('ascii') + body
+
+
+class Server(object):
+    """The HTTP front end: routes requests to the writer and readers"""
+
+    def __init__(self, engine, host=HOST, port=PORT, max_batch=MAX_BATCH,
+                 max_delay=MAX_DELAY, after_commit=None, readers=READERS):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.writer = Writer(engine, max_batch, max_delay, after_commit)
+        self.routes = {'/clockin': ('POST', self.clock_in),
+                       '/clockout': ('POST', self.clock_out),
+                       '/status': ('GET', self.status),
+                       '/report': ('GET', self.report),
+                       '/metrics': ('GET', self.metrics)}
+        self._readers = ThreadPoolExecutor(max_workers=readers)
+        self._server = None
+
+    async def start(self):
+        """Start the writer and listen; port 0 picks a free port"""
+        await self.writer.start()
+        self._server = await asyncio.start_server(self.handle, self.host,
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.writer.stop()
+        self._readers.shutdown()
+
+    async def handle(self, reader, out):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except RequestError as e:
+                    out.write(_response(e.status, {'error': str(e)}, False))
+                    break
+                if request is None:
+                    break
+
+                method, path, query, body, keep_alive = request
+                status, payload = await self.dispatch(method, path, query,
+                                                      body)
+                out.write(_response(status, payload, keep_alive))
+                await out.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            out.close()
+
+    async def dispatch(self, method, path, query, body):
+        """(status, payload) answering a request"""
+        try:
+            if path not in self.routes:
+                raise RequestError(404, "No such endpoint {}".format(path))
+            allowed, handler = self.routes[path]
+            if method != allowed:
+                raise RequestError(405, "{} takes {}".format(path, allowed))
+            return 200, await handler(query, body)
+        except RequestError as e:
+            return e.status, {'error': str(e)}
+        except Exception:
+            logging.exception("%s %s failed", method, path)
+            return 500, {'error': "Internal error"}
+
+    async def clock_in(self, query, body):
+        fields = _json(body)
+        abbr = fields.get('abbr')
+        if not abbr:
+            raise RequestError(400, "abbr is required")
+        sub_task = fields.get('sub_task') or None
+        return await self.writer.punch(Punch(
+            'in', _employee_id(fields), str(abbr).upper(),
+            sub_task and str(sub_task)[:20], datetime.now()))
+
+    async def clock_out(self, query, body):
+        return await self.writer.punch(Punch(
+            'out', _employee_id(_json(body)), None, None, datetime.now()))
+
+    async def status(self, query, body):
+        employee_id = _employee_id(query)
+        shift = self.writer.open.get(employee_id)
+        if shift is None:
+            return {'employee_id': employee_id, 'clocked_in': False}
+        return {'employee_id': employee_id, 'clocked_in': True,
+                'abbr': shift.abbr, 'sub_task': shift.sub_task,
+                'time_in': shift.time_in.isoformat()}
+
+    async def metrics(self, query, body):
+        return self.writer.metrics.summary()
+
+    async def report(self, query, body):
+        start, end = _date(query, 'start'), _date(query, 'end')
+        if start is None and end is None:
+            # Never the whole timesheet in one response.
+            start, end = week_range(datetime.now())
+        employee_id = _employee_id(query) if query.get('employee_id') \
+            else None
+        rows = await asyncio.get_running_loop().run_in_executor(
+            self._readers, self._report_rows, start, end, employee_id,
+            query.get('abbr'))
+        total = sum(row['tenths'] or 0 for row in rows)
+        return {'rows': rows, 'tenths': total, 'hours': format_tenths(total)}
+
+    def _report_rows(self, start, end, employee_id, abbr):
+        with Session(self.engine) as session:
+            return [{'id': row.id, 'abbr': row.abbr, 'name': row.name,
+                     'sub_task': row.sub_task, 'tenths': row.tenths,
+                     'hours': format_tenths(row.tenths),
+                     'date': row.date.isoformat()}
+                    for row in timesheet_rows(session, start, end,
+                                              employee_id, abbr)]
@@ -0,0 +1,72 @@
+"""
+Run the timeclock server on a timesheet database.
+
+    $ python -m server [--db .timesheet.db] [--host 127.0.0.1] [--port 8080]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+
+from backup import BACKUP_DIR, BackupStore, BackupWorker
+from connection import make_engine
+from journal import JOURNAL_NAME, ChangeJournal
+from migrations import upgrade
+from models import Clocktime, Job, Timesheet
+from server import HOST, MAX_BATCH, MAX_DELAY, PORT, Server
+from tc import BACKUP_COMPRESSION, DB_NAME, FORMATTER_STRING, LOGFILE, \
+    LOGLEVEL
+
+parser = argparse.ArgumentParser(
+    description="Clock employees in and out over a local JSON API")
+parser.add_argument('--db', default=DB_NAME,
+                    help="timesheet database (default %(default)s)")
+parser.add_argument('--host', default=HOST,
+                    help="address to listen on (default %(default)s)")
+parser.add_argument('--port', type=int, default=PORT,
+                    help="port to listen on (default %(default)s)")
+parser.add_argument('--max-batch', type=int, default=MAX_BATCH,
+                    help="most punches per transaction (default %(default)s)")
+parser.add_argument('--max-delay', type=float, default=MAX_DELAY,
+                    help="seconds to wait for more punches to join a "
+                         "transaction (default %(default)s)")
+args = parser.parse_args()
+
+logging.basicConfig(filename=LOGFILE, format=FORMATTER_STRING,
+                    level=LOGLEVEL)
+
+engine = make_engine(args.db)
+upgrade(engine)
+
+# Journal every punch, as tc does, so db_recover can replay them.
+journal = ChangeJournal(
+    os.path.join(BACKUP_DIR, JOURNAL_NAME),
+    [Clocktime.__table__, Timesheet.__table__, Job.__table__])
+journal.install(engine)
+backup_worker = BackupWorker(
+    BackupStore(BACKUP_DIR, compression=BACKUP_COMPRESSION), args.db)
+backup_worker.request('server-start')
+
+
+async def main():
+    server = Server(engine, args.host, args.port, args.max_batch,
+                    args.max_delay,
+                    after_commit=lambda size: journal.archive(args.db))
+    await server.start()
+    print("Listening on http://{}:{}/".format(server.host, server.port))
+    logging.info("Server listening on %s:%s", server.host, server.port)
+    try:
+        await server.serve_forever()
+    finally:
+        logging.info("Punches: %s", server.writer.metrics)
+        await server.stop()
+
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    pass
+finally:
+    backup_worker.stop()
+    engine.dispose()
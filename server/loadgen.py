@@ -0,0 +1,132 @@
+"""
+Load generator for the timeclock server: shift changes, with every
+employee clocking in and back out, from many clients at once.
+
+    $ python -m server.loadgen [--clients 50] [--employees 200] [--rounds 5]
+
+Each client keeps a connection open and punches for its share of the
+employees, a request at a time. Employees 1 to --employees and the job
+--abbr must already exist.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, namedtuple
+
+from server import HOST, PORT
+
+__all__ = ['Client', 'LoadResult', 'shift_change']
+
+
+class LoadResult(namedtuple('LoadResult', 'punches seconds latencies '
+                                          'statuses')):
+    """latencies are in seconds, sorted; statuses counts replies by HTTP
+    status"""
+
+    @property
+    def rate(self):
+        return self.punches / self.seconds
+
+    def percentile(self, p):
+        return self.latencies[min(int(len(self.latencies) * p),
+                                  len(self.latencies) - 1)]
+
+    @property
+    def errors(self):
+        return sum(n for status, n in self.statuses.items() if status != 200)
+
+
+class Client(object):
+    """One keep-alive HTTP/1.1 connection to the server"""
+
+    def __init__(self, host=HOST, port=PORT):
+        self.host = host
+        self.port = port
+        self._reader = self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port)
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def request(self, method, path, payload=None):
+        """(status, decoded JSON reply)"""
+        body = json.dumps(payload).encode('utf-8') \
+            if payload is not None else b''
+        self._writer.write(
+            '{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n'
+            'Content-Length: {}\r\n\r\n'.format(
+                method, path, self.host, len(body)).encode('ascii') + body)
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        reply = await self._reader.readexactly(length)
+        return status, json.loads(reply.decode('utf-8'))
+
+
+async def _punch_for(client, employees, rounds, abbr, latencies, statuses):
+    for _ in range(rounds):
+        for employee_id in employees:
+            for path, payload in (
+                    ('/clockin', {'employee_id': employee_id, 'abbr': abbr,
+                                  'sub_task': 'load'}),
+                    ('/clockout', {'employee_id': employee_id})):
+                started = time.time()
+                status, _ = await client.request('POST', path, payload)
+                latencies.append(time.time() - started)
+                statuses[status] += 1
+
+
+async def shift_change(host=HOST, port=PORT, employees=200, clients=50,
+                       rounds=5, abbr='LOAD'):
+    """Clock employees 1 to `employees` in and out `rounds` times over
+    `clients` connections; returns a LoadResult"""
+    connections = [Client(host, port) for _ in range(clients)]
+    await asyncio.gather(*(c.connect() for c in connections))
+    latencies, statuses = [], Counter()
+    started = time.time()
+    try:
+        await asyncio.gather(*(
+            _punch_for(client, range(i + 1, employees + 1, clients), rounds,
+                       abbr, latencies, statuses)
+            for i, client in enumerate(connections)))
+    finally:
+        seconds = time.time() - started
+        await asyncio.gather(*(c.close() for c in connections))
+    return LoadResult(len(latencies), seconds, sorted(latencies), statuses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--employees', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--abbr', default='LOAD')
+    args = parser.parse_args()
+
+    result = asyncio.run(shift_change(args.host, args.port, args.employees,
+                                      args.clients, args.rounds, args.abbr))
+    print("{} punches in {:.2f} s: {:.0f}/s, p50 {:.1f} ms, p99 {:.1f} ms, "
+          "{} errors {}".format(
+              result.punches, result.seconds, result.rate,
+              result.percentile(0.5) * 1000, result.percentile(0.99) * 1000,
+              result.errors, dict(result.statuses)))
+
+
+if __name__ == '__main__':
+    main()
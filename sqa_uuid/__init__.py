@@ -2,36 +2,62 @@
 
 import uuid
 
-import sqlalchemy.dialects.postgresql
-from sqlalchemy.types import TypeEngine
-from sqlalchemy.types import String
+from sqlalchemy.types import LargeBinary
 from sqlalchemy.types import TypeDecorator
 
+__all__ = ['UUID', 'KEY_NAMESPACE', 'to_uuid']
+
+# uuid5 namespace of keys derived from text, see to_uuid().
+KEY_NAMESPACE = uuid.UUID('0c1d5e58-3e7a-5b4e-9a51-7079706572ab')
+
+
+def to_uuid(value, namespace=None):
+    """ uuid.UUID of a UUID, its text (any form uuid.UUID reads) or its
+        16 bytes. With a namespace, text that isn't a UUID is turned into
+        uuid5(namespace, text) rather than raising ValueError. """
+    if isinstance(value, uuid.UUID):
+        return value
+
+    if isinstance(value, bytes):
+        return uuid.UUID(bytes=value)
+
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        if namespace is None:
+            raise
+        return uuid.uuid5(namespace, value)
+
 
 class UUID(TypeDecorator):
-    """ Converts UUID to string before storing to database.
-        Converts string to UUID when retrieving from database. """
+    """ Stores UUIDs as 16 raw bytes, natively on Postgres.
+        Binds anything to_uuid() reads, returns uuid.UUID. """
 
-    impl = TypeEngine
+    impl = LargeBinary
+    cache_ok = True
 
     def load_dialect_impl(self, dialect):
         """ When using Postgres database, use the Postgres UUID column type.
-            Otherwise, use String column type. """
+            Otherwise, use a 16 byte BLOB. """
         if dialect.name == 'postgresql':
-            return dialect.type_descriptor(sqlalchemy.dialects.postgresql.UUID)
+            # Imported here: the dialect is slow to load and rarely used.
+            from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+            return dialect.type_descriptor(PG_UUID(as_uuid=True))
 
-        return dialect.type_descriptor(String)
+        return dialect.type_descriptor(LargeBinary(16))
 
     def process_bind_param(self, value, dialect):
-        """ When using Postgres database, no conversion.
-            Otherwise, convert to string before storing to database. """
-        if dialect.name == 'postgres':
+        """ When using Postgres database, pass a uuid.UUID through.
+            Otherwise, convert to bytes before storing to database. """
+        if value is None:
             return value
 
-        if value is None:
+        value = to_uuid(value)
+
+        if dialect.name == 'postgresql':
             return value
 
-        return str(value)
+        return value.bytes
 
     def process_result_value(self, value, dialect):
         """ When using Postgres database, no conversion.
@@ -42,4 +68,4 @@ class UUID(TypeDecorator):
         if value is None:
             return value
 
-        return uuid.UUID(value)
+        return to_uuid(value)
@@ -26,50 +26,125 @@ from datetime import datetime, timedelta, date
 import os
 import os.path
 import logging
+import threading
 import uuid
 import csv
 
-# Be more specific here..
-from decimal import *
-import shutil
-
 try:
-    from pysqlcipher import dbapi2 as sqlite
-    encryption = True
+    import readline
 except ImportError:
-    encryption = False
-    pass
-
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from models import Job, Employee, Clocktime, Timesheet
+    readline = None
 
 LOGFILE = "timeclock.log"
 FORMATTER_STRING = r"%(levelname)s :: %(asctime)s :: in " \
                    r"%(module)s | %(message)s"
 DB_NAME = ".timesheet.db"
+BACKUP_COMPRESSION = 'gzip'  # None, 'gzip' or 'lzma'
 LOGLEVEL = logging.INFO
-logging.basicConfig(filename=LOGFILE, format=FORMATTER_STRING, level=LOGLEVEL)
 
 day_start = datetime.now()
 week_num = datetime.date(day_start).isocalendar()[1]
 # TODO: Move to a SQLCipher format for security.
 
-if encryption is True:
-    print("\n***PYPER TIMESHEET UTILITY***")
-    DB_NAME = ".timesheet.db"
-    engine = create_engine('sqlite:///.timesheet.db')
-
-else:
-    print(
-        "WARNING: Unencrypted session. Install pysqlcipher3 to enable\n"
-        "encryption\n")
-    DB_NAME = ".timesheet.db"
-    engine = create_engine('sqlite:///{}'.format(DB_NAME))
-
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# The database layer. SQLAlchemy and the packages built on it take about
+# half a second to import, so importing tc leaves these unset and
+# start_database() loads them on a thread while the menu is drawn.
+engine = DBSession = session = None
+backups = backup_worker = journal = catalog = report_cache = None
+clock_queue = None
+_ready = threading.Event()
+_startup = None
+_startup_error = []
+# The startup backup or pruning's error, warned of once by database().
+_maintenance_error = []
+
+
+def load_database():
+    """Import the database layer, open DB_NAME and bring it up to date."""
+    global exists, func, sessionmaker, Job, Employee, \
+        Clocktime, Timesheet, DailyRollup, WeeklyRollup, week_key, \
+        week_label, tenths_between, format_tenths, RetentionPolicy, \
+        exports, imports, reports, rollups, engine, DBSession, session, \
+        backups, backup_worker, journal, catalog, report_cache, clock_queue
+
+    from sqlalchemy import exists, func
+    from sqlalchemy.orm import sessionmaker
+
+    from models import Job, Employee, Clocktime, Timesheet, DailyRollup, \
+        WeeklyRollup, week_key, week_label, tenths_between, format_tenths
+    from backup import BackupStore, BackupWorker, RetentionPolicy, \
+        BACKUP_DIR
+    from journal import ChangeJournal, JOURNAL_NAME
+    from migrations import upgrade
+    from catalog import JobCatalog
+    from connection import make_engine
+    from groupcommit import GroupCommit
+    import exports
+    import imports
+    import reports
+    import rollups
+
+    engine = make_engine(DB_NAME)
+    upgrade(engine)
+
+    DBSession = sessionmaker(bind=engine)
+    session = DBSession()
+    backups = BackupStore(BACKUP_DIR, compression=BACKUP_COMPRESSION)
+    backup_worker = BackupWorker(backups, DB_NAME)
+    journal = ChangeJournal(
+        os.path.join(BACKUP_DIR, JOURNAL_NAME),
+        [Clocktime.__table__, Timesheet.__table__, Job.__table__])
+    journal.install(engine)
+    journal.attach(DBSession, DB_NAME)
+    catalog = JobCatalog(session)
+    report_cache = reports.ReportCache()
+    report_cache.attach(DBSession)
+    # One snapshot per group of clock events rather than one per event.
+    clock_queue = GroupCommit(
+        DBSession, after_commit=lambda size: sqlite3_backup('clock_events'))
+
+
+def start_database():
+    """Run load_database() and then the startup backup and pruning on a
+    background thread. database() waits for the first part. Errors are
+    logged rather than let print over the menu; database() raises one
+    that stopped the database loading and warns of a failed backup."""
+    global _startup
+
+    def run():
+        try:
+            load_database()
+        except Exception as e:
+            logging.exception("Could not open %s", DB_NAME)
+            _startup_error.append(e)
+            return
+        finally:
+            _ready.set()
+        try:
+            sqlite3_backup('startup')
+            clean_data()
+        except Exception as e:
+            logging.exception("Startup backup failed")
+            _maintenance_error.append(e)
+
+    _startup = threading.Thread(target=run, name='startup')
+    _startup.daemon = True
+    _startup.start()
+
+
+def database():
+    """Wait until the database is loaded, loading it here if
+    start_database() never ran; re-raises whatever stopped it loading.
+    A failed startup backup or pruning only gets a warning, once."""
+    if _startup is None and not _ready.is_set():
+        load_database()
+        _ready.set()
+    _ready.wait()
+    if _startup_error:
+        raise _startup_error[0]
+    if _maintenance_error:
+        print("Warning: startup backup failed ({0}), see {1}".format(
+            _maintenance_error.pop(), LOGFILE))
 
 
 def query():
@@ -133,18 +208,20 @@ def job_newline(
 
     # Set up the table row and commit.
     new_task_time = Timesheet(
-        p_uuid=str(p_uuid),
+        p_uuid=p_uuid,
         abbr=abbrev,
         name=project_name,
         date=today,
-        week=current_week)
+        week=current_week,
+        week_key=week_key(today))
     if new is True:
         new_job = Job(
-            p_uuid=str(p_uuid),
+            p_uuid=p_uuid,
             abbr=abbrev,
             name=project_name,
             rate=p_rate)
         session.add(new_job)
+        catalog.invalidate()
 
     if new_task is True:
         new_task = input("Current sub-task: ")
@@ -169,31 +246,6 @@ def project_start(project_name, status, start_time, p_uuid):
     functions.
     """
 
-    abbr = []
-    joblist = []
-    subtask = []
-
-    if encryption is True:
-        # Might have to go raw sql here.
-        sel = session.query(Timesheet).order_by(Timesheet.id.desc()).all()
-        job_sel = session.query(Job).order_by(Job.id.desc()).all()
-        clk_sel = session.query(Clocktime).order_by(Clocktime.id.desc()).all()
-
-    else:
-        sel = session.query(Timesheet).order_by(Timesheet.id.desc()).all()
-        job_sel = session.query(Job).order_by(Job.id.desc()).all()
-        clk_sel = session.query(Clocktime).order_by(Clocktime.id.desc()).all()
-
-    # Create a list of job ids, to check if new job has already been entered.
-    for i in sel:
-        abbr.append(i.abbr)
-
-    for i in job_sel:
-        joblist.append(i.abbr)
-
-    for i in clk_sel:
-        subtask.append(i.sub_task)
-
     if status == 1:
         input(
             "\nYou're already in a task."
@@ -203,13 +255,13 @@ def project_start(project_name, status, start_time, p_uuid):
 
     else:
         logging.debug("project_start called")
-        abbrev = input('\nWhat are you working on? (Job ID): ')
+        abbrev = prompt_job_id()
 
         # Check if user has previously worked under this abbrev, and prompt to
-        # reuse information if so.
-        if abbrev in abbr:
+        # reuse information if so. Both lookups are single index probes.
+        if session.query(exists().where(Timesheet.abbr == abbrev)).scalar():
 
-            if abbrev in joblist:
+            if catalog.get(abbrev):
                 job = session.query(Timesheet).filter(
                     Timesheet.abbr == abbrev).order_by(
                     Timesheet.id.desc()).first()
@@ -297,25 +349,47 @@ def project_start(project_name, status, start_time, p_uuid):
                 True)
 
 
-# TODO: Implement these functions
+def prompt_job_id():
+    """
+    Asks for a job ID, with tab completion over the known job IDs. An
+    unknown ID that looks like an existing job gets a "did you mean"
+    prompt; otherwise it is returned as typed, to start a new job.
+    """
+    if readline is not None:
+        readline.set_completer(catalog.completer)
+        readline.parse_and_bind('tab: complete')
+
+    abbrev = input('\nWhat are you working on? (Job ID): ')
+
+    if abbrev and not catalog.get(abbrev):
+        guess = catalog.suggest(abbrev)
+
+        if guess is not None:
+            print("Did you mean {0} ({1})? (y/N)".format(guess.abbr,
+                                                         guess.name))
+            if query():
+                abbrev = guess.abbr
+    return abbrev
+
+
 def get_job_by_abbr(abbr):
-    jobs = session.query(Job).filter_by(abbr=abbr).all()
+    entries = catalog.get(abbr)
 
-    if len(jobs) > 1:
+    if len(entries) > 1:
 
         # two jobs with the same abbr in here -- should this be unique? If not:
-        for idx, job in enumerate(jobs, start=1):
-            print("{idx}. {job.name}".format(idx=idx, job=job))
+        for idx, entry in enumerate(entries, start=1):
+            print("{idx}. {entry.name}".format(idx=idx, entry=entry))
         selection = input("Which job? ")
-        job = jobs[int(selection) - 1]
+        entry = entries[int(selection) - 1]
 
-    elif len(jobs) == 1:
-        job = jobs[0]
+    elif len(entries) == 1:
+        entry = entries[0]
 
     else:
         return None
         # TODO: no jobs found with that info -- what do we do?
-    return job
+    return session.get(Job, entry.id)
 
 
 def round_to_nearest(num, b):
@@ -355,16 +429,17 @@ def clockin(p_uuid, project_name, sub_task):
 
     :return: None
     """
-    """Backup db"""
-    bk_reason = 'clockin_{0}'.format(project_name)
-    sqlite3_backup(bk_reason)
+    # Record the job id too, for analytics grouped by job.
+    sheet = session.query(Timesheet.abbr).filter(
+        Timesheet.p_uuid == p_uuid).first()
+    jobs = catalog.get(sheet.abbr) if sheet is not None else []
 
     new_task_clock = Clocktime(
-        p_uuid=str(p_uuid),
+        p_uuid=p_uuid,
         time_in=datetime.now(),
-        sub_task=sub_task)
-    session.add(new_task_clock)
-    session.commit()
+        sub_task=sub_task,
+        job_id=jobs[0].id if jobs else None)
+    clock_queue.commit(lambda writer: writer.add(new_task_clock))
     main_menu(project_name, 1, datetime.now(), p_uuid)
 
 
@@ -378,11 +453,6 @@ def clockout(project_name, status, p_uuid):
     :return:
     """
 
-    context = Context(prec=3, rounding=ROUND_DOWN)
-    setcontext(context)
-    _sum_time = Decimal(0.0)
-    sqlite3_backup('clockout')
-
     if status == 0:
         input(
             "You're not currently in a job. Press enter to return to main menu")
@@ -390,10 +460,12 @@ def clockout(project_name, status, p_uuid):
 
     else:
         sel_job = session.query(Timesheet).filter(
-            Timesheet.p_uuid == str(p_uuid)).first()
+            Timesheet.p_uuid == p_uuid).first()
         job_name = sel_job.name
         job_abbrev = sel_job.abbr
-        sel_clk = session.query(Clocktime).order_by(Clocktime.id.desc()).first()
+        sel_clk = session.query(Clocktime).filter(
+            Clocktime.p_uuid == p_uuid).order_by(
+            Clocktime.id.desc()).first()
         clk_id = sel_clk.id
         start_time = sel_clk.time_in
 
@@ -411,34 +483,20 @@ def clockout(project_name, status, p_uuid):
                     now.month,
                     now.year))
 
-            # Get difference between start time and now, and then convert to tenths
-            # of an hour.
-            diff = datetime.now() - start_time
-            time = Decimal(diff.seconds / 3600)
-
-            # Short tasks (6 minutes or less) still count as .1 of an hour per my
-            # company's policy.
-            if time < .1:
-                time = Decimal(0.1)
-
-            time_worked = Decimal(round_to_nearest(diff.seconds, 360)) / 3600
-            if time_worked < .1:
-                time_worked = Decimal(0.1)
+            # Get difference between start time and now in tenths of an
+            # hour. Short tasks (6 minutes or less) still count as .1 of an
+            # hour per my company's policy.
+            diff = now - start_time
+            tenths = tenths_between(start_time, now)
 
             if debug == 1:
                 print(
                     "Variables -- Start Time {0}. Current Time: {1}. Diff: {2}. "
-                    "Time: {3}".format(start_time, datetime.now()
-                                       , diff, time_worked))
-
-                print('diff.seconds = {0}'.format(diff.seconds))
-                print('time = {0}'.format(time))
+                    "Tenths: {3}".format(start_time, now, diff, tenths))
                 input("Press enter to continue.")
             print(
                 "Enjoy! You worked {0} hours on {1}.".format(
-                    round(
-                        time_worked,
-                        1),
+                    format_tenths(tenths),
                     job_name))
             input("\nPress enter to return to main menu.")
             status = 0
@@ -447,46 +505,24 @@ def clockout(project_name, status, p_uuid):
             Need to match with current pid so that not all
             clock activities for the job are written to.
             """
-            session.query(Clocktime). \
-                filter(Clocktime.id == clk_id). \
-                update({"time_out": now}, synchronize_session='fetch')
-
-            session.query(Clocktime).filter(
-                Clocktime.id == clk_id).update(
-                {'tworked': Decimal(time_worked)}, synchronize_session='fetch')
-
-            session.commit()
-
-            # Get all rows in clocktime for current job, by p_uuid and then sum
-            # these tenths of an hour.
-            tworked = session.query(Clocktime).filter(
-                Clocktime.p_uuid == str(p_uuid)).order_by(
-                Clocktime.id.desc()).all()
-
-            for i in tworked:
-
-                if i.tworked is not None:
-                    worked = Decimal(i.tworked)
-                    _sum_time += worked
-
-                if debug == 1:
-                    print(
-                        "Debugging: sum of time for {0} is {1}".format(
-                            i.job_id,
-                            _sum_time))
-                    input('Press enter to continue')
-
-            # Round the sum of tenths of an hour worked to the nearest tenth and
-            # then update to job table.
-            sum_time = Decimal(round_to_nearest(_sum_time, Decimal('0.1')))
-            # Round number down to nearest tenth of an hour.
-
-            # sum_time = Decimal(math.floor(sum_time * 10) / 10)
-            session.query(Timesheet). \
-                filter(Timesheet.p_uuid == str(p_uuid)). \
-                update({"worked": sum_time}, synchronize_session='fetch')
-
-            session.commit()
+            def write(writer):
+                writer.query(Clocktime). \
+                    filter(Clocktime.id == clk_id). \
+                    update({"time_out": now, "tenths": tenths},
+                           synchronize_session=False)
+
+                # Add this slice to the job's running total instead of
+                # summing every clocktime for the p_uuid again.
+                writer.query(Timesheet). \
+                    filter(Timesheet.p_uuid == p_uuid). \
+                    update({"tenths":
+                            func.coalesce(Timesheet.tenths, 0) + tenths},
+                           synchronize_session=False)
+                rollups.record(writer, start_time.date(), job_abbrev,
+                               sel_clk.employee_id, sel_clk.sub_task, tenths)
+
+            clock_queue.commit(write)
+            session.expire_all()
             main_menu(project_name, status, start_time, None)
 
         else:
@@ -624,7 +660,9 @@ def report(project_name, status, start_time, p_uuid):
         print("Timesheet Viewer\n"
               "1. Weekly Timesheet\n"
               "2. Daily Timesheet\n"
-              "3. Main Menu\n")
+              "3. Past Week\n"
+              "4. Date Range\n"
+              "5. Main Menu\n")
 
         answer = input('>>> ')
 
@@ -634,30 +672,26 @@ def report(project_name, status, start_time, p_uuid):
         elif answer.startswith('2'):
             daily_report(project_name, status, start_time, p_uuid)
 
+        elif answer.startswith('3'):
+            past_week_report(project_name, status, start_time, p_uuid)
 
-def week_report(project_name, status, start_time, p_uuid):
-    """
-    Function to generate report for current week.
-    :return: Print report for current week.
-    """
-    os.system('cls' if os.name == 'nt' else 'clear')
-    current_week = get_week_days(day_start.year, week_num)
+        elif answer.startswith('4'):
+            range_report(project_name, status, start_time, p_uuid)
 
-    # Queries job table, pulling all rows.
-    time_worked = session.query(Timesheet).all()
-    tasks = session.query(Clocktime).all()
+        elif answer.startswith('5'):
+            main_menu(project_name, status, start_time, p_uuid)
 
-    for i in tasks:
-        task = {'p_uuid': i.p_uuid, 'task': i.sub_task}
 
-    print("\n  Weekly Timesheet Report\n")
+def print_report_header(title):
+    os.system('cls' if os.name == 'nt' else 'clear')
+    print("\n  {0}\n".format(title))
     print(
         "\n{:<18} {:<18} {:18} {:<18} {:<1}".format(
             'Id',
             'Job Name',
             'Task',
             'Hours',
-            'End of Week'))
+            'Date'))
     print(
         "{:<18} {:<18} {:<18} {:<18} {:<1}".format(
             '========',
@@ -666,23 +700,103 @@ def week_report(project_name, status, start_time, p_uuid):
             '==========',
             '=========='))
 
-    # Print jobs for current week.
-    for i in time_worked:
-        day = i.date.strftime('%Y-%m-%d')
 
-        if datetime.date(datetime.strptime
-                         (i.week, '%Y-%m-%d')) == current_week:
-            worked = str(i.worked)
+def print_report_rows(rows):
+    for i in rows:
+        print(
+            "{:<18} {:<18} {:<18} {:<18} {:<1}".format(
+                i.abbr,
+                i.name,
+                str(i.sub_task),
+                format_tenths(i.tenths),
+                i.date.strftime('%Y-%m-%d')))
 
-            if i.p_uuid == task['p_uuid']:
-                _task = task['task']
-            print(
-                "{:<18} {:<18} {:<18} {:<18} {:<1}".format(
-                    i.abbr,
-                    i.name,
-                    _task,
-                    worked,
-                    day))
+
+def print_report(title, rows):
+    """Prints rows from reports.timesheet_rows or daily_totals under title,
+    a screen at a time."""
+    print_report_header(title)
+
+    for n, page in enumerate(reports.iter_pages(rows)):
+        if n and input("\nEnter for more, q to stop: ").lower() \
+                .startswith('q'):
+            return
+        print_report_rows(page)
+
+
+def page_report(title, start, end, fetch=None, **filters):
+    """Prints timesheet rows in [start, end) a page at a time, letting the
+    user move to the next or previous page. Pages are read through fetch,
+    cached_rows by default."""
+    fetch = fetch or cached_rows
+    page = fetch(reports.timesheet_page, start, end, **filters)
+
+    while True:
+        print_report_header(title)
+        print_report_rows(page.rows)
+
+        moves = [m for m, ok in (('n', page.has_next), ('p', page.has_prev))
+                 if ok]
+        if not moves or not page.rows:
+            return
+        answer = input("\n{0}, enter to finish: ".format(
+            ", ".join({'n': "[n]ext", 'p': "[p]revious"}[m] for m in moves)))
+        answer = answer[:1].lower()
+
+        if answer == 'n' and page.has_next:
+            last = page.rows[-1]
+            page = fetch(reports.timesheet_page, start, end,
+                         after=(last.date, last.id), **filters)
+        elif answer == 'p' and page.has_prev:
+            first = page.rows[0]
+            page = fetch(reports.timesheet_page, start, end,
+                         before=(first.date, first.id), **filters)
+        else:
+            return
+
+
+def report_rows(build, *args, **kwargs):
+    """Rows of build(session, ...), a reports query or Page, read afresh.
+    A query is returned unread, for print_report to stream from the
+    cursor a screen at a time."""
+    return build(session, *args, **kwargs)
+
+
+def cached_rows(build, *args, **kwargs):
+    """Rows of build(session, ...), a reports query, served from the cache
+    while nothing has been written since they were read.
+
+    The rows are read into a list to be cached, so this is for the short
+    views that get looked at again and again; reports over any range the
+    user picks go through report_rows.
+    """
+    key = (build.__name__, args, tuple(sorted(kwargs.items())))
+
+    def load():
+        rows = build(session, *args, **kwargs)
+        return rows.all() if hasattr(rows, 'all') else rows
+    return report_cache.get(session, key, load)
+
+
+def ask_date(prompt):
+    """Prompts for a YYYY-MM-DD date, returns a datetime or None."""
+    answer = input(prompt)
+
+    try:
+        return datetime.strptime(answer.strip(), '%Y-%m-%d')
+    except ValueError:
+        print("Check format and try again. (YYYY-MM-DD)")
+        return None
+
+
+def week_report(project_name, status, start_time, p_uuid):
+    """
+    Function to generate report for current week.
+    :return: Print report for current week.
+    """
+    start, end = reports.week_range(datetime.today())
+    print_report("Weekly Timesheet Report",
+                 cached_rows(reports.daily_totals, start, end))
     input("\nPress enter to return to main menu.")
     main_menu(project_name, status, start_time, p_uuid)
 
@@ -696,51 +810,37 @@ def daily_report(project_name, status, start_time, p_uuid):
     :param p_uuid: passthru for main menu
     :return: Print report
     """
+    start, end = reports.day_range(datetime.today())
+    page_report("Daily Timesheet Report", start, end)
+    input("\nPress enter to return to main menu.")
 
-    today = datetime.today().strftime('%Y-%m-%d')
-    os.system('cls' if os.name == 'nt' else 'clear')
-    # Queries job table, pulling all rows.
-    time_worked = session.query(Timesheet).all()
-    tasks = session.query(Clocktime).all()
-
-    print("\n  Daily Timesheet Report\n")
-    print(
-        "\n{:<18} {:<18} {:18} {:<18}".format(
-            'Id',
-            'Job Name',
-            'Task',
-            'Hours'))
-    print(
-        "{:<18} {:<18} {:<18} {:<18}".format(
-            '========',
-            '==========',
-            '==========',
-            '=====',
-            '=========='))
-
-    # Print jobs for current day.
-    for i in tasks:
-        task = {'p_uuid': i.p_uuid, 'task': i.sub_task}
+    main_menu(project_name, status, start_time, p_uuid)
 
-    for i in time_worked:
 
-        worked = str(i.worked)
-        date = i.date.strftime('%Y-%m-%d')
+def past_week_report(project_name, status, start_time, p_uuid):
+    """Report for the week containing a date the user enters."""
+    day = ask_date("Any date in the week (YYYY-MM-DD): ")
 
-        if date == today:
+    if day is not None:
+        start, end = reports.week_range(day)
+        print_report("Week of {0} Timesheet Report".format(
+            start.strftime('%Y-%m-%d')),
+            report_rows(reports.daily_totals, start, end))
+    input("\nPress enter to return to main menu.")
+    main_menu(project_name, status, start_time, p_uuid)
 
-            if i.p_uuid == task['p_uuid']:
-                task = task['task']
 
-            print(
-                "{:<18} {:<18} {:<18} {:<18}".format(
-                    i.abbr,
-                    i.name,
-                    task,
-                    worked))
+def range_report(project_name, status, start_time, p_uuid):
+    """Report for a date range, optionally for one job."""
+    first = ask_date("First date (YYYY-MM-DD): ")
+    last = ask_date("Last date (YYYY-MM-DD): ") if first else None
 
+    if first is not None and last is not None:
+        abbr = input("Job ID (enter for all jobs): ") or None
+        page_report("{0} to {1} Timesheet Report".format(
+            first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')),
+            first, reports.day_range(last)[1], fetch=report_rows, abbr=abbr)
     input("\nPress enter to return to main menu.")
-
     main_menu(project_name, status, start_time, p_uuid)
 
 
@@ -762,15 +862,17 @@ def config(project_name, status, start_time, p_uuid):
         :return:
         """
         # Set current week, and lists
-        current_week = datetime.now().isocalendar()[1]
+        week_start, week_end = reports.week_range(datetime.now())
         clk_list = []
 
         # Create backup of DB, entitled 'backup_data'.
         sqlite3_backup('clocktime_edit')
 
-        # Sort Job and clocktime tables by date.
-        sel_clk = session.query(Clocktime).order_by(
-            Clocktime.time_in.desc()).all()
+        # This week's clocktimes, newest first, off the time_in index.
+        sel_clk = session.query(Clocktime).filter(
+            Clocktime.time_in >= week_start,
+            Clocktime.time_in < week_end).order_by(
+            Clocktime.time_in.desc())
 
         # TODO: Create menu.
         # Print clocktime and job rows.
@@ -779,13 +881,9 @@ def config(project_name, status, start_time, p_uuid):
             id = i.id
             time_in = i.time_in.strftime('%Y-%m-%d @ %I:%M %p')
             time_out = i.time_out.strftime('%Y-%m-%d @ %I:%M %p')
-            day = i.time_in.strftime('%Y-%m-%d')
-            week = i.time_in.isocalendar()[1]
+            print('ID: {0}, Time in: {1}, Time out: {2}'.format(id, time_in, time_out))
 
-            if week == current_week:
-                print('ID: {0}, Time in: {1}, Time out: {2}'.format(id, time_in, time_out))
-
-                clk_list.append(i.id)
+            clk_list.append(i.id)
 
         edit_id = input("\nEnter the ID for the line you would like to edit: ")
 
@@ -808,19 +906,13 @@ def config(project_name, status, start_time, p_uuid):
         prompt for fields if none are provided
         """
 
-        # Create list of current jobs for duplicate checking.
-        job_sel = session.query(Job).order_by(Job.id.desc()).all()
-        joblist = []
-
-        for i in job_sel:
-            joblist.append(i.abbr)
-
         if not kwargs:
             fields = ['name', 'abbr', 'rate']
             kwargs = {field: input("{}: ".format(field)) for
                       field in fields}
 
-            if kwargs['name'] not in joblist:
+            # Duplicate check against the cached job catalog.
+            if not catalog.get(kwargs['abbr']):
                 # store rate as int of cents/hour
                 kwargs['rate'] = int(kwargs['rate']) * 100
             else:
@@ -828,6 +920,7 @@ def config(project_name, status, start_time, p_uuid):
                 main_menu(project_name, status, start_time, p_uuid)
         new_job = Job(**kwargs)
         session.add(new_job)
+        catalog.invalidate()
         return kwargs
 
     def add_employee(**kwargs):
@@ -881,6 +974,7 @@ def config(project_name, status, start_time, p_uuid):
 
         if confirm == 'y':
             change_table_value(job_to_edit, val_to_change, new_val)
+            catalog.invalidate()
 
         else:
             print("Cancelled")
@@ -910,9 +1004,14 @@ def config(project_name, status, start_time, p_uuid):
               "3. Employees\n"
               "4. Delete Tables\n"
               "5. Back Up Tables\n"
-              "6. Back\n")
+              "6. Rebuild Report Tables\n"
+              "7. Recover Tables From Backup\n"
+              "8. Back\n")
         answer = input(">>> ")
 
+        if answer[:1] in ('1', '2', '3', '4', '5', '6', '7'):
+            database()
+
         if answer.startswith('1'):
             while True:
                 jobs = session.query(Job).all()
@@ -980,7 +1079,10 @@ def config(project_name, status, start_time, p_uuid):
                     session.query(Clocktime).delete()
                     session.query(Job).delete()
                     session.query(Timesheet).delete()
+                    session.query(DailyRollup).delete()
+                    session.query(WeeklyRollup).delete()
                     session.commit()
+                    catalog.invalidate()
 
                 else:
                     main_menu(project_name, status, start_time, p_uuid)
@@ -992,25 +1094,119 @@ def config(project_name, status, start_time, p_uuid):
             raise NotImplementedError
 
         elif answer.startswith('6'):
+            days = rollups.rebuild(session)
+            session.commit()
+            input("Rebuilt {} daily totals. Press enter to continue."
+                  .format(days))
+
+        elif answer.startswith('7'):
+            db_recover(project_name, status, start_time, p_uuid)
+
+        elif answer.startswith('8'):
             break  # kick out of config function
 
 
 def export_timesheet(project_name, status, start_time, p_uuid):
     """
-    Export timesheet to a formatted CSV file. Use all dates.
+    Export timesheet to a formatted CSV file, for all dates or a range.
     :return: None
     """
+    start = end = None
 
-    outfile = open('PyperTimesheet.csv', 'wt')
-    outcsv = csv.writer(outfile)
-    time_worked = session.query(Timesheet).all()
-    header = ('Id', 'Job Name', 'Hours Worked', 'Date', 'Week Ending')
-    outcsv.writerow(header)
+    if input("Export a date range? (y/N) ").lower().startswith('y'):
+        start = ask_date("First date (YYYY-MM-DD): ")
+        last = ask_date("Last date (YYYY-MM-DD): ") if start else None
+        if last is None:
+            input("Press enter to return to main menu.")
+            main_menu(project_name, status, start_time, p_uuid)
+        end = reports.day_range(last)[1]
 
-    for i in time_worked:
-        outcsv.writerow(
-            [i.abbr, i.name, i.worked, datetime.date(i.date), i.week])
-    outfile.close()
+    stats = exports.export_csv(session, 'PyperTimesheet.csv',
+                               exports.timesheet_select(start, end))
+    input("Exported {0} rows ({1:.0f} rows/s). Press enter to return to "
+          "main menu.".format(stats.rows, stats.rate))
+    main_menu(project_name, status, start_time, p_uuid)
+
+
+def export_weekly_summary(project_name, status, start_time, p_uuid):
+    """
+    Export hours per ISO week, job and employee from the weekly rollup.
+    :return: None
+    """
+
+    with open('PyperWeeklySummary.csv', 'wt') as outfile:
+        outcsv = csv.writer(outfile)
+        outcsv.writerow(('Week', 'Id', 'Job Name', 'Employee',
+                         'Hours Worked', 'Punches'))
+
+        for i in reports.weekly_totals(session):
+            outcsv.writerow([week_label(i.week),
+                             i.abbr, i.name, i.employee_id or '',
+                             format_tenths(i.tenths),
+                             i.punches])
+    main_menu(project_name, status, start_time, p_uuid)
+
+
+def import_timesheet(project_name, status, start_time, p_uuid):
+    """
+    Import a timesheet export or a raw clocktime CSV.
+    :return: None
+    """
+    path = input("CSV file to import: ").strip()
+
+    if not os.path.isfile(path):
+        input("No such file. Press enter to return to main menu.")
+        main_menu(project_name, status, start_time, p_uuid)
+
+    sqlite3_backup('pre-import')
+    session.commit()
+
+    try:
+        result = imports.import_csv(engine, path)
+    except ValueError as e:
+        input("{0}. Press enter to return to main menu.".format(e))
+        main_menu(project_name, status, start_time, p_uuid)
+    journal.archive(DB_NAME)
+
+    print("Imported {0} {1} rows, skipped {2} duplicates and {3} bad "
+          "rows.".format(result.inserted, result.kind, result.duplicates,
+                         result.failed))
+    for line, message in result.errors:
+        print("  line {0}: {1}".format(line, message))
+    input("Press enter to return to main menu.")
+    main_menu(project_name, status, start_time, p_uuid)
+
+
+def export_payroll(project_name, status, start_time, p_uuid):
+    """
+    Export one CSV per ISO week and employee into PyperPayroll/, written
+    in parallel, with a manifest of the files.
+    :return: None
+    """
+    session.commit()  # the workers read what is on disk
+    entries = exports.export_partitions(DB_NAME, 'PyperPayroll')
+    input("Wrote {0} files, {1} rows. Press enter to return to main "
+          "menu.".format(len(entries), sum(e['rows'] for e in entries)))
+    main_menu(project_name, status, start_time, p_uuid)
+
+
+def export_changes(project_name, status, start_time, p_uuid):
+    """
+    Export timesheet rows added or changed since the last time, appended
+    to PyperTimesheetChanges.csv or as a dated delta file.
+    :return: None
+    """
+    if input("Append to PyperTimesheetChanges.csv? (Y/n) ").lower() \
+            .startswith('n'):
+        path = 'PyperTimesheetChanges-{0}.csv'.format(
+            datetime.now().strftime('%Y%m%d-%H%M%S'))
+        stats = exports.export_changes(session, path)
+    else:
+        path = 'PyperTimesheetChanges.csv'
+        stats = exports.export_changes(session, path, append=True)
+    session.commit()
+    input("Exported {0} changed rows to {1}. Press enter to return to main "
+          "menu.".format(stats.rows, path))
     main_menu(project_name, status, start_time, p_uuid)
 
 
@@ -1025,93 +1221,107 @@ def imp_exp_sub(project_name, status, start_time, p_uuid):
         os.system('cls' if os.name == 'nt' else 'clear')
         print("Import/Export Timesheet\n"
               "1. Import CSV Timesheet\n"
-              "2. Export CSV Timesheet\n")
+              "2. Export CSV Timesheet\n"
+              "3. Export Weekly Summary CSV\n"
+              "4. Export Payroll CSVs (per week and employee)\n"
+              "5. Export Changes Since Last Export\n")
 
         answer = input('>>> ')
 
         if answer.startswith('1'):
-            # TODO: CSV Parsing
-            raise NotImplementedError
+            import_timesheet(project_name, status, start_time, p_uuid)
 
         elif answer.startswith('2'):
             export_timesheet(project_name, status, start_time, p_uuid)
 
-        else:
-            main_menu(project_name, status, start_time, p_uuid)
+        elif answer.startswith('3'):
+            export_weekly_summary(project_name, status, start_time, p_uuid)
 
+        elif answer.startswith('4'):
+            export_payroll(project_name, status, start_time, p_uuid)
 
-def sqlite3_backup(action):
-    """Create timestamped database copy, preferably use a backup directory."""
-    # path = os.path.dirname(os.path.realpath('tc.py'))
+        elif answer.startswith('5'):
+            export_changes(project_name, status, start_time, p_uuid)
 
-    if not os.path.isdir('.backup'):
-        os.makedirs('.backup')
+        else:
+            main_menu(project_name, status, start_time, p_uuid)
 
-    backup_file = os.path.join(
-        '.backup',
-        os.path.basename(DB_NAME) +
-        '_' +
-        action +
-        datetime.now().strftime("-%Y%m%d-%H%M%S"))
 
-    # Make new backup file
-    shutil.copyfile(DB_NAME, backup_file)
+def sqlite3_backup(action):
+    """Queue a snapshot of the database on the background backup worker."""
+    backup_worker.request(action)
 
 
 def clean_data():
-    """Delete files older than NO_OF_DAYS days"""
+    """Prune snapshots by the grandfather-father-son retention policy"""
 
-    print("\n------------------------------")
+    backup_worker.drain()
+    removed, freed = backups.prune(RetentionPolicy())
 
-    path = os.path.join(os.path.dirname(os.path.realpath('tc.py')), '.backup')
+    for entry in removed:
+        logging.info("Deleted backup %s", entry['name'])
+    logging.info("Freed %.1f KiB, backups now use %.1f KiB",
+                 freed / 1024.0, backups.usage() / 1024.0)
 
-    for filename in os.listdir(path):
-        file_path = os.path.join(path, filename)
-        s = os.stat(file_path).st_ctime
-        file_time = datetime.fromtimestamp(s)
-
-        # Delete file if over 2 days old
-        if os.path.isfile(file_path):
-
-            if file_time < (datetime.now() - timedelta(days=2)):
-                os.remove(file_path)
-                print("Deleting {}...".format(file_path))
+    # Journal records older than the oldest snapshot can't be replayed.
+    oldest = backups.entries()[:1]
+    if oldest:
+        journal.compact(oldest[0]['time'])
 
 
 def db_recover(project_name, status, start_time, p_uuid):
     """
-    Function to check last db entry and give option to recover,
-    or delete. This will be useful because if the program
-    crashes, the time_out fields will not be written to, causing an
-    error on next run. This function should check if
-    the time_out field of the last row is empty and,
-    if so, give said options.
+    Rebuild the database as it was at a given time, by default right now.
+
+    Restores the newest snapshot taken before that time and replays the
+    change journal from there, so recovering from a crash in the middle of
+    a clock out only replays the few changes made since the last backup.
 
     :return: None
     """
 
-    # if status is 0:
-    sqlite3_backup('db_recover')
+    backup_worker.drain()
+    journal.archive(DB_NAME)
+    answer = input("Recover the database as of (YYYY-MM-DD HH:MM), or press "
+                   "enter for the latest state: ")
 
-    # Create list of backup files
-    path = os.path.join(os.path.dirname(os.path.realpath('tc.py')), '.backup')
-    files = []
+    try:
+        until = datetime.strptime(answer, '%Y-%m-%d %H:%M') if answer \
+            else datetime.now()
+    except ValueError:
+        input("Check format and try again. Press enter to return to main "
+              "menu.")
+        main_menu(project_name, status, start_time, p_uuid)
+    base = backups.latest(before=until)
 
-    for filename in os.listdir(path):
-        file_path = os.path.join(path, filename)
-        # s = os.stat(file_path).st_ctime
-        # file_time = datetime.fromtimestamp(s)
+    if base is None:
+        input("No backups found. Press enter to return to main menu.")
+        main_menu(project_name, status, start_time, p_uuid)
 
-        if os.path.isfile(file_path):
-            files = sorted(
-                [f for f in os.listdir(path) if f.startswith('.timesheet.db')])
+    # Keep the current state around in case the recovery isn't wanted.
+    sqlite3_backup('db_recover')
+    backup_worker.drain()
 
-    print('Most recent file = {0}. Restore this?'.format(files[-1], ))
+    print('Restore backup {0} ({1}) and replay changes up to {2}? (y/N)'
+          .format(base['name'], base['time'], until.strftime('%Y-%m-%d %H:%M')))
     answer = query()
     if answer:
-        shutil.move(os.path.realpath('tc.py'), os.path.join(path, 'files[-1]'))
-    else:
-        main_menu(project_name, status, start_time, p_uuid)
+        session.close()
+        engine.dispose()
+        base, replayed = journal.recover(backups, DB_NAME, until, base)
+        # The rollups are derived from clocktimes, so recompute them.
+        rollups.rebuild(session)
+        session.commit()
+        # Recovering again starts from the recovered database, not the
+        # snapshot taken before this recovery.
+        sqlite3_backup('recovered')
+        backup_worker.drain()
+        # Jobs and reports cached from the old file are stale.
+        catalog.invalidate()
+        report_cache.clear()
+        print("Replayed {} changes.".format(replayed))
+        input("Press enter to return to main menu.")
+    main_menu(project_name, status, start_time, p_uuid)
 
 
 def main_menu(project_name, status, start_time, p_uuid):
@@ -1138,6 +1348,9 @@ def main_menu(project_name, status, start_time, p_uuid):
             print("*** Not currently in a job. ***\n")
         answer = input(">>> ")
 
+        if answer[:1] in ('1', '2', '3', '4', '5', '6'):
+            database()
+
         if answer.startswith('1'):
             project_start(project_name, status, start_time, p_uuid)
 
@@ -1157,6 +1370,14 @@ def main_menu(project_name, status, start_time, p_uuid):
             imp_exp_sub(project_name, status, start_time, p_uuid)
 
         if answer.startswith('7'):
+            # Let the startup backup finish before stopping its worker.
+            if _startup is not None:
+                _startup.join()
+            if clock_queue is not None:
+                clock_queue.stop()
+                logging.info("Clock events: %s", clock_queue.metrics)
+            if backup_worker is not None:
+                backup_worker.stop()
             sys.exit()
 
 
@@ -1164,14 +1385,23 @@ if __name__ == "__main__":
     debug = 0
 
     # Initialize logging
-    LOGFILE = "timeclock.log"
-    FORMATTER_STRING = r"%(levelname)s :: %(asctime)s :: in " \
-                       r"%(module)s | %(message)s"
-    LOGLEVEL = logging.INFO
     logging.basicConfig(filename=LOGFILE,
                         format=FORMATTER_STRING,
                         level=LOGLEVEL)
-    sqlite3_backup('startup')
-    clean_data()
+
+    try:
+        from pysqlcipher import dbapi2 as sqlite
+        encryption = True
+    except ImportError:
+        encryption = False
+
+    if encryption is True:
+        print("\n***PYPER TIMESHEET UTILITY***")
+    else:
+        print(
+            "WARNING: Unencrypted session. Install pysqlcipher3 to enable\n"
+            "encryption\n")
+
+    start_database()
     os.system('cls' if os.name == 'nt' else 'clear')
     main_menu('None', 0, 0, 0)
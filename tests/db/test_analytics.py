@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from models import Clocktime
+from tests.db import TestDBBase
+import analytics
+import unittest
+
+@unittest.skipIf(analytics.np is None, "NumPy is not installed")
+class TestClockHistory(TestDBBase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestClockHistory, self).setUp()
+        for job_id, day, tenths in ((1, datetime(2016, 1, 5, 9), 15),
+                                    (1, datetime(2016, 1, 20, 9), 5),
+                                    (2, datetime(2016, 2, 1, 9), 20),
+                                    (2, datetime(2016, 3, 1, 9), 40),
+                                    (2, datetime(2016, 3, 2, 9), None)):
+            self.session.add(Clocktime(
+                job_id=job_id, employee_id=1, time_in=day,
+                time_out=day + timedelta(minutes=6 * (tenths or 0)),
+                tenths=tenths))
+        self.session.flush()
+        self.history = analytics.ClockHistory.load(
+            self.session, start=datetime(2016, 1, 1))
+
+    def test_load(self):
+        """Only closed clocktimes in range are loaded"""
+        self.assertEqual(len(self.history), 4)
+        self.assertEqual(self.history.time_in[0],
+                         analytics.to_epoch(datetime(2016, 1, 5, 9)))
+
+    def test_hours_by_month(self):
+        edges = analytics.period_edges(datetime(2016, 1, 1),
+                                       datetime(2016, 3, 31))
+        self.assertEqual(len(edges), 4)
+        keys, totals = self.history.hours_by(edges)
+        self.assertEqual(list(keys), [1, 2])
+        self.assertEqual(totals.tolist(), [[2.0, 0.0, 0.0], [0.0, 2.0, 4.0]])
+        self.assertEqual(self.history.trend(totals).tolist(), [-1.0, 2.0])
+
+    def test_utilization(self):
+        edges = analytics.period_edges(datetime(2016, 1, 1),
+                                       datetime(2016, 2, 29))
+        self.assertEqual(self.history.utilization(edges, 4).tolist(),
+                         [0.5, 0.5])
+
+if __name__ == "__main__":
+    unittest.main()
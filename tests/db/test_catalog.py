@@ -0,0 +1,37 @@
+from catalog import JobCatalog
+from models import Job
+from tests.db import TestDBBase
+import unittest
+
+class TestJobCatalog(TestDBBase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestJobCatalog, self).setUp()
+        self.session.add_all([
+            Job(name="Python Tests", abbr="PYTEST", rate=100),
+            Job(name="Road Survey", abbr="ROAD01", rate=100)])
+        self.catalog = JobCatalog(self.session)
+
+    def test_complete(self):
+        """Prefix completion returns sorted abbreviations"""
+        self.assertEqual(self.catalog.complete("PY"), ["PYTEST", "PYTIME"])
+        self.assertEqual(self.catalog.complete("PY", limit=1), ["PYTEST"])
+        self.assertEqual(self.catalog.complete("X"), [])
+
+    def test_suggest(self):
+        """Suggestions come from case, prefixes, names and near misses"""
+        self.assertEqual(self.catalog.suggest("road01").abbr, "ROAD01")
+        self.assertEqual(self.catalog.suggest("RO").abbr, "ROAD01")
+        self.assertEqual(self.catalog.suggest("road survey").abbr, "ROAD01")
+        self.assertEqual(self.catalog.suggest("PYTIM").abbr, "PYTIME")
+        self.assertIsNone(self.catalog.suggest("ZZZZZZZZ"))
+
+    def test_invalidate(self):
+        self.assertEqual(len(self.catalog), 3)
+        self.session.add(Job(name="New", abbr="NEW", rate=1))
+        self.assertEqual(len(self.catalog), 3)
+        self.catalog.invalidate()
+        self.assertEqual(self.catalog.get("NEW")[0].name, "New")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+from uuid import uuid5, NAMESPACE_OID
+from models import Base, Clocktime, ExportState, Timesheet
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tests.db import TestDBBase
+import csv
+import exports
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestExports(TestDBBase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestExports, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'out.csv')
+        for day in (9, 7, 14):
+            self.session.add(Timesheet(abbr='PYTIME', name='Python Time',
+                                       tenths=day, week='2016-03-13',
+                                       date=datetime(2016, 3, day, 9)))
+        self.session.flush()
+
+    def tearDown(self):
+        super(TestExports, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with open(self.path, newline='') as f:
+            return list(csv.reader(f))
+
+    def test_export_all(self):
+        stats = exports.export_csv(self.session, self.path, batch=2)
+        self.assertEqual(stats.rows, 3)
+        rows = self.read()
+        self.assertEqual(tuple(rows[0]), exports.TIMESHEET_HEADER)
+        self.assertEqual(rows[1], ['PYTIME', 'Python Time', '0.7',
+                                   '2016-03-07', '2016-03-13'])
+        self.assertEqual([r[3] for r in rows[1:]],
+                         ['2016-03-07', '2016-03-09', '2016-03-14'])
+        self.assertEqual(os.listdir(self.tmpdir), ['out.csv'])
+
+    def test_export_range(self):
+        query = exports.timesheet_select(datetime(2016, 3, 8),
+                                         datetime(2016, 3, 14))
+        self.assertEqual(exports.export_csv(self.session, self.path,
+                                            query).rows, 1)
+        self.assertEqual(self.read()[1][3], '2016-03-09')
+
+    def test_export_changes(self):
+        first = exports.export_changes(self.session, self.path, append=True)
+        self.assertEqual(first.rows, 3)
+
+        # Nothing changed: nothing exported, nothing appended.
+        self.assertEqual(exports.export_changes(
+            self.session, self.path, append=True).rows, 0)
+
+        row = self.session.query(Timesheet).filter(
+            Timesheet.date == datetime(2016, 3, 9, 9)).one()
+        row.tenths = 25
+        self.session.flush()
+
+        # Until committed, the new mark doesn't count.
+        delta = os.path.join(self.tmpdir, 'delta.csv')
+        savepoint = self.session.begin_nested()
+        self.assertEqual(exports.export_changes(self.session, delta).rows, 1)
+        savepoint.rollback()
+        self.assertEqual(exports.export_changes(
+            self.session, self.path, append=True).rows, 1)
+
+        with open(delta, newline='') as f:
+            self.assertEqual(list(csv.reader(f))[1][2], '2.5')
+        # In order of modification.
+        self.assertEqual([r[2] for r in self.read()],
+                         ['Hours Worked', '0.9', '0.7', '1.4', '2.5'])
+
+    def test_export_changes_late_commit(self):
+        exports.export_changes(self.session, self.path)
+        mark = self.session.get(ExportState, 'timesheet').mark
+
+        # Stamped before the last export, committed after it.
+        self.session.add(Timesheet(abbr='PYTIME', name='Python Time',
+                                   tenths=5, week='2016-03-13',
+                                   date=datetime(2016, 3, 10, 9),
+                                   modified=mark - timedelta(seconds=1)))
+        self.session.flush()
+        stats = exports.export_changes(self.session, self.path)
+        self.assertEqual(stats.rows, 1)
+        self.assertEqual(self.read()[1][2], '0.5')
+        self.assertEqual(exports.export_changes(self.session,
+                                                self.path).rows, 0)
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmpdir, 'test.db')
+        engine = create_engine('sqlite:///' + self.db)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        # Employee 1 on a and c, employee 2 on b, a and c a week apart.
+        for name, day, employee in (('a', datetime(2016, 3, 7), 1),
+                                    ('b', datetime(2016, 3, 13), 2),
+                                    ('c', datetime(2016, 3, 14), 1)):
+            p_uuid = uuid5(NAMESPACE_OID, name)
+            session.add(Timesheet(p_uuid=p_uuid, abbr='PYTIME', tenths=10,
+                                  date=day))
+            session.add(Clocktime(p_uuid=p_uuid, time_in=day, tenths=10,
+                                  employee_id=employee))
+        # Nobody clocked d; e is shared by 1, 2 and a punch with no employee.
+        session.add(Timesheet(p_uuid=uuid5(NAMESPACE_OID, 'd'), abbr='PYTIME',
+                              tenths=10, date=datetime(2016, 3, 8)))
+        p_uuid = uuid5(NAMESPACE_OID, 'e')
+        session.add(Timesheet(p_uuid=p_uuid, abbr='PYTIME', tenths=30,
+                              date=datetime(2016, 3, 9)))
+        for employee, tenths in ((1, 10), (2, 15), (None, 5)):
+            session.add(Clocktime(p_uuid=p_uuid, time_in=datetime(2016, 3, 9),
+                                  tenths=tenths, employee_id=employee))
+        session.commit()
+        session.close()
+        engine.dispose()
+        self.out = os.path.join(self.tmpdir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def hours(self, name):
+        with open(os.path.join(self.out, name)) as f:
+            return [row[2] for row in list(csv.reader(f))[1:]]
+
+    def test_week_and_employee(self):
+        entries = exports.export_partitions(self.db, self.out, workers=2)
+        self.assertEqual([(e['file'], e['rows']) for e in entries],
+                         [('timesheet_2016-W10_unassigned.csv', 2),
+                          ('timesheet_2016-W10_emp1.csv', 2),
+                          ('timesheet_2016-W10_emp2.csv', 2),
+                          ('timesheet_2016-W11_emp1.csv', 1)])
+        with open(os.path.join(self.out, exports.MANIFEST)) as f:
+            self.assertEqual([json.loads(line) for line in f], entries)
+
+    def test_shared_row_is_split(self):
+        exports.export_partitions(self.db, self.out, workers=1)
+        self.assertEqual(self.hours('timesheet_2016-W10_emp1.csv'),
+                         ['1.0', '1.0'])
+        self.assertEqual(self.hours('timesheet_2016-W10_emp2.csv'),
+                         ['1.5', '1.0'])
+        self.assertEqual(self.hours('timesheet_2016-W10_unassigned.csv'),
+                         ['1.0', '0.5'])
+
+    def test_week_only(self):
+        entries = exports.export_partitions(self.db, self.out, by=('week',),
+                                            workers=1)
+        self.assertEqual([(e['week'], e['rows']) for e in entries],
+                         [('2016-W10', 4), ('2016-W11', 1)])
+
+if __name__ == "__main__":
+    unittest.main()
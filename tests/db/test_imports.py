@@ -0,0 +1,129 @@
+from datetime import date, datetime
+from uuid import uuid4
+from models import Base, Clocktime, DailyRollup, Employee, Job, Timesheet
+from sqa_uuid import KEY_NAMESPACE, to_uuid
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import exports
+import imports
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestImports(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.engine = create_engine(
+            'sqlite:///' + os.path.join(self.tmpdir, 'test.db'))
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.session.add(Job(name="Python Time", abbr="PYTIME", rate=20000))
+        self.session.add(Employee(firstname="Adam", lastname="Smith"))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, *lines):
+        path = os.path.join(self.tmpdir, 'in.csv')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_timesheet(self):
+        path = self.write('Id,Job Name,Hours Worked,Date,Week Ending',
+                          'PYTIME,Python Time,1.5,2016-03-07,2016-03-12',
+                          'NOJOB,Nope,1.0,2016-03-07,2016-03-12',
+                          'PYTIME,Python Time,abc,2016-03-08,2016-03-12',
+                          'PYTIME,Python Time,2.0,2016-03-09,')
+        result = imports.import_csv(self.engine, path)
+        self.assertEqual((result.inserted, result.failed), (2, 2))
+        self.assertEqual([line for line, _ in result.errors], [3, 4])
+        self.assertEqual(self.session.query(Timesheet.tenths, Timesheet.week)
+                         .order_by(Timesheet.date).all(),
+                         [(15, '2016-03-12'), (20, '2016-03-12')])
+
+        # Importing the same file again adds nothing.
+        result = imports.import_csv(self.engine, path)
+        self.assertEqual((result.inserted, result.duplicates), (0, 2))
+
+    def test_timesheet_dedup_by_job_and_day(self):
+        # A row tc made, with its own random p_uuid.
+        self.session.add(Timesheet(p_uuid=uuid4(), abbr='PYTIME', tenths=5,
+                                   date=datetime(2016, 3, 7, 9, 30)))
+        self.session.commit()
+        path = self.write('Id,Job Name,Hours Worked,Date,Week Ending',
+                          'PYTIME,Python Time,0.5,2016-03-07,2016-03-12',
+                          'PYTIME,Python Time,inf,2016-03-08,2016-03-12',
+                          'PYTIME,Python Time,nan,2016-03-08,2016-03-12')
+        result = imports.import_csv(self.engine, path)
+        self.assertEqual((result.inserted, result.duplicates, result.failed),
+                         (0, 1, 2))
+        self.assertEqual(self.session.query(Timesheet).count(), 1)
+
+    def test_timesheet_rows_same_job_and_day(self):
+        # tc keeps a row per sub-task, the server one per employee.
+        for tenths in (15, 20):
+            self.session.add(Timesheet(p_uuid=uuid4(), abbr='PYTIME',
+                                       name='Python Time', tenths=tenths,
+                                       date=datetime(2016, 3, 7, 9)))
+        self.session.commit()
+        path = os.path.join(self.tmpdir, 'out.csv')
+        with self.engine.connect() as conn:
+            exports.export_csv(conn, path)
+        self.session.query(Timesheet).delete()
+        self.session.commit()
+
+        result = imports.import_csv(self.engine, path, batch=1)
+        self.assertEqual((result.inserted, result.duplicates), (2, 0))
+        self.assertEqual(sorted(t for t, in self.session.query(
+            Timesheet.tenths)), [15, 20])
+        result = imports.import_csv(self.engine, path)
+        self.assertEqual((result.inserted, result.duplicates), (0, 2))
+
+    def test_clocktimes_reimport(self):
+        path = self.write(
+            'Key,Id,Employee,Time In,Time Out,Task',
+            'k1,PYTIME,1,2016-03-07 09:00:00.250000,2016-03-07 10:00:00,tests')
+        imports.import_csv(self.engine, path)
+        out = os.path.join(self.tmpdir, 'out.csv')
+        with self.engine.connect() as conn:
+            exports.export_csv(conn, out, exports.clocktime_select(),
+                               exports.CLOCKTIME_HEADER)
+
+        result = imports.import_csv(self.engine, out)
+        self.assertEqual((result.inserted, result.duplicates), (0, 1))
+        self.assertEqual(self.session.query(Timesheet.tenths).scalar(), 10)
+
+    def test_clocktimes(self):
+        path = self.write(
+            'Key,Id,Employee,Time In,Time Out,Task',
+            'k1,PYTIME,1,2016-03-07 09:00:00,2016-03-07 10:00:00,tests',
+            'k1,PYTIME,1,2016-03-07 09:00:00,2016-03-07 10:00:00,tests',
+            'k1,PYTIME,1,2016-03-07 13:00:00,2016-03-07 13:40:00,tests',
+            ',PYTIME,,2016-03-08 09:00:00,2016-03-08 08:00:00,oops',
+            ',PYTIME,9,2016-03-08 09:00:00,,',
+            ',PYTIME,,2016-03-08 09:00:00,,')
+        result = imports.import_csv(self.engine, path, batch=2)
+        self.assertEqual((result.inserted, result.duplicates, result.failed),
+                         (3, 1, 2))
+        self.assertEqual(self.session.query(Clocktime).count(), 3)
+        self.assertEqual(self.session.query(Timesheet.p_uuid, Timesheet.tenths)
+                         .order_by(Timesheet.date).all(),
+                         [(to_uuid('k1', KEY_NAMESPACE), 17),
+                          (imports.day_key('PYTIME', date(2016, 3, 8)),
+                           0)])
+        self.assertEqual(self.session.query(DailyRollup.tenths,
+                                            DailyRollup.punches).all(),
+                         [(17, 2)])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            imports.import_csv(self.engine, self.write('a,b,c'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+from datetime import datetime
+from uuid import uuid5, NAMESPACE_OID
+from models import Clocktime, Timesheet
+from tests.db import TestDBBase, TESTDATA
+import reports
+import unittest
+
+KEYS = dict((name, uuid5(NAMESPACE_OID, name)) for name in 'abcdx')
+
+class TestReports(TestDBBase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestReports, self).setUp()
+        for name, abbr, day in (('a', 'PYTIME', datetime(2016, 3, 7, 9)),
+                                ('b', 'PYTIME', datetime(2016, 3, 13, 9)),
+                                ('c', 'ROAD01', datetime(2016, 3, 9, 9)),
+                                ('d', 'PYTIME', datetime(2016, 3, 14, 9))):
+            self.session.add(Timesheet(p_uuid=KEYS[name], abbr=abbr,
+                                       name=abbr, tenths=10, date=day))
+            self.session.add(Clocktime(p_uuid=KEYS[name], time_in=day,
+                                       sub_task='first'))
+            self.session.add(Clocktime(p_uuid=KEYS[name], time_in=day,
+                                       sub_task='task ' + name))
+        # By id: going through the relationship would attach this
+        # clocktime to the TESTDATA employee shared by every test.
+        self.session.flush()
+        self.session.add(Clocktime(p_uuid=KEYS['c'], time_in=datetime(2016, 3, 9),
+                                   sub_task='task c',
+                                   employee_id=TESTDATA['employee'].id))
+
+    def uuids(self, rows):
+        return [r.abbr + r.sub_task[-1] for r in rows]
+
+    def test_week_range(self):
+        start, end = reports.week_range(datetime(2016, 3, 10, 15))
+        self.assertEqual(start, datetime(2016, 3, 7))
+        self.assertEqual(end, datetime(2016, 3, 14))
+
+    def test_rows_in_range(self):
+        """Only rows in the week come back, each with its latest task"""
+        rows = reports.timesheet_rows(
+            self.session, *reports.week_range(datetime(2016, 3, 10))).all()
+        self.assertEqual(self.uuids(rows), ['PYTIMEa', 'ROAD01c', 'PYTIMEb'])
+
+    def test_filters(self):
+        start, end = reports.week_range(datetime(2016, 3, 10))
+        rows = reports.timesheet_rows(self.session, start, end,
+                                      abbr='ROAD01')
+        self.assertEqual(self.uuids(rows), ['ROAD01c'])
+        rows = reports.timesheet_rows(self.session, start, end,
+                                      employee_id=TESTDATA['employee'].id)
+        self.assertEqual(self.uuids(rows), ['ROAD01c'])
+        rows = reports.timesheet_rows(self.session, None, None, week=201611)
+        self.assertEqual(self.uuids(rows), ['PYTIMEd'])
+
+    def test_pages(self):
+        start, end = datetime(2016, 3, 1), datetime(2016, 4, 1)
+        first = reports.timesheet_page(self.session, start, end, limit=3)
+        self.assertEqual(self.uuids(first.rows),
+                         ['PYTIMEa', 'ROAD01c', 'PYTIMEb'])
+        self.assertEqual(first[1:], (False, True))
+
+        last = first.rows[-1]
+        second = reports.timesheet_page(self.session, start, end, limit=3,
+                                        after=(last.date, last.id))
+        self.assertEqual(self.uuids(second.rows), ['PYTIMEd'])
+        self.assertEqual(second[1:], (True, False))
+
+        back = reports.timesheet_page(
+            self.session, start, end, limit=2,
+            before=(second.rows[0].date, second.rows[0].id))
+        self.assertEqual(self.uuids(back.rows), ['ROAD01c', 'PYTIMEb'])
+        self.assertEqual(back[1:], (True, True))
+
+    def test_iter_pages(self):
+        query = reports.timesheet_rows(self.session, datetime(2016, 3, 1),
+                                       datetime(2016, 4, 1))
+        self.assertEqual([len(p) for p in reports.iter_pages(query, 3)],
+                         [3, 1])
+        self.assertEqual(list(reports.iter_pages([], 3)), [])
+
+
+class TestReportCache(TestDBBase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestReportCache, self).setUp()
+        self.session.commit()
+        self.cache = reports.ReportCache(maxsize=2)
+        self.cache.attach(self.session)
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return self.session.query(Timesheet).count()
+
+    def test_hit_until_write(self):
+        self.assertEqual(self.cache.get(self.session, 'n', self.build), 0)
+        self.assertEqual(self.cache.get(self.session, 'n', self.build), 0)
+        self.assertEqual(self.builds, 1)
+
+        self.session.add(Timesheet(p_uuid=KEYS['x'], abbr='PYTIME', tenths=10,
+                                   date=datetime(2016, 3, 7)))
+        self.session.flush()
+        self.assertEqual(self.cache.get(self.session, 'n', self.build), 1)
+        self.session.rollback()
+        self.assertEqual(self.cache.get(self.session, 'n', self.build), 0)
+        self.assertEqual(self.builds, 3)
+
+    def test_write_during_build_is_stale(self):
+        def build():
+            count = self.build()
+            # Committed after the report was read.
+            self.session.add(Timesheet(p_uuid=KEYS['x'], abbr='PYTIME',
+                                       tenths=10, date=datetime(2016, 3, 7)))
+            self.session.flush()
+            return count
+
+        self.assertEqual(self.cache.get(self.session, 'n', build), 0)
+        self.assertEqual(self.cache.get(self.session, 'n', self.build), 1)
+        self.assertEqual(self.builds, 2)
+
+    def test_lru_eviction(self):
+        for key in ('a', 'b', 'a', 'c', 'a', 'b'):
+            self.cache.get(self.session, key, self.build)
+        # 'b' was the least recently used when 'c' came in.
+        self.assertEqual(self.builds, 4)
+        self.assertEqual(self.cache.hits, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
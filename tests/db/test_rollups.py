@@ -0,0 +1,51 @@
+import uuid
+from datetime import date, datetime
+from models import Clocktime, DailyRollup, Timesheet, WeeklyRollup
+from tests.db import TestDBBase
+import rollups
+import unittest
+
+class TestRollups(TestDBBase, unittest.TestCase):
+
+    def rollup_rows(self):
+        daily = self.session.query(
+            DailyRollup.day, DailyRollup.abbr, DailyRollup.employee_id,
+            DailyRollup.sub_task, DailyRollup.tenths, DailyRollup.punches) \
+            .order_by(DailyRollup.day, DailyRollup.sub_task).all()
+        weekly = self.session.query(
+            WeeklyRollup.week, WeeklyRollup.abbr, WeeklyRollup.tenths,
+            WeeklyRollup.punches).order_by(WeeklyRollup.week).all()
+        return daily, weekly
+
+    def test_record(self):
+        """Slices add up per day and per ISO week"""
+        rollups.record(self.session, date(2016, 1, 4), 'PYTIME', None,
+                       'tests', 3)
+        rollups.record(self.session, date(2016, 1, 4), 'PYTIME', None,
+                       'tests', 2)
+        rollups.record(self.session, date(2016, 1, 10), 'PYTIME', None,
+                       None, 10)
+        daily, weekly = self.rollup_rows()
+        self.assertEqual(daily, [(date(2016, 1, 4), 'PYTIME', 0, 'tests',
+                                  5, 2),
+                                 (date(2016, 1, 10), 'PYTIME', 0, '', 10,
+                                  1)])
+        self.assertEqual(weekly, [(201601, 'PYTIME', 15, 3)])
+
+    def test_rebuild_matches_record(self):
+        """Rebuilding from clocktimes gives what recording did"""
+        key = uuid.uuid4()
+        for day, task, tenths in ((4, 'tests', 3), (4, 'tests', 2),
+                                 (10, None, 10)):
+            self.session.add(Clocktime(p_uuid=key, sub_task=task,
+                                       time_in=datetime(2016, 1, day, 9),
+                                       tenths=tenths))
+            rollups.record(self.session, date(2016, 1, day), 'PYTIME', None,
+                           task, tenths)
+        self.session.add(Timesheet(p_uuid=key, abbr='PYTIME'))
+        recorded = self.rollup_rows()
+        self.assertEqual(rollups.rebuild(self.session), 2)
+        self.assertEqual(self.rollup_rows(), recorded)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+from models import Job
+from sqa_uuid import KEY_NAMESPACE, to_uuid
+from tests.db import TestDBBase
+import unittest
+import uuid
+
+class TestUUID(TestDBBase, unittest.TestCase):
+
+    def test_round_trip(self):
+        """Any form of a UUID binds, a uuid.UUID comes back"""
+        key = uuid.uuid4()
+        for value in (key, str(key), key.hex, key.bytes):
+            self.session.add(Job(p_uuid=value, abbr='UUID'))
+        self.session.flush()
+        self.assertEqual(self.session.query(Job.p_uuid)
+                         .filter(Job.abbr == 'UUID').distinct().all(),
+                         [(key,)])
+        self.assertEqual(self.session.connection().exec_driver_sql(
+            "SELECT length(p_uuid) FROM jobs WHERE abbr = 'UUID'")
+            .scalar(), 16)
+        self.assertEqual(self.session.query(Job.abbr)
+                         .filter(Job.p_uuid == str(key)).count(), 4)
+
+    def test_text_keys(self):
+        with self.assertRaises(ValueError):
+            to_uuid('k1')
+        self.assertEqual(to_uuid('k1', KEY_NAMESPACE),
+                         uuid.uuid5(KEY_NAMESPACE, 'k1'))
+
+if __name__ == "__main__":
+    unittest.main()
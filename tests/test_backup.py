@@ -0,0 +1,139 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from backup import BackupStore, BackupWorker, RetentionPolicy
+
+
+class BackupTestBase(object):
+    """Creates a throwaway database and backup store for each test"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmpdir, 'test.db')
+        self.store = BackupStore(os.path.join(self.tmpdir, '.backup'))
+        conn = sqlite3.connect(self.db)
+        conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, val TEXT)')
+        conn.executemany('INSERT INTO t (val) VALUES (?)',
+                         [('row {}'.format(i) * 20,) for i in range(2000)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def rows(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute('SELECT * FROM t ORDER BY id').fetchall()
+        finally:
+            conn.close()
+
+    def chunk_count(self):
+        return sum(len(files) for _, _, files in os.walk(self.store.chunk_dir))
+
+
+class TestBackupStore(BackupTestBase, unittest.TestCase):
+
+    def test_restore_is_complete(self):
+        """A restored snapshot has the same rows as the source"""
+        name = self.store.snapshot(self.db, 'test')
+        out = os.path.join(self.tmpdir, 'restored.db')
+        self.store.restore(name, out)
+        self.assertEqual(self.rows(out), self.rows(self.db))
+        self.assertEqual(os.path.getsize(out), os.path.getsize(self.db))
+
+    def test_unchanged_pages_are_shared(self):
+        """A second snapshot only stores the pages that changed"""
+        self.store.snapshot(self.db, 'first')
+        first = self.chunk_count()
+        conn = sqlite3.connect(self.db)
+        conn.execute("UPDATE t SET val = 'changed' WHERE id = 1")
+        conn.commit()
+        conn.close()
+        self.store.snapshot(self.db, 'second')
+        self.assertEqual(len(self.store.snapshots()), 2)
+        self.assertLess(self.chunk_count() - first, 5)
+
+    def test_collect_removes_orphans(self):
+        name = self.store.snapshot(self.db, 'test')
+        self.store.remove(name)
+        self.assertTrue(self.store.collect() > 0)
+        self.assertEqual(self.chunk_count(), 0)
+
+    def test_compressed_restore(self):
+        """Compressed stores restore the same file and use less disk"""
+        plain = self.store
+        plain.snapshot(self.db, 'plain')
+        for compression in ('gzip', 'lzma'):
+            store = BackupStore(os.path.join(self.tmpdir, compression),
+                                compression=compression)
+            name = store.snapshot(self.db, compression)
+            out = os.path.join(self.tmpdir, compression + '.db')
+            store.restore(name, out)
+            self.assertEqual(self.rows(out), self.rows(self.db))
+            self.assertLess(store.usage(), plain.usage())
+
+    def test_manifest_survives_reload(self):
+        name = self.store.snapshot(self.db, 'test')
+        entry = BackupStore(self.store.root).entry(name)
+        self.assertEqual(entry['reason'], 'test')
+        self.assertEqual(entry['size'], os.path.getsize(self.db))
+        self.assertTrue(entry['checksum'])
+
+    def test_latest_before(self):
+        """latest() picks the newest snapshot at or before a time"""
+        start = datetime(2016, 3, 1, 9)
+        for hour in range(5):
+            self.store.snapshot(self.db, 'h{}'.format(hour),
+                                when=start + timedelta(hours=hour))
+        entry = self.store.latest(before=start + timedelta(hours=2,
+                                                           minutes=30))
+        self.assertEqual(entry['reason'], 'h2')
+        self.assertIsNone(self.store.latest(before=start - timedelta(1)))
+        self.assertEqual(self.store.latest()['reason'], 'h4')
+
+    def test_prune_keeps_generations(self):
+        """One snapshot per hour, day and week is kept, the rest go"""
+        start = datetime(2016, 3, 1)
+        entries = [{'name': 'snap-{}'.format(i),
+                    'time': (start + timedelta(hours=i))
+                    .strftime('%Y-%m-%dT%H:%M:%S')} for i in range(24 * 30)]
+        kept = RetentionPolicy(hourly=24, daily=7, weekly=4, last=0) \
+            .keep(entries)
+        # 24 hours, plus 6 more days, plus 3 more weeks, give or take the
+        # boundaries of the ISO week the newest snapshot falls in.
+        self.assertTrue(24 + 6 + 2 <= len(kept) <= 24 + 6 + 3)
+        self.assertIn('snap-{}'.format(24 * 30 - 1), kept)
+
+
+class TestBackupWorker(BackupTestBase, unittest.TestCase):
+
+    def test_burst_is_merged(self):
+        """Requests queued behind a running snapshot share one snapshot"""
+        worker = BackupWorker(self.store, self.db)
+        for i in range(20):
+            worker.request('burst{}'.format(i))
+        worker.drain()
+        self.assertTrue(1 <= worker.taken < 20)
+        worker.stop()
+
+    def test_drained_snapshot_is_consistent(self):
+        worker = BackupWorker(self.store, self.db)
+        conn = sqlite3.connect(self.db)
+        conn.execute("INSERT INTO t (val) VALUES ('last')")
+        conn.commit()
+        conn.close()
+        worker.request('after_insert')
+        worker.drain()
+        out = os.path.join(self.tmpdir, 'restored.db')
+        self.store.restore(self.store.snapshots()[-1], out)
+        self.assertEqual(self.rows(out), self.rows(self.db))
+        worker.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
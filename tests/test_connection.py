@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+from connection import PROFILES, load_pragmas, make_engine
+
+
+class TestConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmpdir, 'test.db')
+        self.config = os.path.join(self.tmpdir, 'pyper.cfg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_config(self, text):
+        with open(self.config, 'w') as f:
+            f.write(text)
+
+    def pragma(self, engine, name):
+        with engine.connect() as conn:
+            return conn.exec_driver_sql('PRAGMA ' + name).scalar()
+
+    def test_default_profile(self):
+        self.assertEqual(load_pragmas(self.config, environ={}),
+                         PROFILES['tuned'])
+
+    def test_config_file(self):
+        self.write_config("[database]\nprofile = safe\ncache_size = -8000\n")
+        pragmas = load_pragmas(self.config, environ={})
+        self.assertEqual(pragmas['synchronous'], 'FULL')
+        self.assertEqual(pragmas['cache_size'], '-8000')
+
+    def test_environment_overrides_config(self):
+        self.write_config("[database]\nprofile = safe\n")
+        pragmas = load_pragmas(self.config, environ={
+            'PYPER_DB_PROFILE': 'stock',
+            'PYPER_DB_PRAGMAS': 'mmap_size=0, temp_store=MEMORY'})
+        self.assertEqual(list(pragmas.items()),
+                         [('mmap_size', '0'), ('temp_store', 'MEMORY')])
+
+    def test_rejects_bad_settings(self):
+        for environ in ({'PYPER_DB_PROFILE': 'fastest'},
+                        {'PYPER_DB_PRAGMAS': 'page_size=512'},
+                        {'PYPER_DB_PRAGMAS': 'cache_size=1; DROP TABLE x'}):
+            self.assertRaises(ValueError, load_pragmas, self.config, environ)
+
+    def test_engine_sets_pragmas(self):
+        engine = make_engine(self.db, load_pragmas(self.config, environ={}))
+        self.assertEqual(self.pragma(engine, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(engine, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(engine, 'cache_size'), -32000)
+        self.assertEqual(self.pragma(engine, 'busy_timeout'), 5000)
+        engine.dispose()
+
+    def test_readonly_engine(self):
+        engine = make_engine(self.db, PROFILES['stock'])
+        with engine.begin() as conn:
+            conn.exec_driver_sql('CREATE TABLE t (id INTEGER)')
+        engine.dispose()
+        engine = make_engine(self.db, PROFILES['tuned'], readonly=True)
+        self.assertEqual(self.pragma(engine, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(engine, 'temp_store'), 2)  # MEMORY
+        with engine.connect() as conn:
+            self.assertRaises(OperationalError, conn.exec_driver_sql,
+                              'INSERT INTO t VALUES (1)')
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
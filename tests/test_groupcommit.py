@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from connection import make_engine
+from groupcommit import GroupCommit
+from migrations import upgrade
+from models import Clocktime
+
+
+def clock_in(sub_task):
+    def write(session):
+        clocktime = Clocktime(time_in=datetime.now(), sub_task=sub_task)
+        session.add(clocktime)
+        session.flush()
+        return clocktime.id
+    return write
+
+
+def fail(session):
+    raise ValueError("bad clock event")
+
+
+class TestGroupCommit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.engine = make_engine(os.path.join(self.tmpdir, 'test.db'))
+        upgrade(self.engine, pause=0)
+        self.DBSession = sessionmaker(bind=self.engine)
+        self.sizes = []
+        self.queue = GroupCommit(self.DBSession, max_delay=0.2,
+                                 after_commit=self.sizes.append)
+
+    def tearDown(self):
+        self.queue.stop()
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def sub_tasks(self):
+        session = self.DBSession()
+        try:
+            return sorted(row[0] for row in session.query(Clocktime.sub_task))
+        finally:
+            session.close()
+
+    def test_groups_concurrent_writes(self):
+        ids = []
+        threads = [threading.Thread(target=lambda i=i: ids.append(
+            self.queue.commit(clock_in('task {:02d}'.format(i)))))
+            for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual(self.sub_tasks(),
+                         ['task {:02d}'.format(i) for i in range(20)])
+        self.assertEqual(self.queue.metrics.writes, 20)
+        self.assertLess(self.queue.metrics.groups, 20)
+        self.assertEqual(sum(self.sizes), 20)
+
+    def test_failed_write_fails_alone(self):
+        futures = [self.queue.submit(write)
+                   for write in (clock_in('a'), fail, clock_in('b'))]
+        self.assertIsInstance(futures[0].result(), int)
+        self.assertRaises(ValueError, futures[1].result)
+        self.assertIsInstance(futures[2].result(), int)
+        self.assertEqual(self.sub_tasks(), ['a', 'b'])
+        self.assertEqual(self.queue.metrics.failed, 1)
+
+    def test_stop_commits_queued_writes(self):
+        futures = [self.queue.submit(clock_in(str(i))) for i in range(5)]
+        self.queue.stop()
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertEqual(len(self.sub_tasks()), 5)
+
+    def test_cancelled_write_is_dropped(self):
+        running, release = threading.Event(), threading.Event()
+        # Hold the writer thread inside a group until the cancel is made.
+        first = self.queue.submit(
+            lambda session: running.set() or release.wait())
+        running.wait()
+        cancelled = self.queue.submit(clock_in('cancelled'))
+        self.assertTrue(cancelled.cancel())
+        release.set()
+        first.result()
+        self.queue.commit(clock_in('kept'))
+        self.assertEqual(self.sub_tasks(), ['kept'])
+
+    def test_metrics_summary(self):
+        self.queue.commit(clock_in('a'))
+        summary = self.queue.metrics.summary()
+        self.assertEqual((summary['writes'], summary['groups'],
+                          summary['largest_group']), (1, 1, 1))
+        self.assertGreater(summary['ack_max_ms'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import uuid
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backup import BackupStore
+from journal import ChangeJournal
+from models import Base, Clocktime, Job
+
+
+class TestChangeJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmpdir, 'test.db')
+        self.engine = create_engine('sqlite:///{}'.format(self.db))
+        Base.metadata.create_all(self.engine)
+        self.store = BackupStore(os.path.join(self.tmpdir, '.backup'))
+        self.journal = ChangeJournal(
+            os.path.join(self.tmpdir, '.backup', 'journal.jsonl'),
+            [Clocktime.__table__, Job.__table__])
+        self.journal.install(self.engine)
+        DBSession = sessionmaker(bind=self.engine)
+        self.journal.attach(DBSession, self.db)
+        self.session = DBSession()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def punch(self, task):
+        self.session.add(Clocktime(p_uuid=uuid.uuid4(),
+                                   time_in=datetime.now(), sub_task=task))
+        self.session.commit()
+        time.sleep(0.01)
+
+    def tasks(self):
+        conn = sqlite3.connect(self.db)
+        try:
+            return [r[0] for r in conn.execute(
+                'SELECT sub_task FROM clocktimes ORDER BY id')]
+        finally:
+            conn.close()
+
+    def test_install_keeps_journal_mode(self):
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(
+                'PRAGMA journal_mode').scalar(), 'delete')
+
+    def test_commits_are_archived(self):
+        self.punch('one')
+        job = Job(name='Python Time', abbr='PYTIME', rate=20000)
+        self.session.add(job)
+        self.session.commit()
+        job.rate = 100
+        self.session.commit()
+        records = self.journal.records()
+        self.assertEqual([(r['table'], r['op']) for r in records],
+                         [('clocktimes', 'insert'), ('jobs', 'insert'),
+                          ('jobs', 'update')])
+        self.assertEqual(records[-1]['row']['rate'], 100)
+
+    def test_recover_to_point_in_time(self):
+        """Snapshot plus replay rebuilds any moment after the snapshot"""
+        self.punch('one')
+        time.sleep(1)  # snapshots are stamped to the second
+        self.store.snapshot(self.db, 'base')
+        self.punch('two')
+        middle = datetime.now()
+        time.sleep(0.01)
+        self.punch('three')
+        self.session.query(Clocktime).filter(
+            Clocktime.sub_task == 'one').delete()
+        self.session.commit()
+        self.session.close()
+        self.engine.dispose()
+
+        _, replayed = self.journal.recover(self.store, self.db, until=middle)
+        self.assertEqual(self.tasks(), ['one', 'two'])
+        self.assertTrue(replayed >= 1)
+
+        # A change after the recovery, then a second recovery to now:
+        # what the first discarded stays discarded.
+        self.engine = create_engine('sqlite:///{}'.format(self.db))
+        DBSession = sessionmaker(bind=self.engine)
+        self.journal.attach(DBSession, self.db)
+        self.session = DBSession()
+        self.punch('four')
+        self.session.close()
+        self.engine.dispose()
+
+        self.journal.recover(self.store, self.db)
+        self.assertEqual(self.tasks(), ['one', 'two', 'four'])
+        conn = sqlite3.connect(self.db)
+        try:
+            self.assertEqual(set(conn.execute(
+                'SELECT typeof(p_uuid), length(p_uuid) FROM clocktimes')),
+                {('blob', 16)})
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest
+import uuid
+
+from sqlalchemy import create_engine, inspect
+
+from migrations import MIGRATIONS, Change, upgrade
+from sqa_uuid import KEY_NAMESPACE
+
+# Schema of a database created before any index was declared.
+OLD_SCHEMA = [
+    "CREATE TABLE employees (id INTEGER PRIMARY KEY, firstname VARCHAR(50), "
+    "lastname VARCHAR(50))",
+    "CREATE TABLE jobs (id INTEGER PRIMARY KEY, p_uuid VARCHAR, "
+    "name VARCHAR(50), abbr VARCHAR(16), rate INTEGER)",
+    "CREATE TABLE clocktimes (id INTEGER PRIMARY KEY, p_uuid VARCHAR, "
+    "time_in DATETIME, time_out DATETIME, sub_task VARCHAR(20), "
+    "employee_id INTEGER REFERENCES employees (id), "
+    "job_id INTEGER REFERENCES jobs (id), tworked FLOAT)",
+    "CREATE TABLE timesheet (id INTEGER PRIMARY KEY, p_uuid VARCHAR, "
+    "name VARCHAR(50), abbr VARCHAR(16), rate INTEGER, worked FLOAT, "
+    "date DATETIME, week VARCHAR(10))",
+]
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///')
+        with self.engine.begin() as conn:
+            for statement in OLD_SCHEMA:
+                conn.exec_driver_sql(statement)
+
+    def indexed_columns(self, table):
+        return set(tuple(ix['column_names'])
+                   for ix in inspect(self.engine).get_indexes(table))
+
+    def test_upgrade_adds_indexes(self):
+        upgrade(self.engine, pause=0)
+        self.assertIn(('abbr',), self.indexed_columns('jobs'))
+        self.assertIn(('p_uuid',), self.indexed_columns('timesheet'))
+        self.assertIn(('p_uuid',), self.indexed_columns('jobs'))
+        self.assertIn(('time_in',), self.indexed_columns('clocktimes'))
+        self.assertIn(('week_key',), self.indexed_columns('timesheet'))
+
+    def test_upgrade_adds_columns(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO timesheet (p_uuid, date) "
+                "VALUES ('a', '2016-03-07 09:00:00.000000')")
+        upgrade(self.engine, pause=0)
+        columns = [c['name'] for c in inspect(self.engine)
+                   .get_columns('timesheet')]
+        self.assertIn('modified', columns)
+        with self.engine.connect() as conn:
+            self.assertEqual(tuple(conn.exec_driver_sql(
+                "SELECT modified, week_key FROM timesheet").one()),
+                ('2016-03-07 09:00:00.000000', 201610))
+
+    def test_upgrade_converts_hours(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO clocktimes (p_uuid, time_in, tworked) "
+                "VALUES ('a', '2016-03-07 09:00:00.000000', 0.30000000000000004)")
+            conn.exec_driver_sql(
+                "INSERT INTO timesheet (p_uuid, abbr, worked, date) "
+                "VALUES ('a', 'PYTIME', 1.7, '2016-03-07 09:00:00.000000')")
+        upgrade(self.engine, pause=0)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT tenths FROM clocktimes").scalar(), 3)
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT tenths FROM timesheet").scalar(), 17)
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT tenths, punches FROM daily_rollup").one(), (3, 1))
+
+    def test_upgrade_converts_uuids(self):
+        key = uuid.uuid4()
+        with self.engine.begin() as conn:
+            for p_uuid in (str(key), str(key), 'k1', ''):
+                conn.exec_driver_sql(
+                    "INSERT INTO clocktimes (p_uuid) VALUES (?)", (p_uuid,))
+        upgrade(self.engine, pause=0)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT p_uuid FROM clocktimes ORDER BY id").scalars().all(),
+                [key.bytes, key.bytes,
+                 uuid.uuid5(KEY_NAMESPACE, 'k1').bytes, None])
+
+    def test_upgrade_is_repeatable(self):
+        upgrade(self.engine, pause=0)
+        self.assertEqual(upgrade(self.engine, pause=0), [])
+
+    def test_upgrade_records_versions(self):
+        upgrade(self.engine, pause=0)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT version FROM schema_version ORDER BY version")
+                .scalars().all(), [m.version for m in MIGRATIONS])
+
+    def test_backfills_in_batches(self):
+        with self.engine.begin() as conn:
+            for i in range(7):
+                conn.exec_driver_sql(
+                    "INSERT INTO clocktimes (p_uuid, time_in, tworked) "
+                    "VALUES (?, '2016-03-07 09:00:00', 0.5)",
+                    (str(uuid.uuid4()),))
+        changes = upgrade(self.engine, batch=3, pause=0)
+        self.assertIn(Change(1, 'backfill_tenths', 7), changes)
+        self.assertIn(Change(2, 'convert_uuids', 7), changes)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT count(*) FROM clocktimes WHERE tenths = 5 "
+                "AND typeof(p_uuid) = 'blob'").scalar(), 7)
+
+    def test_backfill_skips_unfillable_rows(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO jobs (abbr) VALUES ('PYTIME')")
+            for i in range(7):
+                conn.exec_driver_sql(
+                    "INSERT INTO timesheet (p_uuid, abbr) VALUES (?, ?)",
+                    ('k{}'.format(i), 'PYTIME' if i % 2 else 'NOJOB'))
+                conn.exec_driver_sql(
+                    "INSERT INTO clocktimes (p_uuid) VALUES (?)",
+                    ('k{}'.format(i),))
+        changes = upgrade(self.engine, batch=2, pause=0)
+        self.assertIn(Change(5, 'backfill_clocktime_jobs', 3), changes)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(
+                "SELECT job_id FROM clocktimes ORDER BY id").scalars().all(),
+                [None, 1, None, 1, None, 1, None])
+
+    def test_dry_run(self):
+        with self.engine.begin() as conn:
+            for hours in (0.5, 1.0, None):
+                conn.exec_driver_sql(
+                    "INSERT INTO clocktimes (p_uuid, time_out, tworked) "
+                    "VALUES ('a', '2016-03-07 09:00:00', ?)", (hours,))
+        changes = upgrade(self.engine, dry_run=True)
+        self.assertIn(Change(None, 'add column clocktimes.tenths', 0),
+                      changes)
+        self.assertIn(Change(None, 'create index ix_clocktimes_time_in', 3),
+                      changes)
+        self.assertIn(Change(1, 'backfill_tenths', 2), changes)
+        self.assertIn(Change(2, 'convert_uuids', 3), changes)
+        self.assertIn(Change(3, 'populate_rollups', 3), changes)
+        self.assertNotIn('tenths', [c['name'] for c in inspect(self.engine)
+                                    .get_columns('clocktimes')])
+
+    def test_new_database(self):
+        engine = create_engine('sqlite:///')
+        changes = upgrade(engine, pause=0)
+        self.assertEqual([c.rows for c in changes if c.version],
+                         [0] * len(MIGRATIONS))
+        self.assertEqual(upgrade(engine, dry_run=True), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
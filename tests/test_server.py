@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.orm import Session
+
+from connection import make_engine
+from migrations import upgrade
+from models import Clocktime, DailyRollup, Employee, Job, Timesheet
+from server import Server
+from server.loadgen import Client, shift_change
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.engine = make_engine(os.path.join(self.tmpdir, 'test.db'))
+        upgrade(self.engine, pause=0)
+        with Session(self.engine) as session:
+            session.add_all(Employee(firstname='Emp', lastname=str(i))
+                            for i in range(20))
+            session.add(Job(name='Pytime', abbr='PYTIME', rate=0))
+            session.commit()
+
+        self.server = Server(self.engine, port=0)
+        await self.server.start()
+        self.client = Client(port=self.server.port)
+        await self.client.connect()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.stop()
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def clock_in(self, employee_id, abbr='PYTIME'):
+        return self.client.request('POST', '/clockin', {
+            'employee_id': employee_id, 'abbr': abbr, 'sub_task': 'docs'})
+
+    def clock_out(self, employee_id):
+        return self.client.request('POST', '/clockout',
+                                   {'employee_id': employee_id})
+
+    async def test_clock_in_and_out(self):
+        status, reply = await self.clock_in(1)
+        self.assertEqual((status, reply['abbr']), (200, 'PYTIME'))
+        status, reply = await self.client.request('GET',
+                                                  '/status?employee_id=1')
+        self.assertEqual((reply['clocked_in'], reply['sub_task']),
+                         (True, 'docs'))
+
+        status, reply = await self.clock_out(1)
+        self.assertEqual((status, reply['tenths']), (200, 1))
+        status, reply = await self.client.request('GET',
+                                                  '/status?employee_id=1')
+        self.assertFalse(reply['clocked_in'])
+
+        with Session(self.engine) as session:
+            clocktime = session.query(Clocktime).one()
+            self.assertEqual((clocktime.employee_id, clocktime.tenths), (1, 1))
+            self.assertEqual(session.query(Timesheet.tenths).scalar(), 1)
+            self.assertEqual(session.query(DailyRollup.punches).scalar(), 1)
+
+    async def test_refused_punches(self):
+        self.assertEqual((await self.clock_out(1))[0], 409)
+        self.assertEqual((await self.clock_in(1, 'NOJOB'))[0], 404)
+        self.assertEqual((await self.clock_in(99))[0], 404)
+        self.assertEqual((await self.clock_in(1))[0], 200)
+        self.assertEqual((await self.clock_in(1))[0], 409)
+        self.assertEqual((await self.client.request(
+            'POST', '/clockin', {'abbr': 'PYTIME'}))[0], 400)
+        self.assertEqual((await self.client.request('GET', '/clockin'))[0],
+                         405)
+        self.assertEqual((await self.client.request('GET', '/nothing'))[0],
+                         404)
+
+    async def test_report(self):
+        for employee_id in (1, 2):
+            await self.clock_in(employee_id)
+            await self.clock_out(employee_id)
+        status, reply = await self.client.request(
+            'GET', '/report?start=2000-01-01&employee_id=2')
+        self.assertEqual(status, 200)
+        self.assertEqual([row['abbr'] for row in reply['rows']], ['PYTIME'])
+        self.assertEqual(reply['tenths'], 1)
+        status, reply = await self.client.request(
+            'GET', '/report?start=2000-01-01')
+        self.assertEqual(reply['tenths'], 2)
+        # No range: this week's, which has today's punches.
+        status, reply = await self.client.request('GET', '/report')
+        self.assertEqual((status, reply['tenths']), (200, 2))
+
+    async def test_groups_concurrent_punches(self):
+        result = await shift_change(port=self.server.port, employees=20,
+                                    clients=20, rounds=2, abbr='PYTIME')
+        self.assertEqual((result.punches, result.errors), (80, 0))
+        status, metrics = await self.client.request('GET', '/metrics')
+        self.assertEqual(metrics['writes'], 80)
+        self.assertLess(metrics['groups'], 80)
+        with Session(self.engine) as session:
+            self.assertEqual(session.query(Clocktime).filter(
+                Clocktime.tenths.isnot(None)).count(), 40)
+
+    async def test_restart_keeps_open_shifts(self):
+        await self.clock_in(3)
+        server = Server(self.engine, port=0)
+        await server.start()
+        try:
+            self.assertIn(3, server.writer.open)
+        finally:
+            await server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
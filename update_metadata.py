@@ -1,7 +1,32 @@
-from sqlalchemy import create_engine
-from models import Employee, Job, Clocktime, Base
+import argparse
+import os
+import sys
+
+from connection import make_engine
+from migrations import BATCH, upgrade
 from tc import DB_NAME
 
-engine = create_engine('sqlite:///{}'.format(DB_NAME))
+parser = argparse.ArgumentParser(
+    description="Bring {} up to date with the models".format(DB_NAME))
+parser.add_argument('--dry-run', action='store_true',
+                    help="only report what would change, and roughly how "
+                         "many rows")
+parser.add_argument('--batch', type=int, default=BATCH,
+                    help="rows per backfill transaction (default %(default)s)")
+args = parser.parse_args()
+
+if args.dry_run:
+    # Read-only, so a dry run neither creates the file nor sets its
+    # journal mode.
+    if not os.path.isfile(DB_NAME):
+        sys.exit("No {} to check.".format(DB_NAME))
+    engine = make_engine(DB_NAME, readonly=True)
+else:
+    engine = make_engine(DB_NAME)
 
-Base.metadata.create_all(engine)
+changes = upgrade(engine, dry_run=args.dry_run, batch=args.batch)
+for change in changes:
+    print("{:>4} {:<40} {:>10} rows".format(
+        change.version or '', change.name, change.rows))
+if not changes:
+    print("Up to date.")